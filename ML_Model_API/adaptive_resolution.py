@@ -0,0 +1,273 @@
+"""
+Load-adaptive input resolution: trade a little accuracy for latency under overload
+MobileNetV2 is fully convolutional up to a global average pool, so the same weights can
+classify 192px or 160px inputs. Compute scales with the pixel count, so 160px needs about
+half the work of 224px. When the inference queue backs up, or request latency breaks the
+SLO, the serving path steps down one resolution at a time. It steps back up once pressure
+has stayed low for a while. The two thresholds and the dwell times (hysteresis) stop it
+flapping between modes.
+
+The variants and their accuracy cost are measured offline on the val split:
+    python adaptive_resolution.py calibrate dataset_split/val --model best_mobilenetv2.bundle
+This writes resolution_calibration.json, keyed by the model's content hash. At startup
+the server serves only the resolutions whose accuracy drop is within --max-drop.
+Resolutions the file has no results for are not served. Without a calibration for the
+deployed weights (no file, or one measured before a retrain), only the full resolution is
+served, unless ADAPTIVE_UNCALIBRATED=1 opts in to the untested variants. Both cases log a
+warning.
+
+Environment:
+    ADAPTIVE_RESOLUTIONS    candidate input sides, largest first (default 224,192,160;
+                            a single value disables switching)
+    RESOLUTION_CALIBRATION  calibration file (default resolution_calibration.json)
+    ADAPTIVE_QUEUE_HIGH     queued images that trigger a step down (app.py default: request threads - 1)
+    ADAPTIVE_QUEUE_LOW      queued images allowed while stepping back up (default 2)
+    LATENCY_SLO_MS          target for queue wait + inference; a moving average above it
+                            steps down (default 500)
+    ADAPTIVE_UP_SECONDS     calm time required before each step up (default 10)
+    ADAPTIVE_UNCALIBRATED   1 serves every candidate resolution without a calibration (default 0)
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_RESOLUTIONS = [int(r) for r in os.getenv('ADAPTIVE_RESOLUTIONS', '224,192,160').split(',') if r.strip()]
+RESOLUTION_CALIBRATION = os.getenv('RESOLUTION_CALIBRATION', 'resolution_calibration.json')
+ADAPTIVE_QUEUE_LOW = int(os.getenv('ADAPTIVE_QUEUE_LOW', 2))
+LATENCY_SLO_MS = float(os.getenv('LATENCY_SLO_MS', 500))
+ADAPTIVE_UP_SECONDS = float(os.getenv('ADAPTIVE_UP_SECONDS', 10))
+ADAPTIVE_UNCALIBRATED = os.getenv('ADAPTIVE_UNCALIBRATED', '0') == '1'
+# A step down needs this long to show its effect before the next one
+DOWN_SECONDS = 1.0
+# Latency counts as recovered below this fraction of the SLO
+RECOVER_FRACTION = 0.5
+LATENCY_ALPHA = 0.2
+
+
+def model_hash(path):
+    """Content hash of a model file: the bundle's recorded content_hash, else sha256 of the file"""
+    import hashlib
+    import model_bundle
+
+    if model_bundle.is_bundle(path):
+        return model_bundle.read_header(path)[0]['metadata']['content_hash']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def load_calibration(path=RESOLUTION_CALIBRATION, model_hash=None):
+    """Calibration dict, or None when there is no file or it was measured for other weights"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        calibration = json.load(f)
+    if model_hash and calibration.get('model_hash') != model_hash:
+        logger.warning(f"{path} was calibrated for {calibration.get('model')} "
+                       f"({calibration.get('model_hash', 'no hash recorded')}), not the deployed weights "
+                       f"({model_hash}); ignoring it")
+        return None
+    return calibration
+
+
+class ResolutionController:
+    """Current serving resolution, stepped by queue depth and latency with hysteresis"""
+
+    def __init__(self, resolutions=None, calibration=None, queue_high=8,
+                 queue_low=ADAPTIVE_QUEUE_LOW, slo_ms=LATENCY_SLO_MS, up_seconds=ADAPTIVE_UP_SECONDS,
+                 uncalibrated=ADAPTIVE_UNCALIBRATED):
+        resolutions = sorted(set(resolutions or ADAPTIVE_RESOLUTIONS), reverse=True)
+        self.calibration = calibration
+        if calibration is None and len(resolutions) > 1:
+            if uncalibrated:
+                logger.warning(f"Serving {resolutions}px without a calibration (ADAPTIVE_UNCALIBRATED=1); "
+                               f"their accuracy cost is unmeasured")
+            else:
+                logger.warning(f"No resolution calibration for this model; serving only {resolutions[0]}px "
+                               f"(run: python adaptive_resolution.py calibrate <val_dir>)")
+                resolutions = resolutions[:1]
+        if calibration is not None:
+            # Only the variants that passed calibration; the full resolution always stays
+            measured = {int(r) for r in calibration.get('results', {})}
+            if resolutions[0] not in measured:
+                logger.warning(f"Calibration has no results at the full {resolutions[0]}px; "
+                               f"its accuracy drops are relative to {max(measured, default=None)}px")
+            unmeasured = [r for r in resolutions[1:] if r not in measured]
+            if unmeasured:
+                logger.warning(f"No calibration results for {unmeasured}px (measured: {sorted(measured)}); "
+                               f"not serving them")
+            allowed = set(calibration.get('serve', ())) & measured
+            resolutions = [r for i, r in enumerate(resolutions) if i == 0 or r in allowed]
+        self.resolutions = resolutions
+        self.queue_high = queue_high
+        self.queue_low = queue_low
+        self.slo_ms = slo_ms
+        self.up_seconds = up_seconds
+        self._level = 0
+        self._latency_ms = None
+        self._observed = 0.0
+        self._changed = time.monotonic()
+        self._calm_since = None
+        self._lock = threading.Lock()
+        self._served = {r: 0 for r in resolutions}
+        self._seconds = {r: 0.0 for r in resolutions}
+        self._changes = 0
+
+    @property
+    def full(self):
+        return self.resolutions[0]
+
+    def select(self, queued):
+        """Resolution for a request arriving with `queued` images waiting for inference"""
+        now = time.monotonic()
+        with self._lock:
+            # With no model runs for a while (idle, or all cache hits) the average is stale
+            fresh = now - self._observed < self.up_seconds
+            latency = (self._latency_ms or 0.0) if fresh else 0.0
+            overloaded = queued >= self.queue_high or latency > self.slo_ms
+            calm = queued <= self.queue_low and latency < self.slo_ms * RECOVER_FRACTION
+            if overloaded:
+                self._calm_since = None
+                if self._level < len(self.resolutions) - 1 and now - self._changed >= DOWN_SECONDS:
+                    self._step(+1, now)
+            elif calm and self._level > 0:
+                self._calm_since = self._calm_since or now
+                if now - self._calm_since >= self.up_seconds and now - self._changed >= self.up_seconds:
+                    self._step(-1, now)
+                    self._calm_since = now
+            else:
+                self._calm_since = None
+            resolution = self.resolutions[self._level]
+            self._served[resolution] += 1
+            return resolution
+
+    def observe(self, latency_ms):
+        """
+        Feed back queue wait + inference time of a request that ran the model
+        Upload and decode time are left out: a smaller input cannot shorten them
+        """
+        with self._lock:
+            self._observed = time.monotonic()
+            if self._latency_ms is None:
+                self._latency_ms = latency_ms
+            else:
+                self._latency_ms += LATENCY_ALPHA * (latency_ms - self._latency_ms)
+
+    def _step(self, direction, now):
+        self._seconds[self.resolutions[self._level]] += now - self._changed
+        self._level += direction
+        self._changed = now
+        self._changes += 1
+        # Latency measured in the old mode says little about the new one
+        self._latency_ms = None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            resolution = self.resolutions[self._level]
+            seconds = dict(self._seconds)
+            seconds[resolution] += now - self._changed
+            report = {
+                'mode': 'full' if self._level == 0 else 'degraded',
+                'resolution': resolution,
+                'resolutions': self.resolutions,
+                'latency_ewma_ms': round(self._latency_ms, 2) if self._latency_ms is not None else None,
+                'slo_ms': self.slo_ms,
+                'queue_high': self.queue_high,
+                'queue_low': self.queue_low,
+                'changes': self._changes,
+                'served': {str(r): n for r, n in self._served.items()},
+                'seconds_in_mode': {str(r): round(s, 1) for r, s in seconds.items()},
+            }
+            if self.calibration is not None:
+                results = self.calibration.get('results', {})
+                report['accuracy'] = {str(r): results.get(str(r), {}).get('accuracy')
+                                      for r in self.resolutions}
+            return report
+
+
+# ================================
+# Offline calibration
+# ================================
+def calibrate(model, split_dir, resolutions, batch_size=64, workers=None, latency_runs=30):
+    """Val accuracy and batch-1 latency of the same model at each input resolution"""
+    import torch
+    import data_pipeline
+    import evaluate
+    import prune
+
+    results = {}
+    for resolution in resolutions:
+        dataset = data_pipeline.open_split(split_dir, transform=data_pipeline.build_transforms(resolution)['test'])
+        loader = data_pipeline.build_dataloader(dataset, batch_size, num_workers=workers)
+        report = evaluate.evaluate(model, loader, torch.device('cpu'), len(dataset.classes), dataset.classes)
+        results[str(resolution)] = {
+            'accuracy': report['accuracy'],
+            'top3_accuracy': report.get('top3_accuracy'),
+            'expected_calibration_error': report['expected_calibration_error'],
+            'latency_ms': prune.measure_latency(model, resolution, runs=latency_runs),
+        }
+        print(f"  {resolution}px: accuracy {report['accuracy']:.4f}, "
+              f"{results[str(resolution)]['latency_ms']:.2f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate serving resolutions on a validation split")
+    sub = parser.add_subparsers(dest='command', required=True)
+    cal = sub.add_parser('calibrate', help="measure accuracy and latency per resolution")
+    cal.add_argument('split_dir', help="val split (ImageFolder or shards)")
+    cal.add_argument('--model', default='best_mobilenetv2.bundle')
+    cal.add_argument('--resolutions', default=','.join(str(r) for r in ADAPTIVE_RESOLUTIONS))
+    cal.add_argument('--max-drop', type=float, default=0.03,
+                     help="largest accuracy loss (absolute) a served resolution may cost")
+    cal.add_argument('--batch-size', type=int, default=64)
+    cal.add_argument('--workers', type=int, default=None)
+    cal.add_argument('--output', default=RESOLUTION_CALIBRATION)
+    args = parser.parse_args()
+
+    import torch
+    import evaluate
+
+    resolutions = sorted({int(r) for r in args.resolutions.split(',')}, reverse=True)
+    model, _ = evaluate.load_model(args.model, torch.device('cpu'))
+
+    print(f"\n{'='*60}")
+    print(f"Calibrating {args.model} at {resolutions} on {args.split_dir}")
+    print(f"{'='*60}")
+    results = calibrate(model, args.split_dir, resolutions, args.batch_size, args.workers)
+
+    full = results[str(resolutions[0])]
+    serve = []
+    for resolution in resolutions:
+        entry = results[str(resolution)]
+        entry['accuracy_drop'] = full['accuracy'] - entry['accuracy']
+        entry['speedup'] = full['latency_ms'] / entry['latency_ms']
+        if entry['accuracy_drop'] <= args.max_drop:
+            serve.append(resolution)
+
+    calibration = {'model': args.model, 'model_hash': model_hash(args.model), 'split': args.split_dir,
+                   'max_drop': args.max_drop, 'serve': serve, 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, indent=2)
+
+    print(f"\n{'resolution':<12}{'accuracy':>10}{'drop':>9}{'latency ms':>12}{'speedup':>9}")
+    for resolution in resolutions:
+        entry = results[str(resolution)]
+        marker = '' if resolution in serve else '  (over --max-drop, not served)'
+        print(f"{resolution:<12}{entry['accuracy']:>10.4f}{entry['accuracy_drop']:>+9.4f}"
+              f"{entry['latency_ms']:>12.2f}{entry['speedup']:>8.2f}x{marker}")
+    print(f"\n✅ Wrote {args.output}; serving {serve}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,30 @@
 import os
+import time
+import hmac
+import hashlib
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 import torch
 import torch.nn as nn
 from torchvision import transforms, models
 from PIL import Image
-import io
-import base64
 import requests
-from io import BytesIO
+from datetime import datetime
+import threading_config
+import image_ingest
+import prediction_log
+import drift_monitor
+import embedding_index
+import phash
+import profiling
+import model_bundle
+import scheduler
+import tiling
+import traffic_capture
+import adaptive_resolution
+import gradcam
+from feature_tap import FeatureTap
 
 # Configure logging for production
 logging.basicConfig(
@@ -19,14 +34,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Bounded, single-copy request bodies (see image_ingest.py); larger requests get a 413
+app.request_class = image_ingest.IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = image_ingest.MAX_REQUEST_BYTES
 
 # CORS Configuration - Allow all origins for development/production
 CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Debug-Timing", "X-API-Key", "X-Priority"],
+        "expose_headers": ["Content-Type", "X-Debug-Timing", "Server-Timing"],
         "supports_credentials": False
     }
 })
@@ -36,21 +54,26 @@ MODEL_PATH = os.getenv('MODEL_PATH', 'best_mobilenetv2.pth')
 DATA_DIR = os.getenv('DATA_DIR', None)  # Optional dataset directory
 CLASS_NAMES_FILE = os.getenv('CLASS_NAMES_FILE', 'class_names.txt')
 PORT = int(os.getenv('PORT', 5000))
+PREDICTION_LOG_ENABLED = os.getenv('PREDICTION_LOG', '1') != '0'
+DRIFT_REFERENCE = os.getenv('DRIFT_REFERENCE', 'drift_reference.npz')
+DRIFT_WINDOW_SECONDS = int(os.getenv('DRIFT_WINDOW_SECONDS', 3600))
+EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', 'embedding_index')
+MAX_SIMILAR = 50
+# Near-duplicate short-circuit: uploads within PHASH_MAX_DISTANCE bits of a recent one reuse its result
+PHASH_CACHE_SIZE = int(os.getenv('PHASH_CACHE_SIZE', 4096))
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 4))
+# /admin/* is disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Endpoints whose forward pass goes through the priority scheduler
+INFERENCE_ENDPOINTS = ('predict', 'embed', 'similar', 'explain')
 
-# Auto-detect number of classes from model
-def detect_num_classes():
-    """Detect number of classes from the saved model"""
-    try:
-        state_dict = torch.load(MODEL_PATH, map_location='cpu', weights_only=False)
-        classifier_weight = state_dict['classifier.1.weight']
-        num_classes = classifier_weight.shape[0]
-        logger.info(f"Detected {num_classes} classes from model")
-        return num_classes
-    except Exception as e:
-        logger.error(f"Could not auto-detect classes: {e}")
-        return 97  # Default fallback
+# Size torch's thread pools to this worker's share of the CPU before any inference runs
+threading_config.configure_torch_threads()
 
-def load_class_names():
+device = torch.device('cpu')  # Force CPU for deployment stability
+
+def load_class_names(num_classes):
     """Load class names from file (production) or dataset directory (development)"""
     # Priority 1: Load from class_names.txt file (for production deployment)
     if os.path.exists(CLASS_NAMES_FILE):
@@ -85,78 +108,307 @@ def load_class_names():
     
     # Priority 3: Fallback to generic class names
     logger.warning("Using fallback class names")
-    num_classes = detect_num_classes()
     return [f"Class_{i}" for i in range(num_classes)]
 
-NUM_CLASSES = detect_num_classes()
-CLASS_NAMES = load_class_names()
-
-# Validate class names match model
-if len(CLASS_NAMES) != NUM_CLASSES:
-    logger.warning(f"CLASS_NAMES count ({len(CLASS_NAMES)}) doesn't match NUM_CLASSES ({NUM_CLASSES})")
-    if len(CLASS_NAMES) > NUM_CLASSES:
-        CLASS_NAMES = CLASS_NAMES[:NUM_CLASSES]
-        logger.info(f"Trimmed to first {NUM_CLASSES} class names")
-    else:
-        CLASS_NAMES = CLASS_NAMES + [f"Class_{i}" for i in range(len(CLASS_NAMES), NUM_CLASSES)]
-        logger.info(f"Added generic names for remaining classes")
-
-# Image preprocessing pipeline (matching training pipeline)
-image_transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
 # Initialize model architecture (MobileNetV2)
-def create_model():
+def create_model(num_classes):
     """Create MobileNetV2 model with modified classifier"""
     model = models.mobilenet_v2(weights=None)  # Updated API - no pretrained parameter
     num_features = model.classifier[1].in_features
-    model.classifier[1] = nn.Linear(num_features, NUM_CLASSES)
+    model.classifier[1] = nn.Linear(num_features, num_classes)
     return model
 
+def load_legacy_model():
+    """Plain state dict plus class_names.txt; the class count is read from the classifier weights"""
+    state_dict = torch.load(MODEL_PATH, map_location=device, weights_only=False)
+    num_classes = state_dict['classifier.1.weight'].shape[0]
+    logger.info(f"Detected {num_classes} classes from model")
+    model = create_model(num_classes)
+    model.load_state_dict(state_dict)
+
+    class_names = load_class_names(num_classes)
+    # Validate class names match model
+    if len(class_names) != num_classes:
+        logger.warning(f"CLASS_NAMES count ({len(class_names)}) doesn't match NUM_CLASSES ({num_classes})")
+        if len(class_names) > num_classes:
+            class_names = class_names[:num_classes]
+            logger.info(f"Trimmed to first {num_classes} class names")
+        else:
+            class_names = class_names + [f"Class_{i}" for i in range(len(class_names), num_classes)]
+            logger.info(f"Added generic names for remaining classes")
+    return model, class_names
+
 # Load model once at startup
 logger.info("Loading MobileNetV2 model...")
-device = torch.device('cpu')  # Force CPU for deployment stability
-model = create_model()
-
 try:
     if not os.path.exists(MODEL_PATH):
         raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
     
-    model.load_state_dict(torch.load(MODEL_PATH, map_location=device, weights_only=False))
+    if model_bundle.is_bundle(MODEL_PATH):
+        # Self-describing bundle: weights are mapped zero-copy and shared between workers,
+        # and the class table and preprocessing ship with them
+        model, bundle_metadata = model_bundle.load_model(MODEL_PATH, device)
+        CLASS_NAMES = bundle_metadata['class_names']
+        PREPROCESSING = bundle_metadata['preprocessing']
+    else:
+        bundle_metadata = None
+        model, CLASS_NAMES = load_legacy_model()
+        PREPROCESSING = model_bundle.DEFAULT_PREPROCESSING
+    NUM_CLASSES = len(CLASS_NAMES)
     model.to(device)
     model.eval()  # Set to evaluation mode
-    logger.info(f"✓ Model loaded successfully from {MODEL_PATH}")
+    logger.info(f"✓ Model loaded successfully from {MODEL_PATH} ({NUM_CLASSES} classes)")
 except Exception as e:
     logger.error(f"✗ Error loading model: {e}")
     raise
 
+# Image preprocessing pipeline (matching training pipeline)
+image_resize = transforms.Resize(tuple(PREPROCESSING['resize']),
+                                 interpolation=transforms.InterpolationMode(PREPROCESSING['interpolation']))
+image_to_tensor = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(mean=PREPROCESSING['mean'], std=PREPROCESSING['std'])
+])
+image_transform = transforms.Compose([image_resize, image_to_tensor])
+
+# Smaller inputs served under overload (see adaptive_resolution.py); the bundle's size is the full mode
+FULL_RESOLUTION = max(PREPROCESSING['resize'])
+input_sizes = {
+    r: tuple(round(side * r / FULL_RESOLUTION) for side in PREPROCESSING['resize'])
+    for r in [FULL_RESOLUTION] + [r for r in adaptive_resolution.ADAPTIVE_RESOLUTIONS if r < FULL_RESOLUTION]
+}
+image_resizes = {
+    r: transforms.Resize(size, interpolation=transforms.InterpolationMode(PREPROCESSING['interpolation']))
+    for r, size in input_sizes.items()
+}
+image_resizes[FULL_RESOLUTION] = image_resize
+
+def compute_model_version():
+    """Short content hash of the weights, so logged predictions can be tied to a model"""
+    if bundle_metadata is not None:
+        return f"{os.path.basename(MODEL_PATH)}:{bundle_metadata['content_hash'].split(':')[-1][:12]}"
+    digest = hashlib.sha256()
+    with open(MODEL_PATH, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{os.path.basename(MODEL_PATH)}:{digest.hexdigest()[:12]}"
+
+MODEL_VERSION = os.getenv('MODEL_VERSION') or compute_model_version()
+
+# Per-request stage timings, in the order they happen
+STAGES = ('read', 'preprocess', 'queue', 'inference', 'postprocess', 'total')
+prediction_logger = prediction_log.PredictionLog(
+    num_classes=NUM_CLASSES, model_version=MODEL_VERSION, stages=STAGES
+) if PREDICTION_LOG_ENABLED else None
+
+# Penultimate-layer features of each request's forward pass, for drift monitoring and similarity search
+feature_tap = FeatureTap(model)
+drift_reference = None
+if os.path.exists(DRIFT_REFERENCE):
+    drift_reference = drift_monitor.load_reference(DRIFT_REFERENCE)
+    logger.info(f"✓ Loaded drift reference profile from {DRIFT_REFERENCE}")
+else:
+    logger.warning(f"No drift reference at {DRIFT_REFERENCE}; drift scores disabled "
+                   f"(build one with: python drift_monitor.py build-reference <val_dir>)")
+drift = drift_monitor.DriftMonitor(NUM_CLASSES, model.last_channel, reference=drift_reference,
+                                   window_seconds=DRIFT_WINDOW_SECONDS)
+
+# Labelled reference images for "similar confirmed cases" (built by embedding_index.py)
+reference_index = None
+if os.path.exists(os.path.join(EMBEDDING_INDEX_DIR, embedding_index.META_FILE)):
+    reference_index = embedding_index.EmbeddingIndex(EMBEDDING_INDEX_DIR)
+    logger.info(f"✓ Loaded embedding index of {reference_index.count} reference images")
+
+profiler = profiling.Profiler(PROFILE_DIR)
+
+duplicate_cache = phash.NearDuplicateCache(PHASH_CACHE_SIZE, PHASH_MAX_DISTANCE) if PHASH_CACHE_SIZE > 0 else None
+
+# Opt-in capture of inference traffic for replay.py (CAPTURE_DIR, see traffic_capture.py)
+traffic = traffic_capture.TrafficCapture() if traffic_capture.CAPTURE_DIR else None
+if traffic is not None:
+    logger.info(f"✓ Capturing {traffic.sample_rate:.0%} of inference requests to {traffic.capture_dir}")
+
+def run_batch(images):
+    """One forward pass for a scheduler batch; (probabilities [C], embedding [D], feature map [D, H, W]) per image"""
+    with torch.no_grad():
+        with profiler.forward():
+            outputs = model(images.to(device))
+        probabilities = torch.nn.functional.softmax(outputs, dim=1)
+        return list(zip(probabilities, feature_tap.pooled(), feature_tap.features()))
+
+# Interactive requests go first; bulk fills idle time in larger batches (see scheduler.py).
+# Bulk requests may hold at most BULK_MAX_INFLIGHT request threads, leaving the rest for interactive.
+BULK_MAX_INFLIGHT = int(os.getenv('BULK_MAX_INFLIGHT',
+                                  max(1, threading_config.EFFECTIVE_SETTINGS['request_threads'] - 2)))
+inference_scheduler = scheduler.Scheduler(run_batch, bulk_max_inflight=BULK_MAX_INFLIGHT)
+# The forward pass runs on the scheduler thread, so profiles must sample it too
+profiler.add_thread(inference_scheduler.thread_ident)
+
+# Step the input resolution down when the interactive queue backs up or interactive latency
+# breaks the SLO; bulk backlog is the bulk lane's own business and must not degrade interactive.
+# The queue can only hold about one image per request thread, so the trigger scales with them.
+resolution_controller = adaptive_resolution.ResolutionController(
+    resolutions=list(input_sizes), calibration=adaptive_resolution.load_calibration(
+        model_hash=bundle_metadata['content_hash'] if bundle_metadata is not None
+        else adaptive_resolution.model_hash(MODEL_PATH)),
+    queue_high=int(os.getenv('ADAPTIVE_QUEUE_HIGH',
+                             max(2, threading_config.EFFECTIVE_SETTINGS['request_threads'] - 1))))
+if len(resolution_controller.resolutions) > 1:
+    logger.info(f"✓ Adaptive resolution: {resolution_controller.resolutions}")
+
+def infer_batch(images):
+    """Run images [N, ...] as one forward pass in this request's lane; returns (rows, batch_started)"""
+    return inference_scheduler.submit(
+        images, lane=g.get('lane', scheduler.INTERACTIVE), tenant=g.get('tenant', 'anonymous')).result()
+
+def infer(image_tensor):
+    """
+    Classify one preprocessed image in this request's lane
+    Returns (probabilities, embedding, feature_map, batch_started)
+    """
+    rows, batch_started = infer_batch(image_tensor)
+    probabilities, embedding, feature_map = rows[0]
+    return probabilities, embedding, feature_map, batch_started
+
 def download_image_from_url(image_url):
-    """Download image from URL (Cloudinary or any URL)"""
+    """Download image from URL (Cloudinary or any URL), refusing anything over MAX_IMAGE_BYTES"""
     try:
-        response = requests.get(image_url, timeout=10)
-        response.raise_for_status()
-        return response.content
+        with requests.get(image_url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            declared = response.headers.get('Content-Length')
+            image_ingest.check_declared_size(int(declared) if declared else None, image_ingest.MAX_IMAGE_BYTES)
+            return image_ingest.read_stream(response.raw, image_ingest.MAX_IMAGE_BYTES,
+                                            size_hint=int(declared) if declared else None)
+    except image_ingest.PayloadTooLarge:
+        raise
     except Exception as e:
         raise Exception(f"Failed to download image from URL: {str(e)}")
 
-def preprocess_image(image_bytes):
-    """Convert uploaded image bytes to preprocessed tensor"""
-    image = Image.open(io.BytesIO(image_bytes))
+def read_image_payload():
+    """
+    Pull the image out of the request without extra copies; returns (image_buffer, source_type)
+    Raw binary bodies and multipart parts land in one bounded buffer, base64 is decoded
+    incrementally, and URLs are downloaded with the same size limit.
+    """
+    content_type = (request.mimetype or '').lower()
+    image_ingest.check_declared_size(request.content_length, image_ingest.MAX_REQUEST_BYTES)
+
+    # Raw image body: no envelope to parse at all
+    if content_type == 'application/octet-stream' or content_type.startswith('image/'):
+        image_ingest.check_declared_size(request.content_length, image_ingest.MAX_IMAGE_BYTES)
+        return image_ingest.read_stream(request.stream, image_ingest.MAX_IMAGE_BYTES,
+                                        size_hint=request.content_length), 'binary'
+
+    if request.is_json:
+        body = image_ingest.read_stream(request.stream, image_ingest.MAX_REQUEST_BYTES,
+                                        size_hint=request.content_length)
+        data, image_bytes = image_ingest.parse_json_body(body)
+        if image_bytes is not None:
+            return image_bytes, 'base64'
+        data = data if isinstance(data, dict) else {}
+
+        # Cloudinary URL (from Node.js backend)
+        if 'imageUrl' in data:
+            image_url = data['imageUrl']
+            logger.info(f"📥 Downloading image from URL: {image_url[:50]}...")
+            return download_image_from_url(image_url), 'url'
+
+        # Base64 image (optionally a data URI)
+        if 'image' in data:
+            image_data = data['image'].encode('ascii')
+            if b',' in image_data[:256]:
+                image_data = image_data[image_data.index(b',') + 1:]
+            return image_ingest.decode_base64_into(image_data), 'base64'
+        return None, None
+
+    # Multipart/form-data upload, buffered by IngestRequest as it is parsed
+    for field in ('image', 'file'):
+        file = request.files.get(field)
+        if file is not None and file.filename != '':
+            return image_ingest.read_file_storage(file), 'file'
+    return None, None
+
+def preprocess_image(image_bytes, resolution=None):
+    """
+    Convert uploaded image bytes (bytes, bytearray or memoryview) to a preprocessed tensor
+    Returns (tensor [1, 3, 224, 224], original (width, height), perceptual hash or None);
+    a smaller resolution (e.g. 160) shrinks the tensor to [1, 3, 160, 160]
+    """
+    image = Image.open(image_ingest.open_buffer(image_bytes))
     
     # Convert to RGB if necessary (handles RGBA, grayscale, etc.)
     if image.mode != 'RGB':
         image = image.convert('RGB')
     
-    # Apply transformations
-    image_tensor = image_transform(image)
+    # The 224px thumbnail feeds both the model and the near-duplicate hash
+    thumbnail = image_resizes[resolution or FULL_RESOLUTION](image)
+    image_hash = phash.phash(thumbnail) if duplicate_cache is not None else None
+    image_tensor = image_to_tensor(thumbnail)
     
     # Add batch dimension [1, 3, 224, 224]
     image_tensor = image_tensor.unsqueeze(0)
     
-    return image_tensor
+    return image_tensor, image.size, image_hash
+
+@app.before_request
+def profile_request_start():
+    profiler.request_started()
+
+@app.before_request
+def start_capture():
+    if traffic is not None and request.endpoint in INFERENCE_ENDPOINTS and request.method == 'POST' \
+            and traffic.sampled():
+        g.capture_arrival, g.capture_started = time.time(), time.perf_counter()
+
+@app.before_request
+def admit_inference_request():
+    """
+    Pick the request's lane (X-Priority: bulk, or an API key in BULK_API_KEYS) and tenant (X-API-Key)
+    Bulk requests beyond this worker's bulk slots are refused with a 429 and Retry-After
+    """
+    if request.endpoint not in INFERENCE_ENDPOINTS or request.method == 'OPTIONS':
+        return None
+    g.lane, g.tenant = scheduler.classify(request.headers.get('X-API-Key'), request.headers.get('X-Priority'))
+    try:
+        inference_scheduler.admit(g.lane)
+    except scheduler.BulkBusy as e:
+        response = jsonify({'success': False, 'error': f'{e}; retry shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    g.admitted = True
+    return None
+
+@app.teardown_request
+def profile_request_end(exc):
+    profiler.request_finished()
+
+@app.teardown_request
+def release_inference_slot(exc):
+    if g.pop('admitted', False):
+        inference_scheduler.release(g.lane)
+
+@app.after_request
+def add_debug_timing(response):
+    """Stage breakdown inline when the client sends X-Debug-Timing: 1"""
+    timings = g.get('stage_timings')
+    if timings and request.headers.get('X-Debug-Timing', '').lower() in ('1', 'true'):
+        debug, standard = profiling.server_timing(timings)
+        response.headers['X-Debug-Timing'] = debug
+        response.headers['Server-Timing'] = standard
+    return response
+
+@app.after_request
+def capture_request(response):
+    """Trace line plus payload for sampled inference requests (pseudonymous tenant, image metadata stripped, written off-thread)"""
+    arrival = g.pop('capture_arrival', None)
+    if arrival is not None:
+        payload, source = g.get('payload', (None, None))
+        traffic.record(arrival, request.path, request.args.to_dict(), source,
+                       request.mimetype if source == 'binary' else None, payload,
+                       g.get('lane'), g.get('tenant'), response.status_code,
+                       (time.perf_counter() - g.capture_started) * 1000)
+    return response
 
 @app.route('/')
 def home():
@@ -169,6 +421,11 @@ def home():
         'version': '1.0'
     })
 
+def log_prediction(image_bytes, top_indices, top_confidences, latency_ms):
+    if prediction_logger is not None:
+        prediction_logger.record(hashlib.blake2b(image_bytes, digest_size=16).hexdigest(),
+                                 top_indices, top_confidences, latency_ms)
+
 @app.route('/api/predict', methods=['POST'])
 def predict():
     """
@@ -177,43 +434,18 @@ def predict():
     1. JSON with 'imageUrl' field (Cloudinary URL from Node.js)
     2. multipart/form-data with 'image' or 'file' field (direct upload)
     3. JSON with base64 encoded image
+    4. Raw image bytes (Content-Type application/octet-stream or image/*)
+    Query: ?similar=k adds similar reference cases, ?tiled=true classifies overlapping tiles,
+    ?explain=true adds Grad-CAM heatmaps (added anyway below EXPLAIN_CONFIDENCE_THRESHOLD
+    unless ?explain=false), ?explain_format=png sends them as PNG instead of uint8 lists
     Returns: JSON with prediction, confidence_score, and class_index
     """
     try:
-        image_bytes = None
-        source_type = None
-        
-        # Priority 1: Handle JSON with imageUrl (from Node.js backend)
-        if request.is_json:
-            data = request.get_json()
-            
-            # Check for Cloudinary URL
-            if 'imageUrl' in data:
-                image_url = data['imageUrl']
-                logger.info(f"📥 Downloading image from URL: {image_url[:50]}...")
-                image_bytes = download_image_from_url(image_url)
-                source_type = 'url'
-            
-            # Check for base64 image
-            elif 'image' in data:
-                image_data = data['image']
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                image_bytes = base64.b64decode(image_data)
-                source_type = 'base64'
-        
-        # Priority 2: Handle multipart/form-data (direct file upload)
-        elif 'image' in request.files:
-            file = request.files['image']
-            if file.filename != '':
-                image_bytes = file.read()
-                source_type = 'file'
-        elif 'file' in request.files:
-            file = request.files['file']
-            if file.filename != '':
-                image_bytes = file.read()
-                source_type = 'file'
-        
+        started = time.perf_counter()
+        image_bytes, source_type = read_image_payload()
+        read_done = time.perf_counter()
+        g.payload = (image_bytes, source_type)
+
         if image_bytes is None:
             logger.warning("No image provided in request")
             return jsonify({
@@ -223,47 +455,94 @@ def predict():
         
         logger.info(f"🔄 Processing image (source: {source_type})...")
         
+        # Full resolution normally; smaller inputs while this worker is overloaded
+        resolution = resolution_controller.select(inference_scheduler.queued_images(scheduler.INTERACTIVE))
+        
+        if request.args.get('tiled', '').lower() in ('1', 'true'):
+            return predict_tiled(image_bytes, started, read_done, resolution)
+        
         # Preprocess image
-        image_tensor = preprocess_image(image_bytes)
+        image_tensor, image_size, image_hash = preprocess_image(image_bytes, resolution)
         image_tensor = image_tensor.to(device)
+        preprocess_done = time.perf_counter()
         
-        # Perform inference
-        with torch.no_grad():
-            outputs = model(image_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            confidence, predicted_idx = torch.max(probabilities, 1)
-            
-            # Get all class probabilities for detailed response
-            all_probabilities = probabilities[0].cpu().numpy()
-            
-            predicted_class_idx = predicted_idx.item()
-            confidence_score = confidence.item()
-            
-            # Handle dynamic class names
-            if predicted_class_idx < len(CLASS_NAMES):
-                predicted_class_name = CLASS_NAMES[predicted_class_idx]
-            else:
-                predicted_class_name = f"Class_{predicted_class_idx}"
+        # Near-duplicate of a recent upload: reuse its result and skip the model entirely.
+        # Only requests in the default explain mode (no ?explain) use the cache, so a cached
+        # result carries exactly the automatic low-confidence explanation those requests expect.
+        similar_k = request.args.get('similar', type=int)
+        explain = request.args.get('explain', '').lower()
+        explain_requested = explain in ('1', 'true')
+        explain_format = request.args.get('explain_format', 'uint8').lower()
+        if explain_format not in gradcam.FORMATS:
+            return jsonify({'success': False, 'error': f"explain_format must be one of {gradcam.FORMATS}"}), 400
+        cacheable = image_hash is not None and not similar_k and not explain \
+            and explain_format == 'uint8'
+        cached = duplicate_cache.get(image_hash) if cacheable else None
+        if cached is not None:
+            (result, top_indices, top_confidences), distance = cached
+            finished = time.perf_counter()
+            logger.info(f"✅ Near-duplicate ({distance} bits): {result['prediction']}")
+            g.stage_timings = {
+                'read': (read_done - started) * 1000,
+                'preprocess': (preprocess_done - read_done) * 1000,
+                'queue': 0.0,
+                'inference': 0.0,
+                'postprocess': (finished - preprocess_done) * 1000,
+                'total': (finished - started) * 1000,
+            }
+            log_prediction(image_bytes, top_indices, top_confidences, g.stage_timings)
+            return jsonify({**result, 'near_duplicate': {'distance': distance}}), 200
         
-        logger.info(f"✅ Prediction: {predicted_class_name} ({confidence_score*100:.2f}%)")
-        
-        # Return prediction results (Node.js friendly format)
-        return jsonify({
-            'success': True,
-            'prediction': predicted_class_name,
-            'confidence': float(confidence_score),
-            'confidence_percentage': float(confidence_score * 100),
-            'class_index': int(predicted_class_idx),
-            'all_predictions': [
-                {
-                    'class': CLASS_NAMES[i] if i < len(CLASS_NAMES) else f"Class_{i}",
-                    'confidence': float(all_probabilities[i]),
-                    'percentage': float(all_probabilities[i] * 100)
-                }
-                for i in range(len(all_probabilities))
-            ]
-        }), 200
+        # Perform inference (queued behind higher-priority work, possibly batched with other requests)
+        probabilities, embedding, feature_map, batch_started = infer(image_tensor)
+        inference_done = time.perf_counter()
+        result = build_result(probabilities)
+        result['resolution'] = resolution
+        predicted_class_idx, confidence_score = result['class_index'], result['confidence']
+        logger.info(f"✅ Prediction: {result['prediction']} ({confidence_score*100:.2f}%)")
+
+        # Grad-CAM from this forward pass's feature map: one backward through the head only
+        if explain_requested or (explain not in ('0', 'false')
+                                 and confidence_score < gradcam.EXPLAIN_CONFIDENCE_THRESHOLD):
+            result['explanation'] = gradcam.explain(model.classifier, feature_map, probabilities,
+                                                    CLASS_NAMES, fmt=explain_format)
+
+        top_confidences, top_indices = probabilities.topk(min(prediction_log.TOP_K, NUM_CLASSES))
+        top_confidences, top_indices = top_confidences.tolist(), top_indices.tolist()
+        # Degraded-resolution results are not cached, or an idle worker would keep serving them
+        if cacheable and resolution == resolution_controller.full:
+            duplicate_cache.put(image_hash, (result, top_indices, top_confidences))
+
+        # ?similar=k: nearest reference images from the features of this same forward pass
+        if similar_k and reference_index is not None:
+            result['similar_cases'] = reference_index.neighbours(
+                embedding.numpy(), k=min(similar_k, MAX_SIMILAR))
+        finished = time.perf_counter()
+
+        # Drift sketches compare against a full-resolution reference; degraded inputs would skew them
+        if resolution == resolution_controller.full:
+            drift.update(predicted_class_idx, confidence_score,
+                         float(drift_monitor.image_brightness(
+                             image_tensor, PREPROCESSING['mean'], PREPROCESSING['std'])[0]), image_size,
+                         embedding.double().numpy())
+
+        g.stage_timings = {
+            'read': (read_done - started) * 1000,
+            'preprocess': (preprocess_done - read_done) * 1000,
+            'queue': (batch_started - preprocess_done) * 1000,
+            'inference': (inference_done - batch_started) * 1000,
+            'postprocess': (finished - inference_done) * 1000,
+            'total': (finished - started) * 1000,
+        }
+        if g.get('lane') == scheduler.INTERACTIVE:
+            resolution_controller.observe(g.stage_timings['queue'] + g.stage_timings['inference'])
+        log_prediction(image_bytes, top_indices, top_confidences, g.stage_timings)
+        return jsonify(result), 200
     
+    except image_ingest.PayloadTooLarge as e:
+        logger.warning(f"Rejected oversized image: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 413
+
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}", exc_info=True)
         return jsonify({
@@ -271,6 +550,191 @@ def predict():
             'error': f'Error processing image: {str(e)}'
         }), 500
 
+def build_result(probabilities):
+    """Prediction response (Node.js friendly format) for a class distribution [C]"""
+    confidence, predicted_idx = torch.max(probabilities, 0)
+    
+    # Get all class probabilities for detailed response
+    all_probabilities = probabilities.cpu().numpy()
+    
+    predicted_class_idx = predicted_idx.item()
+    confidence_score = confidence.item()
+    
+    # Handle dynamic class names
+    if predicted_class_idx < len(CLASS_NAMES):
+        predicted_class_name = CLASS_NAMES[predicted_class_idx]
+    else:
+        predicted_class_name = f"Class_{predicted_class_idx}"
+    
+    return {
+        'success': True,
+        'prediction': predicted_class_name,
+        'confidence': float(confidence_score),
+        'confidence_percentage': float(confidence_score * 100),
+        'class_index': int(predicted_class_idx),
+        'all_predictions': [
+            {
+                'class': CLASS_NAMES[i] if i < len(CLASS_NAMES) else f"Class_{i}",
+                'confidence': float(all_probabilities[i]),
+                'percentage': float(all_probabilities[i] * 100)
+            }
+            for i in range(len(all_probabilities))
+        ]
+    }
+
+def predict_tiled(image_bytes, started, read_done, resolution):
+    """
+    ?tiled=true: classify overlapping native-resolution tiles in one batched forward pass
+    Returns the aggregated diagnosis in the usual format plus per-tile predictions
+    """
+    height, width = input_sizes[resolution]
+    image, boxes, scale = tiling.open_tiled(image_ingest.open_buffer(image_bytes), min(height, width))
+    decoded_boxes = tiling.scale_boxes(boxes, scale)
+    keep = tiling.select_tiles(image, decoded_boxes)
+    tiles = tiling.crop_tiles(image, [decoded_boxes[i] for i in keep], (width, height), image_to_tensor)
+    kept = [boxes[i] for i in keep]
+    preprocess_done = time.perf_counter()
+
+    rows, batch_started = infer_batch(tiles)
+    inference_done = time.perf_counter()
+    tile_probabilities = torch.stack([probabilities for probabilities, _, _ in rows])
+    probabilities = tiling.aggregate(tile_probabilities)
+
+    result = build_result(probabilities)
+    result['resolution'] = resolution
+    confidences, indices = tile_probabilities.max(dim=1)
+    result['tiles'] = [
+        {'box': list(box), 'prediction': CLASS_NAMES[index], 'class_index': index, 'confidence': confidence}
+        for box, index, confidence in zip(kept, indices.tolist(), confidences.tolist())
+    ]
+    result['detections'] = tiling.detections(tile_probabilities, CLASS_NAMES)
+    result['tiling'] = {
+        'image_size': [round(image.width / scale), round(image.height / scale)],
+        'tile_size': kept[0][2] - kept[0][0],
+        'tiles_total': len(boxes),
+        'tiles_evaluated': len(kept),
+    }
+    logger.info(f"✅ Tiled prediction: {result['prediction']} ({len(kept)}/{len(boxes)} tiles)")
+    finished = time.perf_counter()
+
+    top_confidences, top_indices = probabilities.topk(min(prediction_log.TOP_K, NUM_CLASSES))
+    g.stage_timings = {
+        'read': (read_done - started) * 1000,
+        'preprocess': (preprocess_done - read_done) * 1000,
+        'queue': (batch_started - preprocess_done) * 1000,
+        'inference': (inference_done - batch_started) * 1000,
+        'postprocess': (finished - inference_done) * 1000,
+        'total': (finished - started) * 1000,
+    }
+    log_prediction(image_bytes, top_indices.tolist(), top_confidences.tolist(), g.stage_timings)
+    return jsonify(result), 200
+
+def forward_request_image():
+    """
+    Read and classify the request image once
+    Returns (probabilities [C], embedding [D], feature map [D, H, W]) or None
+    """
+    image_bytes, source_type = read_image_payload()
+    g.payload = (image_bytes, source_type)
+    if image_bytes is None:
+        return None
+    image_tensor, _, _ = preprocess_image(image_bytes)
+    probabilities, embedding, feature_map, _ = infer(image_tensor)
+    return probabilities, embedding, feature_map
+
+def top_prediction(probabilities):
+    confidence, index = probabilities.max(dim=0)
+    return {
+        'prediction': CLASS_NAMES[index.item()],
+        'class_index': index.item(),
+        'confidence': confidence.item(),
+    }
+
+@app.route('/api/embed', methods=['POST'])
+def embed():
+    """
+    Penultimate-layer (1280-d) feature of an image, plus its prediction
+    Accepts the same image inputs as /api/predict; ?normalize=false returns the raw pooled feature
+    """
+    try:
+        forward = forward_request_image()
+        if forward is None:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+        probabilities, embedding, _ = forward
+        if request.args.get('normalize', 'true').lower() != 'false':
+            embedding = torch.nn.functional.normalize(embedding, dim=0)
+        return jsonify({
+            'success': True,
+            'embedding': embedding.tolist(),
+            'dimension': embedding.numel(),
+            **top_prediction(probabilities),
+        })
+    except image_ingest.PayloadTooLarge as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': f'Error processing image: {str(e)}'}), 500
+
+@app.route('/api/similar', methods=['POST'])
+def similar():
+    """Nearest labelled reference images (?k=5), from the same forward pass as the prediction"""
+    if reference_index is None:
+        return jsonify({
+            'success': False,
+            'error': f'No embedding index at {EMBEDDING_INDEX_DIR} (build one with embedding_index.py)'
+        }), 503
+    try:
+        forward = forward_request_image()
+        if forward is None:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+        probabilities, embedding, _ = forward
+        k = min(request.args.get('k', 5, type=int), MAX_SIMILAR)
+        return jsonify({
+            'success': True,
+            **top_prediction(probabilities),
+            'similar_cases': reference_index.neighbours(embedding.numpy(), k=k),
+        })
+    except image_ingest.PayloadTooLarge as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': f'Error processing image: {str(e)}'}), 500
+
+@app.route('/api/explain', methods=['POST'])
+def explain():
+    """
+    Grad-CAM heatmaps of the top-k classes (?k=3), from the same forward pass as the prediction
+    ?format=png sends each heatmap as a grayscale PNG data URI instead of uint8 lists
+    """
+    fmt = request.args.get('format', 'uint8').lower()
+    if fmt not in gradcam.FORMATS:
+        return jsonify({'success': False, 'error': f"format must be one of {gradcam.FORMATS}"}), 400
+    try:
+        forward = forward_request_image()
+        if forward is None:
+            return jsonify({'success': False, 'error': 'No image provided'}), 400
+        probabilities, _, feature_map = forward
+        k = max(1, min(request.args.get('k', gradcam.EXPLAIN_TOP_K, type=int), gradcam.MAX_EXPLAIN_K))
+        return jsonify({
+            'success': True,
+            **top_prediction(probabilities),
+            'explanation': gradcam.explain(model.classifier, feature_map, probabilities, CLASS_NAMES,
+                                           k=k, fmt=fmt),
+        })
+    except image_ingest.PayloadTooLarge as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except Exception as e:
+        logger.error(f"❌ Error: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': f'Error processing image: {str(e)}'}), 500
+
+@app.errorhandler(413)
+def payload_too_large(e):
+    """Bodies over MAX_CONTENT_LENGTH are refused by Flask before predict() runs"""
+    return jsonify({
+        'success': False,
+        'error': f'Request too large (limit {image_ingest.MAX_IMAGE_BYTES} bytes per image)'
+    }), 413
+
 @app.route('/api/classes', methods=['GET'])
 def get_classes():
     """Return list of available classes"""
@@ -280,6 +744,66 @@ def get_classes():
         'num_classes': len(CLASS_NAMES)
     })
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    Aggregated prediction log over a time range
+    Query params: start, end (unix seconds or ISO 8601; default the last 24 hours), top (classes listed)
+    """
+    def parse_time(value, default):
+        if not value:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+
+    try:
+        end = parse_time(request.args.get('end'), time.time())
+        start = parse_time(request.args.get('start'), end - 24 * 3600)
+        top = int(request.args.get('top', 20))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid query parameter: {e}'}), 400
+
+    stats = prediction_log.query(start, end, CLASS_NAMES, top_classes=top)
+    stats['logging_enabled'] = prediction_logger is not None
+    stats['dropped_rows'] = prediction_logger.dropped if prediction_logger is not None else 0
+    return jsonify({'success': True, **stats})
+
+@app.route('/api/drift', methods=['GET'])
+def get_drift():
+    """Drift scores of this worker's current and previous window against the val-split reference"""
+    return jsonify({'success': True, **drift.report()})
+
+def is_admin():
+    supplied = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Profile this worker for the next N requests and/or T seconds (POST), or show status (GET)
+    JSON body: {"requests": 20, "seconds": 60}; requires the X-Admin-Token header
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'success': False, 'error': 'Admin endpoints are disabled (set ADMIN_TOKEN)'}), 404
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Invalid admin token'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, **profiler.status()})
+
+    options = request.get_json(silent=True) or {}
+    try:
+        max_requests = int(options['requests']) if options.get('requests') else None
+        seconds = float(options['seconds']) if options.get('seconds') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': "'requests' and 'seconds' must be numbers"}), 400
+    status = profiler.start(max_requests=max_requests, seconds=seconds)
+    if status is None:
+        return jsonify({'success': False, 'error': 'A profiling session is already running',
+                        **profiler.status()}), 409
+    return jsonify({'success': True, **status})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Detailed health check for monitoring"""
@@ -288,7 +812,14 @@ def health_check():
         'model_loaded': model is not None,
         'device': str(device),
         'model_type': 'MobileNetV2',
-        'num_classes': len(CLASS_NAMES)
+        'num_classes': len(CLASS_NAMES),
+        'model_version': MODEL_VERSION,
+        'model_format': 'bundle' if bundle_metadata is not None else 'state_dict',
+        'duplicate_cache': duplicate_cache.stats() if duplicate_cache is not None else None,
+        'scheduler': inference_scheduler.stats(),
+        'resolution': resolution_controller.stats(),
+        'capture': traffic.stats() if traffic is not None else None,
+        'threading': threading_config.EFFECTIVE_SETTINGS
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,252 @@
+"""
+Bulk offline inference over directories, globs or manifest files
+Decodes in worker processes, runs batched forward passes and appends results as it goes,
+so an interrupted run picks up where it left off.
+
+Usage:
+    python bulk_predict.py <dir | glob | manifest.csv | manifest.jsonl> --output results.jsonl
+    python bulk_predict.py "archive/2024/**/*.jpg" --output results.parquet --format parquet
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import shutil
+import argparse
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from tqdm import tqdm
+from test_controller import DiseaseDetectionModel
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+# ================================
+# Input discovery
+# ================================
+def _read_manifest(manifest_path):
+    """Image paths from a CSV ('path' column, else the first) or JSONL ({'path': ...}) manifest"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    paths = []
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        if manifest_path.lower().endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    paths.append(json.loads(line)['path'])
+        else:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            column = header.index('path') if header and 'path' in header else 0
+            if header and 'path' not in header:
+                paths.append(header[column])  # No header row, first line is data
+            paths.extend(row[column] for row in reader if row)
+    return [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in paths]
+
+
+def collect_inputs(source):
+    """Expand a directory, glob pattern or manifest into a sorted list of image paths"""
+    if os.path.isdir(source):
+        paths = [
+            os.path.join(root, name)
+            for root, _, files in os.walk(source)
+            for name in files if name.lower().endswith(IMG_EXTENSIONS)
+        ]
+    elif source.lower().endswith(('.csv', '.jsonl')) and os.path.isfile(source):
+        return _read_manifest(source)  # Manifest order is kept as given
+    else:
+        paths = [p for p in glob.glob(source, recursive=True) if p.lower().endswith(IMG_EXTENSIONS)]
+    return sorted(paths)
+
+
+class _ImagePathDataset(Dataset):
+    """Decodes one path per item; failures are reported instead of aborting the batch"""
+
+    def __init__(self, paths, transform, size=(224, 224)):
+        self.paths = paths
+        self.transform = transform
+        self.size = tuple(size)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        try:
+            with Image.open(self.paths[idx]) as image:
+                return self.transform(image.convert('RGB')), idx, ''
+        except Exception as e:
+            return torch.zeros(3, *self.size), idx, str(e)
+
+
+# ================================
+# Output writers (append-only, resumable)
+# ================================
+class JsonlWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def completed_paths(self):
+        """Paths already written; drops a trailing partial line left by a crash"""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) != len(data):
+            with open(self.path, 'wb') as f:
+                f.write(complete)
+        return {json.loads(line)['path'] for line in complete.decode('utf-8').splitlines() if line.strip()}
+
+    def open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        self._file.write(''.join(json.dumps(r) + '\n' for r in records))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """One part file per flush inside the output directory; parts appear atomically"""
+
+    def __init__(self, path, rows_per_part=10000):
+        try:
+            import pyarrow.parquet  # Optional dependency, only needed for --format parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for --format parquet (pip install pyarrow)")
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self._pending = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(n for n in os.listdir(self.path) if n.endswith('.parquet'))
+
+    def completed_paths(self):
+        import pyarrow.parquet as pq
+        done = set()
+        for name in self._parts():
+            done.update(pq.read_table(os.path.join(self.path, name), columns=['path']).column('path').to_pylist())
+        return done
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def write(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._pending:
+            return
+        rows = [dict(r, top_k=json.dumps(r['top_k'])) for r in self._pending]
+        table = pa.Table.from_pylist(rows)
+        part_path = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        pq.write_table(table, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        self._next_part += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+
+
+# ================================
+# Inference
+# ================================
+def run(detector, paths, writer, batch_size=64, num_workers=4, prefetch_batches=2, top_k=5):
+    """Batched inference over paths; results go to writer batch by batch"""
+    # Placeholder tensors for unreadable images must match the [h, w] the transform produces
+    size = detector.bundle_metadata['preprocessing']['resize'] if detector.bundle_metadata else (224, 224)
+    dataset = _ImagePathDataset(paths, detector.transform, size=size)
+    loader_kwargs = {'batch_size': batch_size, 'shuffle': False, 'num_workers': num_workers}
+    if num_workers > 0:
+        # Bounded prefetch: each worker keeps at most prefetch_batches decoded batches queued
+        loader_kwargs['prefetch_factor'] = prefetch_batches
+    loader = DataLoader(dataset, **loader_kwargs)
+
+    k = min(top_k, detector.num_classes)
+    written = failed = 0
+    writer.open()
+    try:
+        for images, indices, errors in tqdm(loader, desc="Predicting", unit="batch"):
+            predictions = detector.predict_tensor(images)
+
+            records = []
+            for prediction, idx, error in zip(predictions, indices.tolist(), errors):
+                record = {'path': paths[idx]}
+                if error:
+                    record.update({'prediction': None, 'class_index': None,
+                                   'confidence': None, 'top_k': [], 'error': error})
+                    failed += 1
+                else:
+                    top = prediction.top_k(k)
+                    record.update({
+                        'prediction': top[0]['class_name'],
+                        'class_index': top[0]['class_index'],
+                        'confidence': top[0]['confidence'],
+                        'top_k': [{'class': t['class_name'], 'confidence': t['confidence']} for t in top],
+                        'error': None,
+                    })
+                records.append(record)
+            writer.write(records)
+            written += len(records)
+    finally:
+        writer.close()
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk disease prediction over many images")
+    parser.add_argument('source', help="directory, glob pattern, or .csv/.jsonl manifest")
+    parser.add_argument('--output', required=True, help="results .jsonl file or parquet directory")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    parser.add_argument('--model', default='best_mobilenetv2.pth')
+    parser.add_argument('--class-names', default='class_names.txt')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--prefetch', type=int, default=2, help="decoded batches queued per worker")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--overwrite', action='store_true', help="discard existing output instead of resuming")
+    args = parser.parse_args()
+
+    paths = collect_inputs(args.source)
+    if not paths:
+        print(f"❌ No images found for {args.source}")
+        return 1
+
+    writer = ParquetWriter(args.output) if args.format == 'parquet' else JsonlWriter(args.output)
+    if args.overwrite and os.path.exists(args.output):
+        if os.path.isdir(args.output):
+            shutil.rmtree(args.output)
+        else:
+            os.remove(args.output)
+    done = writer.completed_paths()
+    remaining = [p for p in paths if p not in done]
+    print(f"Found {len(paths)} images, {len(done)} already scored, {len(remaining)} to go")
+    if not remaining:
+        return 0
+
+    detector = DiseaseDetectionModel(model_path=args.model)
+    if detector.bundle_metadata is None and os.path.exists(args.class_names):
+        with open(args.class_names, 'r', encoding='utf-8') as f:
+            class_names = [line.strip() for line in f if line.strip()]
+        if len(class_names) == detector.num_classes:
+            detector.class_names = class_names
+
+    written, failed = run(detector, remaining, writer, batch_size=args.batch_size,
+                          num_workers=args.workers, prefetch_batches=args.prefetch, top_k=args.top_k)
+    print(f"✅ Wrote {written} results to {args.output} ({failed} unreadable images)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
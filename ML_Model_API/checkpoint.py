@@ -0,0 +1,138 @@
+"""
+Full training checkpoints for model.py
+Snapshots model/optimizer/scheduler/RNG state to CPU and writes it from a background
+thread, so a crashed or preempted run can continue with --resume.
+"""
+import os
+import re
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+CHECKPOINT_PATTERN = re.compile(r"checkpoint_epoch_(\d+)\.pth$")
+
+
+def _to_cpu(obj):
+    """Detached CPU copy of every tensor in a (nested) state dict"""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def snapshot_training_state(epoch, model, optimizer, scheduler, scaler=None, **extra):
+    """
+    Everything needed to continue after `epoch` (0-based), copied to CPU
+
+    The copy happens on the training thread (it is cheap next to an epoch); the
+    expensive serialization and disk write happen on the writer thread.
+    """
+    state = {
+        'epoch': epoch,
+        'model': _to_cpu(model.state_dict()),
+        'optimizer': _to_cpu(optimizer.state_dict()),
+        'scheduler': scheduler.state_dict(),
+        'scaler': scaler.state_dict() if scaler is not None else None,
+        'rng': {
+            'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        },
+    }
+    state.update(_to_cpu(extra))
+    return state
+
+
+def restore_training_state(state, model, optimizer, scheduler, scaler=None):
+    """Load a checkpoint back into live objects; returns the first epoch to run"""
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scheduler.load_state_dict(state['scheduler'])
+    if scaler is not None and state.get('scaler'):
+        scaler.load_state_dict(state['scaler'])
+
+    rng = state['rng']
+    random.setstate(rng['python'])
+    np.random.set_state(rng['numpy'])
+    torch.set_rng_state(rng['torch'])
+    if rng.get('cuda') is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng['cuda'])
+    return state['epoch'] + 1
+
+
+def list_checkpoints(checkpoint_dir):
+    """[(epoch, path), ...] sorted oldest first"""
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    found = []
+    for name in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_PATTERN.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return sorted(found)
+
+
+def latest_checkpoint(checkpoint_dir):
+    """Path of the newest complete checkpoint, or None"""
+    found = list_checkpoints(checkpoint_dir)
+    return found[-1][1] if found else None
+
+
+def load_checkpoint(path):
+    # Checkpoints hold RNG state and history, not just tensors
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+
+class AsyncCheckpointWriter:
+    """Writes snapshots on a background thread; keeps the newest `keep_last` files"""
+
+    def __init__(self, checkpoint_dir, keep_last=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.error = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+        # One write in flight plus one waiting; a third submit blocks training until
+        # the disk catches up rather than piling snapshots up in memory
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, state):
+        if self.error is not None:
+            raise RuntimeError(f"Checkpoint writer failed: {self.error}")
+        self._queue.put(state)
+
+    def _run(self):
+        while True:
+            state = self._queue.get()
+            if state is None:
+                return
+            try:
+                self._write(state)
+            except Exception as e:
+                self.error = e
+                print(f"❌ Checkpoint write failed: {e}")
+
+    def _write(self, state):
+        path = os.path.join(self.checkpoint_dir, f"checkpoint_epoch_{state['epoch'] + 1:04d}.pth")
+        tmp_path = path + ".tmp"
+        torch.save(state, tmp_path)
+        # Atomic rename: a crash mid-write never leaves a truncated checkpoint behind
+        os.replace(tmp_path, path)
+
+        for _, old_path in list_checkpoints(self.checkpoint_dir)[:-self.keep_last]:
+            os.remove(old_path)
+
+    def close(self):
+        """Flush pending writes and stop the thread"""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Checkpoint writer failed: {self.error}")
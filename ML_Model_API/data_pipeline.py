@@ -0,0 +1,229 @@
+"""
+Training data pipeline for the MobileNetV2 trainer
+Parallel DataLoaders plus an optional decoded-pixel cache so later epochs skip JPEG decode
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from torchvision import datasets, transforms
+from shard_dataset import ShardedImageDataset, is_sharded_split, SHARD_META_FILE, SHARD_INDEX_FILE
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+SPLITS = ['train', 'val', 'test']
+
+# Cached images are stored square at this size; augmentations crop down to img_size
+DEFAULT_CACHE_RESOLUTION = 256
+
+
+def default_num_workers():
+    """Leave one core for the training loop, cap so small boxes don't thrash"""
+    return max(1, min(8, (os.cpu_count() or 1) - 1))
+
+
+def build_transforms(img_size=224, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """Train/val/test transforms (shared by model.py and the offline tools)"""
+    normalize = transforms.Normalize(mean, std)
+    eval_transform = transforms.Compose([
+        transforms.Resize((img_size, img_size)),
+        transforms.ToTensor(),
+        normalize
+    ])
+    return {
+        'train': transforms.Compose([
+            transforms.RandomResizedCrop(img_size),
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(25),
+            transforms.ColorJitter(0.3, 0.3, 0.3, 0.2),
+            transforms.ToTensor(),
+            normalize
+        ]),
+        'val': eval_transform,
+        'test': eval_transform,
+    }
+
+
+# ================================
+# Decoded pixel cache
+# ================================
+def _fingerprint(source, resolution):
+    """Hash of the source files' sizes/mtimes so a stale cache is rebuilt"""
+    if isinstance(source, ShardedImageDataset):
+        # The index covers labels and offsets, so its stats stand in for every sample
+        entries = [(os.path.join(source.split_dir, name), '') for name in (SHARD_META_FILE, SHARD_INDEX_FILE)]
+    else:
+        entries = source.samples
+
+    h = hashlib.sha1(str(resolution).encode())
+    for path, label in entries:
+        st = os.stat(path)
+        h.update(f"{path}|{label}|{st.st_size}|{st.st_mtime_ns}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+class _CacheFillDataset(Dataset):
+    """Decodes one image and writes it straight into the shared memmap (runs in workers)"""
+
+    def __init__(self, source, pixels_path, resolution):
+        self.source = source
+        self.pixels_path = pixels_path
+        self.resolution = resolution
+        self._pixels = None
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getitem__(self, idx):
+        if self._pixels is None:
+            self._pixels = np.load(self.pixels_path, mmap_mode='r+')
+        image, _ = self.source[idx]
+        image = image.convert('RGB').resize((self.resolution, self.resolution), Image.BILINEAR)
+        self._pixels[idx] = np.asarray(image, dtype=np.uint8)
+        return idx
+
+
+def build_decoded_cache(source, cache_dir, resolution=DEFAULT_CACHE_RESOLUTION, num_workers=None):
+    """
+    Decode a dataset once into cache_dir/pixels.npy (N x R x R x 3 uint8)
+
+    source is an ImageFolder or ShardedImageDataset without a transform. The existing
+    cache is reused when the source files haven't changed. Returns the cache directory.
+    """
+    fingerprint = _fingerprint(source, resolution)
+
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') == fingerprint:
+            print(f"✓ Reusing decoded cache at {cache_dir} ({meta['count']} images)")
+            return cache_dir
+        os.remove(meta_path)  # Invalidate before rewriting pixels
+
+    os.makedirs(cache_dir, exist_ok=True)
+    pixels_path = os.path.join(cache_dir, 'pixels.npy')
+    pixels = np.lib.format.open_memmap(
+        pixels_path, mode='w+', dtype=np.uint8,
+        shape=(len(source), resolution, resolution, 3)
+    )
+    del pixels  # Workers reopen the file themselves
+
+    np.save(os.path.join(cache_dir, 'labels.npy'), np.asarray(source.targets, dtype=np.int64))
+
+    workers = default_num_workers() if num_workers is None else num_workers
+    loader = DataLoader(
+        _CacheFillDataset(source, pixels_path, resolution),
+        batch_size=64, shuffle=False, num_workers=workers
+    )
+    print(f"🔄 Building decoded cache in {cache_dir} ({len(source)} images, {workers} workers)...")
+    for _ in loader:
+        pass
+
+    # meta.json is written last so a half-built cache is never picked up
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'classes': source.classes,
+            'count': len(source),
+            'resolution': resolution,
+            'fingerprint': fingerprint,
+        }, f)
+    print(f"✓ Decoded cache ready at {cache_dir}")
+    return cache_dir
+
+
+class CachedImageDataset(Dataset):
+    """Serves images from a decoded cache; random augmentations run on the cached pixels"""
+
+    def __init__(self, cache_dir, transform=None):
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.cache_dir = cache_dir
+        self.transform = transform
+        self.classes = meta['classes']
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+        self.targets = np.load(os.path.join(cache_dir, 'labels.npy')).tolist()
+        self._pixels = None  # Opened lazily so each worker maps the file itself
+
+    def __len__(self):
+        return len(self.targets)
+
+    @property
+    def pixels(self):
+        if self._pixels is None:
+            self._pixels = np.load(os.path.join(self.cache_dir, 'pixels.npy'), mmap_mode='r')
+        return self._pixels
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pixels'] = None
+        return state
+
+    def __getitem__(self, idx):
+        image = Image.fromarray(np.asarray(self.pixels[idx]))
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[idx]
+
+
+# ================================
+# Dataset / DataLoader construction
+# ================================
+def open_split(split_dir, transform=None):
+    """Packed shard split or plain ImageFolder tree, whichever split_dir holds"""
+    if is_sharded_split(split_dir):
+        return ShardedImageDataset(split_dir, transform=transform)
+    return datasets.ImageFolder(split_dir, transform=transform)
+
+
+def load_datasets(data_dir, data_transforms, cache_dir=None,
+                  cache_resolution=DEFAULT_CACHE_RESOLUTION, num_workers=None):
+    """Datasets per split (shards or ImageFolder), served from the decoded cache when cache_dir is given"""
+    image_datasets = {}
+    for split in SPLITS:
+        split_dir = os.path.join(data_dir, split)
+        if cache_dir:
+            split_cache = build_decoded_cache(
+                open_split(split_dir), os.path.join(cache_dir, split),
+                resolution=cache_resolution, num_workers=num_workers
+            )
+            image_datasets[split] = CachedImageDataset(split_cache, transform=data_transforms[split])
+        else:
+            image_datasets[split] = open_split(split_dir, transform=data_transforms[split])
+    return image_datasets
+
+
+def build_dataloader(dataset, batch_size, shuffle=False, num_workers=None,
+                     pin_memory=None, prefetch_factor=4):
+    """DataLoader with worker processes, prefetching and (when useful) pinned memory"""
+    workers = default_num_workers() if num_workers is None else num_workers
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()  # Pinning only pays off for CUDA copies
+
+    kwargs = {
+        'batch_size': batch_size,
+        'shuffle': shuffle,
+        'num_workers': workers,
+        'pin_memory': pin_memory,
+    }
+    if workers > 0:
+        kwargs['persistent_workers'] = True
+        kwargs['prefetch_factor'] = prefetch_factor
+    return DataLoader(dataset, **kwargs)
+
+
+def build_dataloaders(image_datasets, batch_size, num_workers=None,
+                      pin_memory=None, prefetch_factor=4):
+    """One loader per split; only train is shuffled"""
+    return {
+        split: build_dataloader(
+            image_datasets[split], batch_size, shuffle=(split == 'train'),
+            num_workers=num_workers, pin_memory=pin_memory,
+            prefetch_factor=prefetch_factor
+        )
+        for split in image_datasets
+    }
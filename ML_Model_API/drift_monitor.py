@@ -0,0 +1,316 @@
+"""
+Incremental input and confidence drift monitoring
+Each time window keeps fixed-size sketches (class counts, confidence histogram, brightness
+histogram, resolution buckets, embedding sum), so memory per window is constant and an
+update is a handful of array increments. Windows are scored against a reference profile
+built offline from the val split:
+
+    python drift_monitor.py build-reference dataset_split/val --model best_mobilenetv2.pth
+
+Scores: PSI for the class and confidence distributions, Jensen-Shannon divergence for
+brightness and resolution, cosine distance between mean embeddings. Histograms get a
+pseudo-count per bin, and the divergence expected from sampling noise alone is subtracted,
+so a window drawn from the reference distribution scores near zero. Each signal is
+judged against its own thresholds because the scales differ (PSI is unbounded, JS is in
+[0, 1]). drift_score is the worst signal as a fraction of its alert threshold.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+import torch
+
+CONFIDENCE_BINS = 20
+BRIGHTNESS_BINS = 16
+# Long side of the uploaded image, in pixels
+RESOLUTION_EDGES = (0, 256, 512, 1024, 2048, 4096)
+RESOLUTION_LABELS = ('<256', '256-511', '512-1023', '1024-2047', '2048-4095', '>=4096')
+
+# Conventional PSI bands: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 major shift
+WARN_THRESHOLD = float(os.getenv('DRIFT_WARN_THRESHOLD', 0.1))
+ALERT_THRESHOLD = float(os.getenv('DRIFT_ALERT_THRESHOLD', 0.25))
+# For small shifts JS (bits) is about PSI / (8 ln 2), so these match the PSI bands
+JS_SCALE = 1 / (8 * np.log(2))
+EMBEDDING_WARN_THRESHOLD = float(os.getenv('DRIFT_EMBEDDING_WARN_THRESHOLD', 0.05))
+EMBEDDING_ALERT_THRESHOLD = float(os.getenv('DRIFT_EMBEDDING_ALERT_THRESHOLD', 0.1))
+SIGNAL_THRESHOLDS = {
+    'class_psi': (WARN_THRESHOLD, ALERT_THRESHOLD),
+    'confidence_psi': (WARN_THRESHOLD, ALERT_THRESHOLD),
+    'brightness_js': (WARN_THRESHOLD * JS_SCALE, ALERT_THRESHOLD * JS_SCALE),
+    'resolution_js': (WARN_THRESHOLD * JS_SCALE, ALERT_THRESHOLD * JS_SCALE),
+    'embedding_cosine': (EMBEDDING_WARN_THRESHOLD, EMBEDDING_ALERT_THRESHOLD),
+}
+MIN_WINDOW_COUNT = 50
+# A window is scored once it holds this many predictions per class (and at least MIN_WINDOW_COUNT)
+MIN_COUNT_PER_CLASS = 10
+# Added to every bin of both histograms (Jeffreys prior) so rare and unseen classes stay finite
+PSEUDO_COUNT = 0.5
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+LUMA = torch.tensor([0.299, 0.587, 0.114])
+
+
+def image_brightness(image_tensor, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """
+    Mean luma in [0, 1] of normalized [B, 3, H, W] input tensors
+    mean/std are the normalization the tensors went through (the model's preprocessing)
+    """
+    channel_means = image_tensor.float().mean(dim=(2, 3)) * torch.tensor(std) + torch.tensor(mean)
+    return (channel_means @ LUMA).clamp_(0.0, 1.0)
+
+
+def resolution_bucket(size):
+    """Bucket index for an image (width, height)"""
+    return int(np.searchsorted(RESOLUTION_EDGES, max(size), side='right')) - 1
+
+
+class WindowSketch:
+    """Constant-size summary of the predictions seen in one window"""
+
+    def __init__(self, num_classes, embed_dim, start=None):
+        self.start = start if start is not None else time.time()
+        self.count = 0
+        self.class_counts = np.zeros(num_classes, dtype=np.int64)
+        self.confidence_hist = np.zeros(CONFIDENCE_BINS, dtype=np.int64)
+        self.brightness_hist = np.zeros(BRIGHTNESS_BINS, dtype=np.int64)
+        self.resolution_hist = np.zeros(len(RESOLUTION_EDGES), dtype=np.int64)
+        self.embedding_sum = np.zeros(embed_dim, dtype=np.float64)
+
+    def update(self, class_index, confidence, brightness, size_bucket, embedding=None):
+        self.count += 1
+        self.class_counts[class_index] += 1
+        self.confidence_hist[min(int(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)] += 1
+        self.brightness_hist[min(int(brightness * BRIGHTNESS_BINS), BRIGHTNESS_BINS - 1)] += 1
+        self.resolution_hist[size_bucket] += 1
+        if embedding is not None:
+            self.embedding_sum += embedding
+
+    def profile(self):
+        return {
+            'count': self.count,
+            'class_counts': self.class_counts,
+            'confidence_hist': self.confidence_hist,
+            'brightness_hist': self.brightness_hist,
+            'resolution_hist': self.resolution_hist,
+            'embedding_mean': self.embedding_sum / max(self.count, 1),
+        }
+
+
+# ================================
+# Divergences
+# ================================
+def _normalize(counts):
+    """Counts -> probabilities, with PSEUDO_COUNT added to every bin"""
+    p = np.asarray(counts, dtype=np.float64) + PSEUDO_COUNT
+    return p / p.sum()
+
+
+def _sampling_bias(expected, actual):
+    """
+    PSI that two samples of the same distribution show on average: (bins - 1) * (1/n_e + 1/n_a)
+    Only bins either histogram has seen count, so an unused tail of classes adds nothing
+    """
+    expected, actual = np.asarray(expected), np.asarray(actual)
+    bins = np.count_nonzero((expected > 0) | (actual > 0))
+    return max(bins - 1, 0) * (1 / max(expected.sum(), 1) + 1 / max(actual.sum(), 1))
+
+
+def psi(expected, actual):
+    """Population stability index between two histograms, less the sampling-noise bias"""
+    e, a = _normalize(expected), _normalize(actual)
+    return max(0.0, float(np.sum((a - e) * np.log(a / e))) - _sampling_bias(expected, actual))
+
+
+def js_divergence(p, q):
+    """Jensen-Shannon divergence (base 2, in [0, 1]) between two histograms, less the sampling-noise bias"""
+    bias = _sampling_bias(p, q) * JS_SCALE
+    p, q = _normalize(p), _normalize(q)
+    m = (p + q) / 2
+    return max(0.0, float(0.5 * np.sum(p * np.log2(p / m)) + 0.5 * np.sum(q * np.log2(q / m))) - bias)
+
+
+def cosine_distance(a, b):
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(1.0 - np.dot(a, b) / denom) if denom > 0 else 0.0
+
+
+def drift_scores(window, reference):
+    """Per-signal drift of a window profile against the reference profile"""
+    scores = {
+        'class_psi': psi(reference['class_counts'], window['class_counts']),
+        'confidence_psi': psi(reference['confidence_hist'], window['confidence_hist']),
+        'brightness_js': js_divergence(reference['brightness_hist'], window['brightness_hist']),
+        'resolution_js': js_divergence(reference['resolution_hist'], window['resolution_hist']),
+        'embedding_cosine': cosine_distance(reference['embedding_mean'], window['embedding_mean']),
+    }
+    # One number to alert on: the worst signal relative to its own alert threshold (1.0 = alert)
+    scores['drift_score'] = max(scores[name] / alert for name, (_, alert) in SIGNAL_THRESHOLDS.items())
+    return scores
+
+
+def _signal_status(name, score):
+    warn, alert = SIGNAL_THRESHOLDS[name]
+    if score >= alert:
+        return 'alert'
+    if score >= warn:
+        return 'warn'
+    return 'ok'
+
+
+def _status(scores):
+    """Worst per-signal status"""
+    if scores is None:
+        return 'insufficient_data'
+    statuses = {_signal_status(name, scores[name]) for name in SIGNAL_THRESHOLDS}
+    return next(status for status in ('alert', 'warn', 'ok') if status in statuses)
+
+
+def min_window_count(num_classes):
+    return max(MIN_WINDOW_COUNT, MIN_COUNT_PER_CLASS * num_classes)
+
+
+# ================================
+# Serving-side monitor
+# ================================
+def load_reference(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+class DriftMonitor:
+    """Current and previous window sketches for one worker, scored against the reference"""
+
+    def __init__(self, num_classes, embed_dim, reference=None, window_seconds=3600):
+        self.num_classes = num_classes
+        self.embed_dim = embed_dim
+        self.reference = reference
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._current = self._new_window(time.time())
+        self._previous = None
+
+    def _new_window(self, now):
+        # Windows sit on a fixed grid (e.g. whole hours) so every worker's windows line up
+        return WindowSketch(self.num_classes, self.embed_dim, start=now - now % self.window_seconds)
+
+    def update(self, class_index, confidence, brightness, size, embedding=None):
+        """Fold one prediction into the current window (a few array increments)"""
+        bucket = resolution_bucket(size)
+        now = time.time()
+        with self._lock:
+            if now - self._current.start >= self.window_seconds:
+                self._previous = self._current
+                self._current = self._new_window(now)
+            self._current.update(class_index, confidence, brightness, bucket, embedding)
+
+    def _report_window(self, sketch):
+        profile = sketch.profile()
+        scores = None
+        if self.reference is not None and profile['count'] >= min_window_count(self.num_classes):
+            scores = drift_scores(profile, self.reference)
+        return {
+            'window_start': sketch.start,
+            'window_end': sketch.start + self.window_seconds,
+            'count': profile['count'],
+            'scores': scores,
+            'status': _status(scores),
+            'brightness_hist': profile['brightness_hist'].tolist(),
+            'resolution_hist': dict(zip(RESOLUTION_LABELS, profile['resolution_hist'].tolist())),
+            'mean_confidence': float(
+                (profile['confidence_hist'] * (np.arange(CONFIDENCE_BINS) + 0.5) / CONFIDENCE_BINS).sum()
+                / max(profile['count'], 1)
+            ),
+        }
+
+    def report(self):
+        with self._lock:
+            current, previous = self._current, self._previous
+            report = {
+                'reference_loaded': self.reference is not None,
+                'window_seconds': self.window_seconds,
+                'thresholds': {name: {'warn': warn, 'alert': alert}
+                               for name, (warn, alert) in SIGNAL_THRESHOLDS.items()},
+                'min_window_count': min_window_count(self.num_classes),
+                'current': self._report_window(current),
+                'previous': self._report_window(previous) if previous is not None else None,
+            }
+        return report
+
+
+# ================================
+# Reference profile (offline)
+# ================================
+class _StatsDataset(torch.utils.data.Dataset):
+    """Wraps a split to also return the original image size for resolution bucketing"""
+
+    def __init__(self, dataset, transform):
+        self.dataset = dataset
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        image, label = self.dataset[idx]
+        return self.transform(image), resolution_bucket(image.size)
+
+
+def build_reference(model, loader, num_classes, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """Reference profile from a labelled split, using the same sketches as serving"""
+    from feature_tap import FeatureTap
+
+    tap = FeatureTap(model)
+    sketch = WindowSketch(num_classes, model.classifier[-1].in_features)
+    with torch.inference_mode():
+        for images, buckets in loader:
+            probabilities = torch.softmax(model(images), dim=1)
+            confidence, predicted = probabilities.max(dim=1)
+            brightness = image_brightness(images, mean, std)
+            embeddings = tap.pooled().double().numpy()
+            for i in range(len(images)):
+                sketch.update(int(predicted[i]), float(confidence[i]), float(brightness[i]),
+                              int(buckets[i]), embeddings[i])
+    tap.remove()
+    return sketch.profile()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the drift reference profile from a dataset split")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build-reference', help="profile a split (normally val)")
+    build.add_argument('split_dir', help="ImageFolder split or packed shard split")
+    build.add_argument('--model', default='best_mobilenetv2.pth')
+    build.add_argument('--output', default='drift_reference.npz')
+    build.add_argument('--batch-size', type=int, default=64)
+    build.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    import data_pipeline
+    import model_bundle
+    from evaluate import load_model, eval_transform
+
+    model, kind = load_model(args.model, torch.device('cpu'))
+    if not hasattr(model, 'features'):
+        print(f"❌ {kind} models have no .features to hook; use a state dict or checkpoint")
+        return 1
+
+    # Same inputs as serving: the bundle's preprocessing, else the default pipeline
+    preprocessing = model_bundle.read_header(args.model)[0]['metadata']['preprocessing'] \
+        if kind == 'bundle' else model_bundle.DEFAULT_PREPROCESSING
+    split = data_pipeline.open_split(args.split_dir)
+    dataset = _StatsDataset(split, eval_transform(args.model, kind))
+    loader = data_pipeline.build_dataloader(dataset, args.batch_size, num_workers=args.workers)
+
+    print(f"Profiling {len(dataset)} images from {args.split_dir}...")
+    profile = build_reference(model, loader, model.classifier[-1].out_features,
+                              preprocessing['mean'], preprocessing['std'])
+    np.savez(args.output, **profile)
+    print(f"✅ Reference profile of {profile['count']} images written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
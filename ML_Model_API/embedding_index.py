@@ -0,0 +1,232 @@
+"""
+Nearest-neighbour index over penultimate-layer embeddings of labelled reference images
+Embeddings are L2-normalized and stored as a memory-mapped float16 matrix, sorted by
+inverted-file (IVF) cluster so every cluster is one contiguous slice. A query scores the
+cluster centroids, then only the rows of the nprobe closest clusters.
+
+Build from the train split (offline):
+    python embedding_index.py build dataset_split/train --model best_mobilenetv2.pth
+
+Files in the index directory:
+    embeddings.f16   float16 [N, D], rows grouped by cluster
+    centroids.npy    float32 [nlist, D]
+    list_offsets.npy int64 [nlist + 1], rows of cluster c are offsets[c]:offsets[c+1]
+    labels.npy       int32 [N]
+    items.json       reference image path (relative to the split) per row
+    meta.json        count, dim, nlist, classes; written last
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import torch
+
+EMBEDDINGS_FILE = 'embeddings.f16'
+META_FILE = 'meta.json'
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE = 50000
+DEFAULT_NPROBE = 8
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def _assign(vectors, centroids, chunk=8192):
+    """Closest centroid (by cosine) for each row, chunked to bound the score matrix"""
+    return np.concatenate([
+        np.argmax(np.asarray(vectors[i:i + chunk], dtype=np.float32) @ centroids.T, axis=1)
+        for i in range(0, len(vectors), chunk)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+def spherical_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """k-means on the unit sphere over a sample of the (normalized) vectors"""
+    rng = np.random.default_rng(seed)
+    sample_idx = rng.choice(len(vectors), size=min(len(vectors), KMEANS_SAMPLE), replace=False)
+    sample = np.asarray(vectors[np.sort(sample_idx)], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty clusters from random points so every list stays useful
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def build_index(embeddings, labels, items, classes, out_dir, nlist=None):
+    """Write the IVF index for normalized embeddings [N, D]"""
+    count, dim = embeddings.shape
+    nlist = nlist or int(np.clip(round(np.sqrt(count)), 1, 1024))
+    nlist = min(nlist, count)
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # Mark the index incomplete while it is rewritten
+
+    centroids = spherical_kmeans(embeddings, nlist)
+    assignment = _assign(embeddings, centroids)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+
+    sorted_embeddings = np.memmap(os.path.join(out_dir, EMBEDDINGS_FILE), dtype=np.float16,
+                                  mode='w+', shape=(count, dim))
+    for start in range(0, count, 8192):
+        rows = order[start:start + 8192]
+        sorted_embeddings[start:start + len(rows)] = embeddings[rows]
+    sorted_embeddings.flush()
+    del sorted_embeddings
+
+    np.save(os.path.join(out_dir, 'centroids.npy'), centroids.astype(np.float32))
+    np.save(os.path.join(out_dir, 'list_offsets.npy'), offsets)
+    np.save(os.path.join(out_dir, 'labels.npy'), np.asarray(labels, dtype=np.int32)[order])
+    with open(os.path.join(out_dir, 'items.json'), 'w', encoding='utf-8') as f:
+        json.dump([items[i] for i in order], f)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'count': int(count), 'dim': int(dim), 'nlist': int(nlist), 'classes': list(classes)}, f)
+    return nlist
+
+
+class EmbeddingIndex:
+    """Read-only IVF index; the embedding matrix stays memory-mapped"""
+
+    def __init__(self, index_dir, nprobe=DEFAULT_NPROBE):
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count, self.dim, self.nlist = meta['count'], meta['dim'], meta['nlist']
+        self.classes = meta['classes']
+        self.nprobe = nprobe
+        self.embeddings = np.memmap(os.path.join(index_dir, EMBEDDINGS_FILE), dtype=np.float16,
+                                    mode='r', shape=(self.count, self.dim))
+        self.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(index_dir, 'list_offsets.npy'))
+        self.labels = np.load(os.path.join(index_dir, 'labels.npy'))
+        with open(os.path.join(index_dir, 'items.json'), 'r', encoding='utf-8') as f:
+            self.items = json.load(f)
+
+    def search(self, queries, k=5, nprobe=None):
+        """Top-k (row indices [Q, k], cosine similarities [Q, k]) for query vectors [Q, D]; -1 pads"""
+        queries = normalize(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probe):
+            # Each probed list is a contiguous slice of the matrix
+            spans = [(self.offsets[c], self.offsets[c + 1]) for c in lists]
+            rows = np.concatenate([np.arange(start, end) for start, end in spans])
+            if not len(rows):
+                continue
+            candidates = np.concatenate([self.embeddings[start:end] for start, end in spans])
+            candidate_scores = candidates.astype(np.float32) @ queries[q]
+            top = min(k, len(rows))
+            best = np.argpartition(-candidate_scores, top - 1)[:top]
+            best = best[np.argsort(-candidate_scores[best])]
+            indices[q, :top] = rows[best]
+            scores[q, :top] = candidate_scores[best]
+        return indices, scores
+
+    def neighbours(self, query, k=5, nprobe=None):
+        """Nearest reference images to one query vector, as JSON-ready dicts"""
+        indices, scores = self.search(query, k=k, nprobe=nprobe)
+        return [
+            {
+                'class': self.classes[self.labels[i]],
+                'class_index': int(self.labels[i]),
+                'item': self.items[i],
+                'similarity': float(score),
+            }
+            for i, score in zip(indices[0].tolist(), scores[0].tolist()) if i >= 0
+        ]
+
+
+# ================================
+# Offline builder
+# ================================
+def extract_embeddings(model, loader, count, dim, out_path):
+    """Pooled, normalized features for a whole split into a float16 memmap; also returns labels"""
+    from feature_tap import FeatureTap
+
+    tap = FeatureTap(model)
+    embeddings = np.memmap(out_path, dtype=np.float16, mode='w+', shape=(count, dim))
+    labels = np.zeros(count, dtype=np.int32)
+    position = 0
+    with torch.inference_mode():
+        for images, targets in loader:
+            model(images)
+            batch = normalize(tap.pooled().float().numpy())
+            embeddings[position:position + len(batch)] = batch
+            labels[position:position + len(batch)] = targets.numpy()
+            position += len(batch)
+    tap.remove()
+    embeddings.flush()
+    return embeddings, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the reference image embedding index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="index a labelled split (normally train)")
+    build.add_argument('split_dir', help="ImageFolder split or packed shard split")
+    build.add_argument('--model', default='best_mobilenetv2.pth')
+    build.add_argument('--output', default='embedding_index')
+    build.add_argument('--nlist', type=int, default=None, help="IVF clusters (default sqrt(N))")
+    build.add_argument('--batch-size', type=int, default=64)
+    build.add_argument('--workers', type=int, default=None)
+    query = subparsers.add_parser('query', help="nearest reference images for one image file")
+    query.add_argument('image')
+    query.add_argument('--index', default='embedding_index')
+    query.add_argument('--model', default='best_mobilenetv2.pth')
+    query.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    import data_pipeline
+    from evaluate import load_model, eval_transform
+    from feature_tap import FeatureTap
+
+    model, kind = load_model(args.model, torch.device('cpu'))
+    if not hasattr(model, 'features'):
+        print(f"❌ {kind} models have no .features to hook; use a state dict or checkpoint")
+        return 1
+    # The server embeds queries with the bundle's preprocessing; references must match it
+    transform = eval_transform(args.model, kind)
+
+    if args.command == 'query':
+        from PIL import Image
+        tap = FeatureTap(model)
+        with Image.open(args.image) as image, torch.inference_mode():
+            model(transform(image.convert('RGB')).unsqueeze(0))
+        for n in EmbeddingIndex(args.index).neighbours(tap.pooled()[0].numpy(), k=args.k):
+            print(f"  {n['similarity']:.4f}  {n['class']:<40} {n['item']}")
+        return 0
+
+    dataset = data_pipeline.open_split(args.split_dir, transform=transform)
+    if hasattr(dataset, 'samples'):
+        items = [os.path.relpath(path, args.split_dir) for path, _ in dataset.samples]
+    else:
+        items = [f"#{i}" for i in range(len(dataset))]  # Packed shards keep no file names
+    loader = data_pipeline.build_dataloader(dataset, args.batch_size, num_workers=args.workers)
+
+    os.makedirs(args.output, exist_ok=True)
+    scratch = os.path.join(args.output, 'unsorted.f16.tmp')
+    print(f"Embedding {len(dataset)} images from {args.split_dir}...")
+    embeddings, labels = extract_embeddings(model, loader, len(dataset), model.last_channel, scratch)
+    nlist = build_index(embeddings, labels, items, dataset.classes, args.output, nlist=args.nlist)
+    del embeddings
+    os.remove(scratch)
+    print(f"✅ Indexed {len(dataset)} images in {nlist} clusters at {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
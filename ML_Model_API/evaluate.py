@@ -0,0 +1,233 @@
+"""
+Offline evaluation of a trained model on one dataset split
+Reads plain ImageFolder trees or packed shard splits (see shard_dataset.py) and loads any
+serving artifact: state dicts, training checkpoints, TorchScript or pickled (quantized) models.
+
+Metrics are accumulated batch by batch into preallocated tensors (confusion matrix,
+top-k hits, calibration bins), so memory stays flat however large the split is.
+
+Usage: python evaluate.py <split_dir> [--model best_mobilenetv2.pth] [--output report.json]
+"""
+import sys
+import json
+import time
+import argparse
+import torch
+import torch.nn as nn
+from torchvision import models
+import data_pipeline
+import model_bundle
+
+
+def load_model(model_path, device):
+    """
+    Load any model artifact we ship; returns (model, kind)
+
+    kind is one of 'bundle', 'torchscript', 'module', 'checkpoint', 'state_dict'.
+    """
+    if model_bundle.is_bundle(model_path):
+        model, _ = model_bundle.load_model(model_path)
+        return model.to(device).eval(), 'bundle'
+    try:
+        model = torch.jit.load(model_path, map_location='cpu')
+        kind = 'torchscript'
+    except RuntimeError:
+        # Not TorchScript: a pickled module, a training checkpoint or a plain state dict
+        obj = torch.load(model_path, map_location='cpu', weights_only=False)
+        if isinstance(obj, nn.Module):
+            model, kind = obj, 'module'
+        else:
+            kind = 'state_dict'
+            if 'model' in obj and 'epoch' in obj:
+                obj, kind = obj['model'], 'checkpoint'
+            num_classes = obj['classifier.1.weight'].shape[0]
+            model = models.mobilenet_v2(weights=None)
+            model.classifier[1] = nn.Linear(model.last_channel, num_classes)
+            model.load_state_dict(obj)
+    return model.to(device).eval(), kind
+
+
+class MetricsAccumulator:
+    """Streaming classification metrics over (logits, labels) batches"""
+
+    def __init__(self, num_classes, top_k=(1, 3, 5), num_bins=15):
+        self.num_classes = num_classes
+        self.top_k = tuple(k for k in top_k if k <= num_classes)
+        self.num_bins = num_bins
+
+        self.confusion = torch.zeros(num_classes * num_classes, dtype=torch.int64)
+        self.topk_hits = torch.zeros(len(self.top_k), dtype=torch.int64)
+        self.bin_count = torch.zeros(num_bins, dtype=torch.float64)
+        self.bin_confidence = torch.zeros(num_bins, dtype=torch.float64)
+        self.bin_correct = torch.zeros(num_bins, dtype=torch.float64)
+        self.nll_sum = 0.0
+        self.count = 0
+
+    def update(self, logits, labels):
+        logits = logits.detach().float().cpu()
+        labels = labels.cpu()
+
+        probs = torch.softmax(logits, dim=1)
+        confidence, preds = probs.max(dim=1)
+        correct = (preds == labels)
+
+        # Row = true class, column = predicted class
+        self.confusion += torch.bincount(labels * self.num_classes + preds,
+                                         minlength=self.num_classes * self.num_classes)
+
+        if self.top_k:
+            topk = logits.topk(max(self.top_k), dim=1).indices
+            hits = topk == labels.unsqueeze(1)
+            for i, k in enumerate(self.top_k):
+                self.topk_hits[i] += hits[:, :k].any(dim=1).sum()
+
+        bins = (confidence * self.num_bins).long().clamp_(max=self.num_bins - 1)
+        self.bin_count += torch.bincount(bins, minlength=self.num_bins)
+        self.bin_confidence += torch.bincount(bins, weights=confidence.double(), minlength=self.num_bins)
+        self.bin_correct += torch.bincount(bins, weights=correct.double(), minlength=self.num_bins)
+
+        self.nll_sum += nn.functional.cross_entropy(logits, labels, reduction='sum').item()
+        self.count += labels.numel()
+
+    def report(self, class_names=None):
+        n = max(self.count, 1)
+        confusion = self.confusion.view(self.num_classes, self.num_classes).double()
+        true_pos = confusion.diagonal()
+        support = confusion.sum(dim=1)
+        predicted = confusion.sum(dim=0)
+
+        precision = torch.where(predicted > 0, true_pos / predicted.clamp(min=1), torch.zeros_like(true_pos))
+        recall = torch.where(support > 0, true_pos / support.clamp(min=1), torch.zeros_like(true_pos))
+        denom = precision + recall
+        f1 = torch.where(denom > 0, 2 * precision * recall / denom.clamp(min=1e-12), torch.zeros_like(denom))
+
+        weights = support / support.sum().clamp(min=1)
+        present = support > 0
+
+        # Expected calibration error: |accuracy - confidence| per bin, weighted by bin size
+        filled = self.bin_count > 0
+        bin_acc = self.bin_correct[filled] / self.bin_count[filled]
+        bin_conf = self.bin_confidence[filled] / self.bin_count[filled]
+        ece = ((bin_acc - bin_conf).abs() * self.bin_count[filled]).sum().item() / n
+
+        names = class_names or [f"Class_{i}" for i in range(self.num_classes)]
+        off_diagonal = confusion.clone()
+        off_diagonal.fill_diagonal_(0)
+        top_confusions = []
+        values, flat_idx = off_diagonal.flatten().topk(min(10, off_diagonal.numel()))
+        for value, idx in zip(values.tolist(), flat_idx.tolist()):
+            if value <= 0:
+                break
+            true_idx, pred_idx = divmod(idx, self.num_classes)
+            top_confusions.append({'true': names[true_idx], 'predicted': names[pred_idx], 'count': int(value)})
+
+        return {
+            'num_samples': self.count,
+            'accuracy': true_pos.sum().item() / n,
+            **{f'top{k}_accuracy': self.topk_hits[i].item() / n for i, k in enumerate(self.top_k)},
+            'precision_macro': precision[present].mean().item() if present.any() else 0.0,
+            'recall_macro': recall[present].mean().item() if present.any() else 0.0,
+            'f1_macro': f1[present].mean().item() if present.any() else 0.0,
+            'precision_weighted': (precision * weights).sum().item(),
+            'recall_weighted': (recall * weights).sum().item(),
+            'f1_weighted': (f1 * weights).sum().item(),
+            'expected_calibration_error': ece,
+            'nll': self.nll_sum / n,
+            'per_class': [
+                {
+                    'class': names[i],
+                    'precision': precision[i].item(),
+                    'recall': recall[i].item(),
+                    'f1': f1[i].item(),
+                    'support': int(support[i].item()),
+                }
+                for i in range(self.num_classes)
+            ],
+            'top_confusions': top_confusions,
+        }
+
+
+def evaluate(model, loader, device, num_classes, class_names=None, top_k=(1, 3, 5)):
+    """Stream the loader through the model; returns the metrics report with throughput"""
+    metrics = MetricsAccumulator(num_classes, top_k=top_k)
+    model_seconds = 0.0
+    start = time.perf_counter()
+
+    with torch.inference_mode():
+        for inputs, labels in loader:
+            inputs = inputs.to(device, non_blocking=True)
+            batch_start = time.perf_counter()
+            outputs = model(inputs)
+            if outputs.shape[1] != num_classes:
+                raise ValueError(f"Model outputs {outputs.shape[1]} classes, dataset has {num_classes}")
+            metrics.update(outputs, labels)
+            model_seconds += time.perf_counter() - batch_start
+
+    elapsed = time.perf_counter() - start
+    report = metrics.report(class_names)
+    report['images_per_sec'] = report['num_samples'] / elapsed if elapsed > 0 else 0.0
+    report['model_images_per_sec'] = report['num_samples'] / model_seconds if model_seconds > 0 else 0.0
+    report['elapsed_seconds'] = elapsed
+    return report
+
+
+def eval_transform(model_path, kind, img_size=None):
+    """
+    Test-time transform for a model artifact
+    Bundles use the preprocessing they ship with (img_size only overrides the resize);
+    other formats get the default pipeline at img_size (224 when not given)
+    """
+    if kind == 'bundle':
+        header, _ = model_bundle.read_header(model_path)
+        preprocessing = header['metadata']['preprocessing']
+        if img_size:
+            preprocessing = {**preprocessing, 'resize': [img_size, img_size]}
+        return model_bundle.build_transform(preprocessing)
+    return data_pipeline.build_transforms(img_size or 224)['test']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a trained model on a dataset split")
+    parser.add_argument('split_dir', help="ImageFolder split or packed shard split")
+    parser.add_argument('--model', default='best_mobilenetv2.pth',
+                        help="bundle, state dict, checkpoint, TorchScript or pickled (quantized) model")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--img-size', type=int, default=None,
+                        help="input size (default: the bundle's preprocessing, else 224)")
+    parser.add_argument('--device', default='cpu', help="quantized models only run on cpu")
+    parser.add_argument('--top-k', default='1,3,5')
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--min-accuracy', type=float, default=None,
+                        help="exit non-zero when accuracy is below this (for gating model swaps)")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    model, kind = load_model(args.model, device)
+
+    transform = eval_transform(args.model, kind, args.img_size)
+    dataset = data_pipeline.open_split(args.split_dir, transform=transform)
+    loader = data_pipeline.build_dataloader(dataset, args.batch_size, num_workers=args.workers)
+
+    report = evaluate(model, loader, device, len(dataset.classes), dataset.classes,
+                      top_k=tuple(int(k) for k in args.top_k.split(',')))
+    report = {'split': args.split_dir, 'model': args.model, 'model_kind': kind, **report}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"✅ Accuracy {report['accuracy']:.4f} on {report['num_samples']} images "
+              f"({report['images_per_sec']:.1f} images/sec), report written to {args.output}")
+    else:
+        print(output)
+
+    if args.min_accuracy is not None and report['accuracy'] < args.min_accuracy:
+        print(f"❌ Accuracy {report['accuracy']:.4f} is below the required {args.min_accuracy:.4f}",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+"""
+Forward hook on model.features that keeps the last feature map per thread
+Lets monitoring code read the penultimate-layer activations of the forward pass that just
+ran, instead of running the backbone a second time. Request threads never see each
+other's captures.
+"""
+import threading
+
+
+class FeatureTap:
+    def __init__(self, model):
+        self._local = threading.local()
+        self._handle = model.features.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        self._local.features = output
+
+    def features(self):
+        """Feature map [B, C, H, W] from this thread's most recent forward pass (or None)"""
+        return getattr(self._local, 'features', None)
+
+    def pooled(self):
+        """Global-average-pooled features [B, C], the input the classifier head sees"""
+        features = self.features()
+        return None if features is None else features.mean(dim=(2, 3))
+
+    def clear(self):
+        self._local.features = None
+
+    def remove(self):
+        self._handle.remove()
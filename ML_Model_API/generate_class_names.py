@@ -4,6 +4,7 @@ Run this script before deploying to Render
 """
 import os
 import sys
+from shard_dataset import is_sharded_split, read_shard_meta
 
 def generate_class_names_file(data_dir, output_file='class_names.txt'):
     """Generate class_names.txt from dataset directory"""
@@ -14,9 +15,13 @@ def generate_class_names_file(data_dir, output_file='class_names.txt'):
             print(f"❌ Error: Training directory not found at {train_dir}")
             sys.exit(1)
         
-        # Get all class names (folder names in train directory)
-        class_names = sorted([d for d in os.listdir(train_dir) 
-                             if os.path.isdir(os.path.join(train_dir, d))])
+        if is_sharded_split(train_dir):
+            # Packed dataset: the class table is in the split's index, no directory listing needed
+            class_names = read_shard_meta(train_dir)['classes']
+        else:
+            # Get all class names (folder names in train directory)
+            class_names = sorted([d for d in os.listdir(train_dir) 
+                                 if os.path.isdir(os.path.join(train_dir, d))])
         
         if not class_names:
             print(f"❌ Error: No class folders found in {train_dir}")
@@ -0,0 +1,81 @@
+"""
+Grad-CAM heatmaps from the feature map of the forward pass that produced the prediction
+The last conv block's activations A [D, H, W] are captured by the FeatureTap hook during
+the normal batched forward. Nothing runs through the backbone again. Grad-CAM weights each
+channel by the gradient of the class score with respect to it. In MobileNetV2 that
+gradient only passes through the global average pool and the classifier head. So the k
+maps take one backward pass over k copies of the pooled feature [k, D] through the head,
+followed by one [k, D] x [D, H*W] product. The cost is a few microseconds per request, so
+explanations can stay on by default for low-confidence results.
+
+Heatmaps are coarse (7x7 at 224px input) and cover the whole image, because
+preprocessing resizes the image without cropping. They are quantized to uint8 and sent
+either as nested lists or as a tiny grayscale PNG for the client to upscale over the photo.
+
+Environment:
+    EXPLAIN_CONFIDENCE_THRESHOLD  /api/predict adds explanations below this confidence
+                                  unless ?explain=false (default 0.6, 0 disables)
+    EXPLAIN_TOP_K                 classes explained per image (default 3)
+"""
+import io
+import os
+import base64
+import torch
+from PIL import Image
+
+EXPLAIN_CONFIDENCE_THRESHOLD = float(os.getenv('EXPLAIN_CONFIDENCE_THRESHOLD', 0.6))
+EXPLAIN_TOP_K = int(os.getenv('EXPLAIN_TOP_K', 3))
+MAX_EXPLAIN_K = 10
+FORMATS = ('uint8', 'png')
+
+
+def grad_cam(classifier, feature_map, class_indices):
+    """
+    Heatmaps [k, H, W] in [0, 1] for each class in class_indices
+    feature_map: [D, H, W] activations of model.features for one image (no grad needed)
+    """
+    feature_map = feature_map.detach().float()
+    class_indices = torch.as_tensor(class_indices, dtype=torch.long)
+    k = class_indices.numel()
+    # Row i of the batch carries the score of class i, so one backward yields all k gradients
+    pooled = feature_map.mean(dim=(1, 2)).expand(k, -1).clone().requires_grad_(True)
+    with torch.enable_grad():
+        scores = classifier(pooled).gather(1, class_indices[:, None]).sum()
+        (gradients,) = torch.autograd.grad(scores, pooled)
+    # d score / d A[d, h, w] = gradient[d] / (H * W) everywhere, so the spatial mean is gradient / (H * W)
+    cams = torch.relu(torch.einsum('kd,dhw->khw', gradients, feature_map))
+    peak = cams.amax(dim=(1, 2), keepdim=True)
+    return torch.where(peak > 0, cams / peak.clamp_min(1e-12), cams)
+
+
+def quantize(cams):
+    """[k, H, W] floats in [0, 1] -> uint8 tensor"""
+    return (cams * 255).round().to(torch.uint8)
+
+
+def encode_png(heatmap):
+    """One uint8 heatmap [H, W] as a base64 grayscale PNG data URI"""
+    buffer = io.BytesIO()
+    Image.fromarray(heatmap.numpy(), mode='L').save(buffer, format='PNG', optimize=True)
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def explain(classifier, feature_map, probabilities, class_names, k=EXPLAIN_TOP_K, fmt='uint8'):
+    """JSON-ready explanation of the top-k classes of one image"""
+    confidences, indices = probabilities.topk(min(k, probabilities.numel()))
+    heatmaps = quantize(grad_cam(classifier, feature_map, indices))
+    return {
+        'method': 'grad-cam',
+        'layer': 'features',
+        'grid': list(heatmaps.shape[1:]),
+        'format': fmt,
+        'classes': [
+            {
+                'class': class_names[index],
+                'class_index': index,
+                'confidence': confidence,
+                'heatmap': encode_png(heatmap) if fmt == 'png' else heatmap.tolist(),
+            }
+            for index, confidence, heatmap in zip(indices.tolist(), confidences.tolist(), heatmaps)
+        ],
+    }
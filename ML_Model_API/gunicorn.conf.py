@@ -0,0 +1,37 @@
+"""
+Gunicorn settings for the ML API
+Worker and thread counts follow the CPU topology (see threading_config.py).
+Start with: gunicorn app:app --config gunicorn.conf.py
+"""
+import os
+import threading_config
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv(
+    'GUNICORN_THREADS',
+    threading_config.plan_threads(len(threading_config.available_cores()), workers)['request_threads']
+))
+timeout = 120
+loglevel = 'info'
+
+# Inherited by every worker so app.py can size its torch thread pools
+os.environ['AGROLENS_NUM_WORKERS'] = str(workers)
+
+PIN_WORKERS = os.getenv('PIN_WORKERS') == '1'
+
+
+def pre_fork(server, worker):
+    """Give the new worker the lowest slot not held by a live worker (stable across restarts)"""
+    used = {getattr(w, 'agrolens_slot', None) for w in server.WORKERS.values()}
+    worker.agrolens_slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+
+
+def post_fork(server, worker):
+    slot = worker.agrolens_slot
+    os.environ['AGROLENS_WORKER_INDEX'] = str(slot)
+    if PIN_WORKERS and hasattr(os, 'sched_setaffinity'):
+        cores = threading_config.worker_core_set(threading_config.available_cores(), slot, workers)
+        os.sched_setaffinity(0, cores)
+        os.environ['AGROLENS_PINNED'] = '1'
+        server.log.info(f"Worker {worker.pid} (slot {slot}) pinned to cores {cores}")
@@ -0,0 +1,211 @@
+"""
+Request body ingestion for /api/predict without double buffering
+Raw binary bodies and multipart uploads are read straight into one bounded, preallocated
+buffer; base64 JSON bodies are decoded chunk by chunk into a preallocated bytearray instead
+of being parsed into a str, split and decoded as whole copies.
+"""
+import io
+import os
+import re
+import json
+import binascii
+from flask import Request
+
+# Largest image accepted, enforced before the body is read whenever the size is declared
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+# base64 inflates by 4/3; JSON envelopes get a little slack on top
+MAX_REQUEST_BYTES = MAX_IMAGE_BYTES * 4 // 3 + 64 * 1024
+
+# JSON bodies smaller than this go through the regular parser; larger ones are scanned
+SMALL_JSON_BYTES = 256 * 1024
+
+READ_CHUNK = 64 * 1024
+# Multiple of 4 so every chunk is a whole number of base64 quads
+BASE64_CHUNK = 256 * 1024
+
+# Multipart requests carry one image; the margin allows a stray extra file field
+MAX_FILE_PARTS = 2
+
+_IMAGE_FIELD = re.compile(rb'"image"\s*:\s*"')
+_QUOTE = re.compile(rb'"')
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class BoundedBuffer(io.RawIOBase):
+    """Writable/readable in-memory file over one bytearray that refuses to grow past `limit`"""
+
+    def __init__(self, limit, size_hint=0):
+        self.limit = limit
+        self._buf = bytearray(min(max(size_hint, 0), limit))
+        self._size = 0
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, data):
+        n = len(data)
+        end = self._pos + n
+        if end > self.limit:
+            raise PayloadTooLarge(f"Image exceeds {self.limit} bytes")
+        if end > len(self._buf):
+            # Grow geometrically, never past the limit
+            self._buf.extend(bytes(min(self.limit, max(end, 2 * len(self._buf))) - len(self._buf)))
+        self._buf[self._pos:end] = data
+        self._pos = end
+        self._size = max(self._size, end)
+        return n
+
+    def readinto(self, b):
+        n = max(0, min(len(b), self._size - self._pos))
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        """Zero-copy view of everything written"""
+        return memoryview(self._buf)[:self._size]
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only file over an existing buffer, so PIL can decode without copying it first"""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def open_buffer(data):
+    """File object over image bytes for Image.open()"""
+    if isinstance(data, bytes):
+        return io.BytesIO(data)  # BytesIO shares an immutable bytes object without copying
+    return BufferReader(data)
+
+
+class IngestRequest(Request):
+    """
+    Flask request whose multipart file parts are written into a BoundedBuffer
+    Each buffer starts at the part's own declared size (or READ_CHUNK) and grows as needed.
+    Requests with more than MAX_FILE_PARTS file parts are refused.
+    """
+
+    max_content_length = MAX_REQUEST_BYTES
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        self._file_parts = getattr(self, '_file_parts', 0) + 1
+        if self._file_parts > MAX_FILE_PARTS:
+            raise PayloadTooLarge(f"More than {MAX_FILE_PARTS} file parts in one request")
+        return BoundedBuffer(MAX_IMAGE_BYTES, size_hint=content_length or READ_CHUNK)
+
+
+def check_declared_size(content_length, limit):
+    """Reject before reading anything when the client declares an oversized body"""
+    if content_length is not None and content_length > limit:
+        raise PayloadTooLarge(f"Payload of {content_length} bytes exceeds {limit} bytes")
+
+
+def read_stream(stream, limit, size_hint=None):
+    """Read a stream into one preallocated buffer, failing as soon as `limit` is passed"""
+    buffer = BoundedBuffer(limit, size_hint=size_hint or READ_CHUNK)
+    chunk = bytearray(READ_CHUNK)
+    view = memoryview(chunk)
+    while True:
+        n = stream.readinto(chunk) if hasattr(stream, 'readinto') else _read_fallback(stream, chunk)
+        if not n:
+            break
+        buffer.write(view[:n])
+    return buffer.getbuffer()
+
+
+def _read_fallback(stream, chunk):
+    data = stream.read(len(chunk))
+    chunk[:len(data)] = data
+    return len(data)
+
+
+def read_file_storage(file_storage):
+    """Bytes view of an uploaded multipart file (zero-copy when IngestRequest buffered it)"""
+    stream = file_storage.stream
+    if isinstance(stream, BoundedBuffer):
+        return stream.getbuffer()
+    return read_stream(stream, MAX_IMAGE_BYTES)
+
+
+def decode_base64_into(src, limit=MAX_IMAGE_BYTES):
+    """Decode clean base64 (no whitespace/escapes) chunk by chunk into a preallocated bytearray"""
+    src = memoryview(src).cast('B')
+    out = bytearray(len(src) * 3 // 4)
+    if len(out) > limit + 2:
+        raise PayloadTooLarge(f"Image exceeds {limit} bytes")
+    pos = 0
+    for start in range(0, len(src), BASE64_CHUNK):
+        decoded = binascii.a2b_base64(src[start:start + BASE64_CHUNK])
+        out[pos:pos + len(decoded)] = decoded
+        pos += len(decoded)
+    del out[pos:]  # Trailing '=' padding decodes to fewer bytes than preallocated
+    return out
+
+
+def parse_json_body(body):
+    """
+    (parsed_json_or_None, image_bytes_or_None) for a JSON request body
+
+    Small bodies are parsed normally. Large bodies are assumed to carry a base64 'image'
+    field, which is located in the raw bytes and decoded in place; anything the scanner
+    can't handle safely (escapes, line breaks) falls back to the regular parser.
+    """
+    if len(body) <= SMALL_JSON_BYTES:
+        return json.loads(bytes(body)), None
+
+    match = _IMAGE_FIELD.search(body)
+    if match:
+        start = match.end()
+        # Searched in place: read_stream hands over a memoryview, and bytes() would copy it
+        quote = _QUOTE.search(body, start)
+        end = quote.start() if quote else -1
+        if end != -1:
+            value = memoryview(body)[start:end]
+            if value[:5] == b'data:':
+                comma = bytes(value[:256]).find(b',')
+                value = value[comma + 1:] if comma != -1 else value
+            if not re.search(rb'[\\\s]', value):
+                return None, decode_base64_into(value)
+
+    return json.loads(bytes(body)), None
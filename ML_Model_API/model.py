@@ -0,0 +1,396 @@
+# ================================
+# MobileNetV2 Training (PyTorch, GPU) with tqdm
+# ================================
+# Run directly for a full training run (test evaluation + curves), or import and call
+# train(config) with overrides of default_config() (see sweep.py)
+import torch
+import torchvision
+import torch.nn as nn
+import torch.optim as optim
+from torchvision import models
+import numpy as np
+import time, os, argparse
+from tqdm import tqdm
+import data_pipeline
+import checkpoint
+import evaluate
+import model_bundle
+
+# ================================
+# Device setup
+# ================================
+def select_device():
+    # Use DirectML for AMD GPU (Radeon RX 6600M)
+    try:
+        import torch_directml
+        device = torch_directml.device()
+        print("Using device: DirectML (AMD Radeon RX 6600M)")
+    except ImportError:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print("Using device:", device)
+    return device
+
+# ================================
+# Dataset path
+# ================================
+
+# data_dir = r"F:\proj\dataset_split"
+data_dir=r"E:\data\dataset_split"
+# data_dir may also be a packed shard directory produced by shard_dataset.py
+
+train_dir = os.path.join(data_dir, "train")
+val_dir   = os.path.join(data_dir, "val")
+test_dir  = os.path.join(data_dir, "test")
+
+# ================================
+# Hyperparameters
+# ================================
+img_size = 224
+batch_size = 32
+epochs = 30
+learning_rate = 1e-4
+weight_decay = 1e-4
+label_smoothing = 0.1
+patience = 5
+unfreeze_last = 20      # Trailing parameter tensors left trainable (0 = fine-tune everything)
+
+# ================================
+# Training mode
+# ================================
+use_amp = True          # bfloat16 autocast on CPU, fp16/bf16 on CUDA (ignored on DirectML)
+channels_last = True    # NHWC tensors; oneDNN/cuDNN convolutions are faster in this layout
+accum_steps = 1         # Gradient accumulation: effective batch = batch_size * accum_steps
+
+# ================================
+# Checkpointing
+# ================================
+# Full checkpoints (model, optimizer, scheduler, RNG, history) let a preempted run resume
+checkpoint_dir = "checkpoints"
+checkpoint_every = 1    # Epochs between full checkpoints
+keep_checkpoints = 2
+
+# ================================
+# Data pipeline
+# ================================
+# Worker processes decode in parallel with training; the main thread only runs the model
+num_workers = data_pipeline.default_num_workers()
+prefetch_factor = 4
+
+# Optional decoded-pixel cache: first run decodes every JPEG once into a memmapped
+# uint8 array, later epochs (and later runs) read pixels straight from it
+cache_dir = None  # e.g. r"E:\data\decoded_cache"
+cache_resolution = data_pipeline.DEFAULT_CACHE_RESOLUTION
+
+
+
+def default_config():
+    """Every knob train() takes, defaulting to the module settings above"""
+    return {
+        'data_dir': data_dir,
+        'img_size': img_size,
+        'batch_size': batch_size,
+        'epochs': epochs,
+        'learning_rate': learning_rate,
+        'weight_decay': weight_decay,
+        'label_smoothing': label_smoothing,
+        'patience': patience,
+        'unfreeze_last': unfreeze_last,
+        'use_amp': use_amp,
+        'channels_last': channels_last,
+        'accum_steps': accum_steps,
+        'checkpoint_dir': checkpoint_dir,
+        'checkpoint_every': checkpoint_every,
+        'keep_checkpoints': keep_checkpoints,
+        'num_workers': num_workers,
+        'prefetch_factor': prefetch_factor,
+        'cache_dir': cache_dir,
+        'cache_resolution': cache_resolution,
+        'output_dir': '.',      # best_mobilenetv2.pth / .bundle are written here
+        'resume': None,         # checkpoint path, or 'latest' in checkpoint_dir
+        'evaluate_test': False,
+        'progress': True,       # tqdm bars
+    }
+
+
+# ================================
+# Mixed precision setup
+# ================================
+def amp_settings(device, use_amp=use_amp):
+    """(enabled, autocast device type, dtype, GradScaler) for the training device"""
+    if not use_amp or device.type not in ('cpu', 'cuda'):
+        return False, 'cpu', torch.float32, torch.amp.GradScaler('cuda', enabled=False)
+    if device.type == 'cuda':
+        if torch.cuda.is_bf16_supported():
+            return True, 'cuda', torch.bfloat16, torch.amp.GradScaler('cuda', enabled=False)
+        # fp16 needs loss scaling to keep small gradients from underflowing
+        return True, 'cuda', torch.float16, torch.amp.GradScaler('cuda', enabled=True)
+    return True, 'cpu', torch.bfloat16, torch.amp.GradScaler('cuda', enabled=False)
+
+
+# ================================
+# Training Function with tqdm
+# ================================
+def train_model(model, criterion, optimizer, scheduler, dataloaders, device, config, resume_state=None):
+    num_epochs, patience = config['epochs'], config['patience']
+    channels_last, accum_steps = config['channels_last'], config['accum_steps']
+    checkpoint_dir, checkpoint_every = config['checkpoint_dir'], config['checkpoint_every']
+    weights_path = os.path.join(config['output_dir'], "best_mobilenetv2.pth")
+    history = {"train_loss": [], "val_loss": [], "train_acc": [], "val_acc": [],
+               "train_images_per_sec": [], "val_images_per_sec": []}
+    best_acc = 0.0
+    # Preallocated once; improvements copy into it in place instead of deep-copying
+    best_model_wts = {k: v.detach().to('cpu', copy=True) for k, v in model.state_dict().items()}
+    no_improve = 0
+    start_epoch = 0
+
+    amp_enabled, amp_device, amp_dtype, scaler = amp_settings(device, config['use_amp'])
+    if amp_enabled:
+        print(f"Mixed precision: {amp_dtype} autocast on {amp_device}")
+
+    if resume_state is not None:
+        start_epoch = checkpoint.restore_training_state(resume_state, model, optimizer, scheduler, scaler)
+        history = resume_state['history']
+        best_acc = resume_state['best_acc']
+        no_improve = resume_state['no_improve']
+        for k, v in resume_state['best_model_wts'].items():
+            best_model_wts[k].copy_(v)
+        print(f"Resumed after epoch {start_epoch} (best val acc so far: {best_acc:.4f})")
+
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    writer = checkpoint.AsyncCheckpointWriter(checkpoint_dir, keep_last=config['keep_checkpoints']) if checkpoint_dir else None
+
+    for epoch in range(start_epoch, num_epochs):
+        print(f"\nEpoch {epoch+1}/{num_epochs}")
+        print("-" * 20)
+
+        for phase in ['train', 'val']:
+            if phase == 'train':
+                model.train()
+            else:
+                model.eval()
+
+            running_loss, running_corrects = 0.0, 0
+            num_batches = len(dataloaders[phase])
+            optimizer.zero_grad(set_to_none=True)
+            phase_start = time.perf_counter()
+
+            loop = tqdm(dataloaders[phase], desc=f"{phase} Epoch {epoch+1}", leave=False,
+                        disable=not config['progress'])
+            for step, (inputs, labels) in enumerate(loop):
+                inputs = inputs.to(device, non_blocking=True)
+                labels = labels.to(device, non_blocking=True)
+                if channels_last:
+                    inputs = inputs.contiguous(memory_format=torch.channels_last)
+
+                with torch.set_grad_enabled(phase == 'train'):
+                    with torch.autocast(device_type=amp_device, dtype=amp_dtype, enabled=amp_enabled):
+                        outputs = model(inputs)
+                    loss = criterion(outputs.float(), labels)
+                    _, preds = torch.max(outputs, 1)
+
+                    if phase == 'train':
+                        scaler.scale(loss / accum_steps).backward()
+                        if (step + 1) % accum_steps == 0 or step + 1 == num_batches:
+                            scaler.step(optimizer)
+                            scaler.update()
+                            optimizer.zero_grad(set_to_none=True)
+
+                running_loss += loss.item() * inputs.size(0)
+                running_corrects += torch.sum(preds == labels.data)
+
+                # Update tqdm postfix
+                loop.set_postfix(loss=loss.item(), acc=(running_corrects.double() / ((loop.n + 1) * inputs.size(0))).item())
+
+            # Compute epoch metrics
+            num_images = len(dataloaders[phase].dataset)
+            images_per_sec = num_images / (time.perf_counter() - phase_start)
+            epoch_loss = running_loss / num_images
+            epoch_acc = running_corrects.double() / num_images
+
+            history[phase + "_loss"].append(epoch_loss)
+            history[phase + "_acc"].append(epoch_acc.item())
+            history[phase + "_images_per_sec"].append(images_per_sec)
+
+            print(f"{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} ({images_per_sec:.1f} images/sec)")
+
+            if phase == 'val':
+                scheduler.step()
+                if epoch_acc > best_acc:
+                    best_acc = epoch_acc
+                    for k, v in model.state_dict().items():
+                        best_model_wts[k].copy_(v)
+                    torch.save(best_model_wts, weights_path)
+                    no_improve = 0
+                else:
+                    no_improve += 1
+
+        stopping = no_improve >= patience
+        if writer and ((epoch + 1) % checkpoint_every == 0 or stopping or epoch + 1 == num_epochs):
+            # CPU snapshot now, serialization and disk write on the writer thread
+            writer.submit(checkpoint.snapshot_training_state(
+                epoch, model, optimizer, scheduler, scaler,
+                history=history, best_acc=float(best_acc), no_improve=no_improve,
+                best_model_wts=best_model_wts
+            ))
+
+        if stopping:
+            print("Early stopping triggered!")
+            break
+
+    if writer:
+        writer.close()
+
+    print(f"\nBest Val Acc: {best_acc:.4f}")
+    model.load_state_dict(best_model_wts)
+    return model, history
+
+
+def build_model(num_classes, unfreeze_last=unfreeze_last):
+    """ImageNet-pretrained MobileNetV2 with a new classifier; only the last unfreeze_last tensors train"""
+    model = models.mobilenet_v2(weights='IMAGENET1K_V1')
+
+    # Freeze most layers, unfreeze last few
+    if unfreeze_last:
+        for param in list(model.parameters())[:-unfreeze_last]:
+            param.requires_grad = False
+
+    # Replace classifier
+    model.classifier[1] = nn.Linear(model.last_channel, num_classes)
+    return model
+
+
+def train(config=None, device=None):
+    """
+    One training run; config overrides default_config()
+    Returns a summary dict: best_val_acc, epochs_completed, stopped_early, history,
+    class_names, the trained model, artifact paths and (if evaluate_test) test_report
+    """
+    config = {**default_config(), **(config or {})}
+    device = device or select_device()
+    os.makedirs(config['output_dir'], exist_ok=True)
+
+    # ================================
+    # Load datasets
+    # ================================
+    image_datasets = data_pipeline.load_datasets(
+        config['data_dir'], data_pipeline.build_transforms(config['img_size']),
+        cache_dir=config['cache_dir'], cache_resolution=config['cache_resolution'],
+        num_workers=config['num_workers']
+    )
+    dataloaders = data_pipeline.build_dataloaders(
+        image_datasets, config['batch_size'],
+        num_workers=config['num_workers'], prefetch_factor=config['prefetch_factor']
+    )
+
+    class_names = image_datasets['train'].classes
+    num_classes = len(class_names)
+    print("Number of classes:", num_classes)
+    print("Classes:", class_names)
+
+    # ================================
+    # Load MobileNetV2
+    # ================================
+    model = build_model(num_classes, config['unfreeze_last']).to(device)
+
+    # ================================
+    # Loss & Optimizer
+    # ================================
+    criterion = nn.CrossEntropyLoss(label_smoothing=config['label_smoothing'])
+    optimizer = optim.AdamW(model.parameters(), lr=config['learning_rate'], weight_decay=config['weight_decay'])
+    scheduler = optim.lr_scheduler.CosineAnnealingWarmRestarts(optimizer, T_0=5, T_mult=2)
+
+    # ================================
+    # Train
+    # ================================
+    resume_state = None
+    if config['resume']:
+        resume_path = (checkpoint.latest_checkpoint(config['checkpoint_dir'])
+                       if config['resume'] == 'latest' else config['resume'])
+        if resume_path is None:
+            print(f"No checkpoint found in {config['checkpoint_dir']}, starting from scratch")
+        else:
+            print(f"Resuming from {resume_path}")
+            resume_state = checkpoint.load_checkpoint(resume_path)
+
+    model, history = train_model(model, criterion, optimizer, scheduler, dataloaders, device, config,
+                                 resume_state=resume_state)
+
+    # Self-describing serving artifact: best weights + class table + preprocessing in one file
+    bundle_path = os.path.join(config['output_dir'], "best_mobilenetv2.bundle")
+    model_bundle.pack(model.state_dict(), bundle_path, class_names,
+                      preprocessing=dict(model_bundle.DEFAULT_PREPROCESSING,
+                                         resize=[config['img_size'], config['img_size']]),
+                      extra={'source': 'model.py'})
+    print(f"Saved {bundle_path}")
+
+    epochs_completed = len(history['val_acc'])
+    result = {
+        'best_val_acc': max(history['val_acc'], default=0.0),
+        'epochs_completed': epochs_completed,
+        'stopped_early': epochs_completed < config['epochs'],
+        'history': history,
+        'class_names': class_names,
+        'model': model,
+        'weights_path': os.path.join(config['output_dir'], "best_mobilenetv2.pth"),
+        'bundle_path': bundle_path,
+    }
+    if config['evaluate_test']:
+        result['test_report'] = evaluate.evaluate(model, dataloaders['test'], device, num_classes, class_names)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train MobileNetV2 on the plant disease dataset")
+    parser.add_argument('--resume', nargs='?', const='latest', default=None,
+                        help="checkpoint to resume from; without a value, the newest in --checkpoint-dir")
+    parser.add_argument('--checkpoint-dir', default=checkpoint_dir)
+    parser.add_argument('--checkpoint-every', type=int, default=checkpoint_every,
+                        help="epochs between full checkpoints")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = train({
+        'resume': args.resume,
+        'checkpoint_dir': args.checkpoint_dir,
+        'checkpoint_every': args.checkpoint_every,
+        'evaluate_test': True,
+    })
+    history, test_report = result['history'], result['test_report']
+
+    # ================================
+    # Test Evaluation
+    # ================================
+    print("\nTest Results:")
+    print(f"Accuracy: {test_report['accuracy']:.4f}")
+    print(f"Top-5 Accuracy: {test_report.get('top5_accuracy', 1.0):.4f}")
+    print(f"Precision: {test_report['precision_weighted']:.4f}")
+    print(f"Recall: {test_report['recall_weighted']:.4f}")
+    print(f"F1 Score: {test_report['f1_weighted']:.4f}")
+    print(f"Calibration Error (ECE): {test_report['expected_calibration_error']:.4f}")
+
+    # ================================
+    # Plot Curves
+    # ================================
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12,5))   
+    plt.subplot(1,2,1)
+    plt.plot(history['train_acc'], label='Train Acc')
+    plt.plot(history['val_acc'], label='Val Acc')
+    plt.legend(); plt.title("Accuracy")
+
+    plt.subplot(1,2,2)
+    plt.plot(history['train_loss'], label='Train Loss')
+    plt.plot(history['val_loss'], label='Val Loss')
+    plt.legend(); plt.title("Loss")
+
+    plt.show()
+
+
+# Guarded so DataLoader worker processes (spawned on Windows) don't re-run training
+if __name__ == "__main__":
+    main()
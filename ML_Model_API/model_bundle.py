@@ -0,0 +1,298 @@
+"""
+Self-describing model bundle: weights, class table, preprocessing and architecture in one file
+Layout (safetensors-style):
+    8 bytes   little-endian u64, length of the JSON header
+    header    JSON: {"format", "version", "tensors": {name: {dtype, shape, offsets}}, "metadata"}
+              padded with spaces so the data section starts 64-byte aligned
+    data      raw little-endian tensor bytes, each tensor 64-byte aligned; offsets are
+              relative to the start of this section
+
+Loading maps the file copy-on-write and wraps each tensor around the mapping, so weights are
+never copied into the heap and every worker shares the same page-cache pages.
+
+Usage:
+    python model_bundle.py pack best_mobilenetv2.pth --class-names class_names.txt --output best_mobilenetv2.bundle
+    python model_bundle.py inspect best_mobilenetv2.bundle [--verify]
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import contextlib
+import torch
+import torch.nn as nn
+from torchvision import models, transforms
+
+BUNDLE_FORMAT = 'agrolens-bundle'
+BUNDLE_VERSION = 1
+ALIGNMENT = 64
+
+DEFAULT_PREPROCESSING = {
+    'resize': [224, 224],
+    'interpolation': 'bilinear',
+    'mean': [0.485, 0.456, 0.406],
+    'std': [0.229, 0.224, 0.225],
+    'color_mode': 'RGB',
+}
+
+_DTYPES = {
+    torch.float32: 'F32', torch.float16: 'F16', torch.bfloat16: 'BF16', torch.float64: 'F64',
+    torch.int64: 'I64', torch.int32: 'I32', torch.int16: 'I16', torch.int8: 'I8', torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+_DTYPE_NAMES = {name: dtype for dtype, name in _DTYPES.items()}
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def mobilenet_architecture(num_classes, hidden_channels=None):
+    """hidden_channels: {features index: width} for blocks narrowed by prune.py"""
+    architecture = {'name': 'mobilenet_v2', 'num_classes': num_classes, 'last_channel': 1280}
+    if hidden_channels:
+        architecture['hidden_channels'] = hidden_channels
+    return architecture
+
+
+def pack(state_dict, out_path, class_names, preprocessing=None, architecture=None, extra=None):
+    """Write a bundle; returns its header. Atomic: readers never see a half-written file"""
+    tensors = {name: t.detach().cpu().contiguous() for name, t in state_dict.items()}
+    num_classes = tensors['classifier.1.weight'].shape[0]
+    if len(class_names) != num_classes:
+        raise ValueError(f"Model has {num_classes} outputs but {len(class_names)} class names were given")
+
+    entries, offset = {}, 0
+    for name, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        entries[name] = {'dtype': _DTYPES[tensor.dtype], 'shape': list(tensor.shape), 'offsets': [offset, offset + size]}
+        offset = _align(offset + size)
+
+    digest = hashlib.sha256()
+    for name, tensor in tensors.items():
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() else b'')
+
+    header = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'tensors': entries,
+        'metadata': {
+            'architecture': architecture or mobilenet_architecture(num_classes),
+            'class_names': list(class_names),
+            'preprocessing': preprocessing or DEFAULT_PREPROCESSING,
+            'content_hash': f"sha256:{digest.hexdigest()}",
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            **(extra or {}),
+        },
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (_align(8 + len(header_bytes)) - 8 - len(header_bytes))
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        data_start = f.tell()
+        for name, tensor in tensors.items():
+            f.seek(data_start + entries[name]['offsets'][0])
+            if tensor.numel():
+                f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, out_path)
+    return header
+
+
+def read_header(path):
+    """(header dict, data section offset); raises ValueError if path is not a bundle"""
+    with open(path, 'rb') as f:
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            raise ValueError(f"{path} is not a model bundle")
+        (length,) = struct.unpack('<Q', prefix)
+        if length > 64 * 1024 * 1024:
+            raise ValueError(f"{path} is not a model bundle")
+        try:
+            header = json.loads(f.read(length))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ValueError(f"{path} is not a model bundle")
+    if not isinstance(header, dict) or header.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not a model bundle")
+    return header, 8 + length
+
+
+def is_bundle(path):
+    try:
+        read_header(path)
+        return True
+    except (OSError, ValueError, struct.error):
+        return False
+
+
+def load_state_dict(path):
+    """Zero-copy state dict over a copy-on-write mapping of the bundle; returns (state_dict, metadata)"""
+    header, data_start = read_header(path)
+    with open(path, 'rb') as f:
+        # ACCESS_COPY: pages stay shared with the page cache (and other workers) unless written
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict = {}
+    for name, entry in header['tensors'].items():
+        dtype = _DTYPE_NAMES[entry['dtype']]
+        begin, end = entry['offsets']
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            state_dict[name] = torch.empty(entry['shape'], dtype=dtype)
+            continue
+        state_dict[name] = torch.frombuffer(mapping, dtype=dtype, count=count,
+                                            offset=data_start + begin).view(entry['shape'])
+    return state_dict, header['metadata']
+
+
+def verify(path):
+    """True if the tensor bytes still match the content hash recorded at pack time"""
+    state_dict, metadata = load_state_dict(path)
+    digest = hashlib.sha256()
+    for tensor in state_dict.values():
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() else b'')
+    return metadata['content_hash'] == f"sha256:{digest.hexdigest()}"
+
+
+@contextlib.contextmanager
+def _skip_weight_init():
+    """Make torch.nn.init a no-op while building a model whose weights are assigned afterwards"""
+    names = ('kaiming_normal_', 'kaiming_uniform_', 'normal_', 'uniform_', 'zeros_', 'ones_')
+    saved = {name: getattr(nn.init, name) for name in names}
+    for name in names:
+        setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, fn in saved.items():
+            setattr(nn.init, name, fn)
+
+
+def _select_bn(bn, keep):
+    new = nn.BatchNorm2d(len(keep), eps=bn.eps, momentum=bn.momentum)
+    new.weight = nn.Parameter(bn.weight.detach()[keep].clone())
+    new.bias = nn.Parameter(bn.bias.detach()[keep].clone())
+    new.running_mean = bn.running_mean[keep].clone()
+    new.running_var = bn.running_var[keep].clone()
+    new.num_batches_tracked = bn.num_batches_tracked.clone()
+    return new
+
+
+def shrink_block(block, keep):
+    """Rebuild an expanded inverted residual with only the hidden channels in keep (LongTensor)"""
+    expand, depthwise, project = block.conv[0][0], block.conv[1][0], block.conv[2]
+    n = len(keep)
+
+    new_expand = nn.Conv2d(expand.in_channels, n, 1, bias=False)
+    new_expand.weight = nn.Parameter(expand.weight.detach()[keep].clone())
+    new_depthwise = nn.Conv2d(n, n, depthwise.kernel_size, stride=depthwise.stride,
+                              padding=depthwise.padding, groups=n, bias=False)
+    new_depthwise.weight = nn.Parameter(depthwise.weight.detach()[keep].clone())
+    new_project = nn.Conv2d(n, project.out_channels, 1, bias=False)
+    new_project.weight = nn.Parameter(project.weight.detach()[:, keep].clone())
+
+    block.conv[0][0], block.conv[0][1] = new_expand, _select_bn(block.conv[0][1], keep)
+    block.conv[1][0], block.conv[1][1] = new_depthwise, _select_bn(block.conv[1][1], keep)
+    block.conv[2] = new_project
+    return block
+
+
+def apply_hidden_channels(model, channels):
+    """Resize blocks to a {features index: hidden channels} table (rebuilds pruned bundles; also used by prune.py)"""
+    for index, count in channels.items():
+        block = model.features[int(index)]
+        if block.conv[1][0].out_channels != count:
+            shrink_block(block, torch.arange(count))
+    return model
+
+
+def build_model(architecture):
+    """Empty model for the architecture metadata, on the meta device (no memory, no init)"""
+    if architecture['name'] != 'mobilenet_v2':
+        raise ValueError(f"Unsupported architecture: {architecture['name']}")
+    with torch.device('meta'), _skip_weight_init():
+        model = models.mobilenet_v2(weights=None)
+        model.classifier[1] = nn.Linear(model.last_channel, architecture['num_classes'])
+        if architecture.get('hidden_channels'):
+            apply_hidden_channels(model, architecture['hidden_channels'])
+    return model
+
+
+def load_model(path, device='cpu'):
+    """(model in eval mode, metadata); parameters alias the mapped file on cpu"""
+    state_dict, metadata = load_state_dict(path)
+    model = build_model(metadata['architecture'])
+    model.load_state_dict(state_dict, assign=True)
+    return model.to(device).eval(), metadata
+
+
+def build_transform(preprocessing):
+    """Inference transform described by a bundle's preprocessing spec"""
+    interpolation = transforms.InterpolationMode(preprocessing.get('interpolation', 'bilinear'))
+    return transforms.Compose([
+        transforms.Resize(tuple(preprocessing['resize']), interpolation=interpolation),
+        transforms.ToTensor(),
+        transforms.Normalize(preprocessing['mean'], preprocessing['std']),
+    ])
+
+
+# ================================
+# Packer CLI
+# ================================
+def _class_names_from(args):
+    if args.class_names:
+        with open(args.class_names, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    from shard_dataset import is_sharded_split, read_shard_meta
+    train_dir = os.path.join(args.data_dir, 'train')
+    if is_sharded_split(train_dir):
+        return read_shard_meta(train_dir)['classes']
+    return sorted(d for d in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, d)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect self-describing model bundles")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help="bundle a state dict or training checkpoint")
+    pack_parser.add_argument('weights', help="best_mobilenetv2.pth or checkpoints/checkpoint_epoch_*.pth")
+    source = pack_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--class-names', help="class_names.txt")
+    source.add_argument('--data-dir', help="dataset_split directory to read the class table from")
+    pack_parser.add_argument('--img-size', type=int, default=224)
+    pack_parser.add_argument('--output', default='best_mobilenetv2.bundle')
+    inspect_parser = subparsers.add_parser('inspect', help="print a bundle's metadata")
+    inspect_parser.add_argument('bundle')
+    inspect_parser.add_argument('--verify', action='store_true', help="recompute the content hash")
+    args = parser.parse_args()
+
+    if args.command == 'inspect':
+        header, data_start = read_header(args.bundle)
+        metadata = dict(header['metadata'])
+        num_names = len(metadata.pop('class_names'))
+        print(json.dumps(metadata, indent=2))
+        print(f"{len(header['tensors'])} tensors, {num_names} classes, data at byte {data_start}")
+        if args.verify:
+            ok = verify(args.bundle)
+            print("✅ Content hash matches" if ok else "❌ Content hash mismatch")
+            return 0 if ok else 1
+        return 0
+
+    obj = torch.load(args.weights, map_location='cpu', weights_only=False)
+    if isinstance(obj, dict) and 'model' in obj and 'epoch' in obj:
+        obj = obj['model']  # Training checkpoint
+    class_names = _class_names_from(args)
+    preprocessing = dict(DEFAULT_PREPROCESSING, resize=[args.img_size, args.img_size])
+    header = pack(obj, args.output, class_names, preprocessing=preprocessing,
+                  extra={'source': os.path.basename(args.weights)})
+    print(f"✅ Wrote {args.output} ({len(class_names)} classes, {header['metadata']['content_hash'][:19]}...)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Perceptual hashing for near-duplicate images
+A 64-bit DCT pHash survives re-encoding, resizing and small shifts, so bursts of nearly
+identical uploads land within a few bits of each other.
+
+Serving: NearDuplicateCache, an LRU of recent predictions indexed by a multi-index hash
+table (the hash is split into max_distance + 1 chunks; by pigeonhole any hash within
+max_distance bits matches at least one chunk exactly).
+
+Offline: BKTree plus a dedupe CLI for the dataset:
+    python phash.py dedupe dataset_split [--max-distance 4] [--output duplicates.json]
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def phash(image):
+    """64-bit perceptual hash of a PIL image (any size; the serving path passes the 224px thumbnail)"""
+    pixels = np.asarray(image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR), dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # Median of the low frequencies, leaving out the DC term (overall brightness)
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# ================================
+# Serving: LRU + multi-index hash table
+# ================================
+class NearDuplicateCache:
+    """Recent hash -> cached value; lookups find any entry within max_distance bits"""
+
+    def __init__(self, capacity=4096, max_distance=4):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.num_chunks = min(max_distance + 1, 16)
+        bits = HASH_SIZE * HASH_SIZE
+        bounds = np.linspace(0, bits, self.num_chunks + 1).astype(int)
+        self._chunks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self._tables = [dict() for _ in self._chunks]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _keys(self, image_hash):
+        return [(image_hash >> shift) & mask for shift, mask in self._chunks]
+
+    def get(self, image_hash):
+        """(value, distance) of the closest entry within max_distance, else None"""
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                for candidate in table.get(key, ()):
+                    distance = hamming(candidate, image_hash)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best], best_distance
+
+    def put(self, image_hash, value):
+        with self._lock:
+            if image_hash in self._entries:
+                self._entries.move_to_end(image_hash)
+                self._entries[image_hash] = value
+                return
+            self._entries[image_hash] = value
+            for table, key in zip(self._tables, self._keys(image_hash)):
+                table.setdefault(key, set()).add(image_hash)
+            while len(self._entries) > self.capacity:
+                evicted, _ = self._entries.popitem(last=False)
+                for table, key in zip(self._tables, self._keys(evicted)):
+                    bucket = table[key]
+                    bucket.discard(evicted)
+                    if not bucket:
+                        del table[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# ================================
+# Offline: BK-tree + dataset dedupe
+# ================================
+class BKTree:
+    """Metric tree over Hamming distance; search only descends edges that can hold a match"""
+
+    def __init__(self):
+        self._root = None  # [hash, items, {distance: child}]
+
+    def add(self, image_hash, item):
+        if self._root is None:
+            self._root = [image_hash, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(image_hash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [image_hash, [item], {}]
+                return
+            node = child
+
+    def search(self, image_hash, max_distance):
+        """[(distance, item)] for every item within max_distance"""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(image_hash, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children at |d - max_distance| .. d + max_distance can match
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+def _hash_file(path):
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (DCT_SIZE * 4, DCT_SIZE * 4))  # Let JPEG decode at reduced size
+            return path, phash(image)
+    except Exception:
+        return path, None
+
+
+def find_duplicates(root, max_distance=4, workers=None):
+    """Groups of near-duplicate image paths under root (first path of a group is kept)"""
+    paths = sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, files in os.walk(root)
+        for name in files if name.lower().endswith(IMG_EXTENSIONS)
+    )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashes = [(p, h) for p, h in pool.map(_hash_file, paths, chunksize=64) if h is not None]
+
+    tree = BKTree()
+    grouped = set()
+    groups = []
+    for path, image_hash in hashes:
+        if path not in grouped:
+            matches = sorted((d, p) for d, p in tree.search(image_hash, max_distance) if p not in grouped)
+            if matches:
+                group = [p for _, p in matches] + [path]
+                grouped.update(group)
+                groups.append(group)
+        tree.add(image_hash, path)
+    return groups, len(hashes), len(paths) - len(hashes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dedupe = subparsers.add_parser('dedupe', help="find near-duplicate images in a directory tree")
+    dedupe.add_argument('root', help="dataset directory (e.g. dataset_split; cross-split pairs show leakage)")
+    dedupe.add_argument('--max-distance', type=int, default=4, help="Hamming distance threshold (bits)")
+    dedupe.add_argument('--workers', type=int, default=None)
+    dedupe.add_argument('--output', default='duplicates.json')
+    args = parser.parse_args()
+
+    groups, hashed, unreadable = find_duplicates(args.root, args.max_distance, args.workers)
+    duplicates = sum(len(g) - 1 for g in groups)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump([{'keep': g[0], 'duplicates': g[1:]} for g in groups], f, indent=2)
+
+    print(f"\n{'='*60}")
+    print(f"Hashed {hashed} images ({unreadable} unreadable)")
+    print(f"Found {len(groups)} near-duplicate groups, {duplicates} redundant images")
+    print(f"✅ Report written to {args.output}")
+    print(f"{'='*60}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
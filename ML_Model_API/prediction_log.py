@@ -0,0 +1,228 @@
+"""
+Append-only prediction log, partitioned by day
+Each flush writes one columnar segment (.npz) plus a small summary sidecar (.json) with
+pre-aggregated class counts and histograms. Queries add up the summaries of segments inside
+the time range and only read rows from the segments that straddle its edges.
+
+Layout: <PREDICTION_LOG_DIR>/date=YYYY-MM-DD/seg-<first_ts_ms>-<pid>.npz (+ .summary.json)
+Every gunicorn worker has its own writer; the pid in the file name keeps segments apart.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.getenv('PREDICTION_LOG_DIR', 'prediction_logs')
+FLUSH_ROWS = int(os.getenv('PREDICTION_LOG_FLUSH_ROWS', 1000))
+FLUSH_SECONDS = float(os.getenv('PREDICTION_LOG_FLUSH_SECONDS', 10))
+QUEUE_SIZE = 10000
+
+TOP_K = 5
+CONFIDENCE_BINS = 20
+# Latency histogram edges in milliseconds: log-spaced so percentiles stay accurate from 0.1ms to 60s
+LATENCY_EDGES_MS = np.geomspace(0.1, 60000, 65)
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+def _latency_hist(values_ms):
+    counts, _ = np.histogram(np.clip(values_ms, LATENCY_EDGES_MS[0], LATENCY_EDGES_MS[-1]), bins=LATENCY_EDGES_MS)
+    return counts
+
+
+def summarize(columns, num_classes):
+    """Pre-aggregated view of one segment, merged by query() instead of re-reading rows"""
+    top1 = columns['topk_indices'][:, 0].astype(np.int64)
+    confidence = columns['topk_confidences'][:, 0]
+    return {
+        'count': int(len(top1)),
+        't_min': float(columns['ts'].min()) if len(top1) else None,
+        't_max': float(columns['ts'].max()) if len(top1) else None,
+        'class_counts': np.bincount(top1, minlength=num_classes).tolist(),
+        'confidence_hist': np.histogram(confidence, bins=CONFIDENCE_BINS, range=(0.0, 1.0))[0].tolist(),
+        'latency_hist': {
+            str(stage): _latency_hist(columns['latency_ms'][:, i]).tolist()
+            for i, stage in enumerate(columns['stages'])
+        },
+    }
+
+
+class PredictionLog:
+    """Batched background writer; record() never blocks the request thread"""
+
+    def __init__(self, log_dir=LOG_DIR, num_classes=97, model_version='unknown', stages=(),
+                 flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.log_dir = log_dir
+        self.num_classes = num_classes
+        self.model_version = model_version
+        self.stages = tuple(stages)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name='prediction-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, content_hash, topk_indices, topk_confidences, latency_ms, ts=None):
+        """Queue one prediction; latency_ms maps stage name -> milliseconds"""
+        row = (ts or time.time(), content_hash, topk_indices, topk_confidences,
+               [latency_ms.get(stage, 0.0) for stage in self.stages])
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1  # Losing a log row beats stalling a request
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=30)
+
+    def _run(self):
+        rows = []
+        deadline = time.monotonic() + self.flush_seconds
+        while True:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = False
+            if row:
+                rows.append(row)
+            if row is None or len(rows) >= self.flush_rows or time.monotonic() >= deadline:
+                try:
+                    self._flush(rows)
+                except Exception as e:
+                    logger.error(f"Prediction log flush failed ({len(rows)} rows lost): {e}")
+                rows = []
+                deadline = time.monotonic() + self.flush_seconds
+            if row is None:
+                return
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        # A batch may straddle midnight; split it so every segment sits in exactly one day
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(_day(row[0]), []).append(row)
+        for day, day_rows in by_day.items():
+            self._write_segment(day, day_rows)
+
+    def _write_segment(self, day, rows):
+        k = TOP_K
+        columns = {
+            'ts': np.array([r[0] for r in rows], dtype=np.float64),
+            'content_hash': np.array([r[1] for r in rows], dtype='S32'),
+            'model_version': np.array([self.model_version] * len(rows)),
+            'topk_indices': np.array([list(r[2][:k]) + [-1] * (k - len(r[2][:k])) for r in rows], dtype=np.int16),
+            'topk_confidences': np.array([list(r[3][:k]) + [0.0] * (k - len(r[3][:k])) for r in rows],
+                                         dtype=np.float32),
+            'latency_ms': np.array([r[4] for r in rows], dtype=np.float32).reshape(len(rows), len(self.stages)),
+            'stages': np.array(self.stages),
+        }
+        summary = summarize(columns, self.num_classes)
+        summary['model_version'] = self.model_version
+
+        day_dir = os.path.join(self.log_dir, f"date={day}")
+        os.makedirs(day_dir, exist_ok=True)
+        base = os.path.join(day_dir, f"seg-{int(columns['ts'][0] * 1000)}-{os.getpid()}")
+        with open(base + '.npz.tmp', 'wb') as f:
+            np.savez(f, **columns)
+        with open(base + '.summary.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(summary, f)
+        # Rows first, then the summary: a segment is only visible to queries once both exist
+        os.replace(base + '.npz.tmp', base + '.npz')
+        os.replace(base + '.summary.json.tmp', base + '.summary.json')
+
+
+# ================================
+# Queries
+# ================================
+def _segments(log_dir, start, end):
+    """Summary sidecars of segments that can overlap [start, end], pruned by day directory"""
+    if not os.path.isdir(log_dir):
+        return
+    first, last = _day(start), _day(end)
+    for day_dir in sorted(os.listdir(log_dir)):
+        day = day_dir.partition('=')[2]
+        if not day or day < first or day > last:
+            continue
+        path = os.path.join(log_dir, day_dir)
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.summary.json'):
+                yield os.path.join(path, name[:-len('.summary.json')])
+
+
+def _percentiles(hist, qs=(0.5, 0.95, 0.99)):
+    """Percentiles (ms) from a latency histogram, reported at the bin's geometric midpoint"""
+    hist = np.asarray(hist)
+    total = hist.sum()
+    if total == 0:
+        return {f"p{int(q * 100)}": None for q in qs}
+    cumulative = np.cumsum(hist)
+    mids = np.sqrt(LATENCY_EDGES_MS[:-1] * LATENCY_EDGES_MS[1:])
+    return {f"p{int(q * 100)}": float(mids[np.searchsorted(cumulative, q * total)]) for q in qs}
+
+
+def query(start, end, class_names, log_dir=LOG_DIR, top_classes=20):
+    """Class distribution, confidence histogram and latency percentiles over [start, end] (unix seconds)"""
+    num_classes = len(class_names)
+    total = {'count': 0, 'class_counts': np.zeros(num_classes, dtype=np.int64),
+             'confidence_hist': np.zeros(CONFIDENCE_BINS, dtype=np.int64), 'latency_hist': {}}
+    model_versions = set()
+    segments_read = segments_scanned = 0
+
+    for base in _segments(log_dir, start, end):
+        with open(base + '.summary.json', 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        if not summary['count'] or summary['t_max'] < start or summary['t_min'] > end:
+            continue
+        if summary['t_min'] < start or summary['t_max'] > end:
+            # Straddles the range edge: re-aggregate just the rows inside it
+            with np.load(base + '.npz') as data:
+                columns = {name: data[name] for name in data.files}
+            keep = (columns['ts'] >= start) & (columns['ts'] <= end)
+            columns = {name: (col if name == 'stages' else col[keep]) for name, col in columns.items()}
+            summary = summarize(columns, num_classes)
+            segments_scanned += 1
+        segments_read += 1
+
+        counts = np.asarray(summary['class_counts'][:num_classes], dtype=np.int64)
+        total['count'] += summary['count']
+        total['class_counts'][:len(counts)] += counts
+        total['confidence_hist'] += np.asarray(summary['confidence_hist'], dtype=np.int64)
+        for stage, hist in summary['latency_hist'].items():
+            total['latency_hist'].setdefault(stage, np.zeros(len(LATENCY_EDGES_MS) - 1, dtype=np.int64))
+            total['latency_hist'][stage] += np.asarray(hist, dtype=np.int64)
+        if 'model_version' in summary:
+            model_versions.add(summary['model_version'])
+
+    count = total['count']
+    order = np.argsort(-total['class_counts'], kind='stable')[:top_classes]
+    return {
+        'start': start,
+        'end': end,
+        'count': count,
+        'segments': segments_read,
+        'segments_rescanned': segments_scanned,
+        'model_versions': sorted(model_versions),
+        'class_distribution': [
+            {'class': class_names[i], 'count': int(total['class_counts'][i]),
+             'fraction': float(total['class_counts'][i] / count) if count else 0.0}
+            for i in order if total['class_counts'][i] > 0
+        ],
+        'confidence_histogram': {
+            'bin_edges': np.linspace(0.0, 1.0, CONFIDENCE_BINS + 1).round(3).tolist(),
+            'counts': total['confidence_hist'].tolist(),
+        },
+        'latency_ms': {stage: _percentiles(hist) for stage, hist in total['latency_hist'].items()},
+    }
@@ -0,0 +1,189 @@
+"""
+On-demand profiling of a live worker
+POST /admin/profile starts a session for the next N requests and/or T seconds. During the
+session:
+- the forward pass of profiled requests runs under torch.profiler (one Chrome trace per
+  request, open in chrome://tracing or Perfetto)
+- a sampling thread records the Python stacks of request threads, and of the inference
+  scheduler thread that runs the forward passes, every few milliseconds and writes them as
+  collapsed stacks (python.folded) for flamegraph.pl or speedscope
+
+Output goes to <PROFILE_DIR>/<session>/. A session covers only the gunicorn worker that
+received the admin request.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import torch
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+MAX_SESSION_SECONDS = 600
+
+
+def _collapse(frame):
+    """'module:function;...' from the outermost frame to this one"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Profiler:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        # Kineto is process-wide, so only one request at a time gets a torch trace
+        self._torch_lock = threading.Lock()
+        self._session = None
+        self._background = set()  # Threads sampled for the whole session, e.g. the inference thread
+
+    def add_thread(self, ident):
+        """Sample this thread in every session, not just while it serves a request"""
+        self._background.add(ident)
+
+    @property
+    def active(self):
+        return self._session is not None
+
+    def start(self, max_requests=None, seconds=None):
+        """Begin a session; returns its status, or None if one is already running"""
+        if not max_requests and not seconds:
+            seconds = 30
+        seconds = min(seconds or MAX_SESSION_SECONDS, MAX_SESSION_SECONDS)
+        with self._lock:
+            if self._session is not None:
+                return None
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            session = {
+                'name': name,
+                'dir': os.path.join(self.output_dir, name),
+                'started': time.time(),
+                'deadline': time.time() + seconds,
+                'remaining': max_requests,
+                'requests': 0,
+                'threads': set(self._background),
+                'stacks': Counter(),
+                'samples': 0,
+                'torch_traces': [],
+                'torch_ops': Counter(),
+            }
+            os.makedirs(session['dir'], exist_ok=True)
+            self._session = session
+        threading.Thread(target=self._sample, args=(session,), name='profile-sampler', daemon=True).start()
+        logger.info(f"Profiling session {name} started (requests={max_requests}, seconds={seconds})")
+        return self.status()
+
+    def status(self):
+        session = self._session
+        if session is None:
+            return {'active': False}
+        return {
+            'active': True,
+            'session': session['name'],
+            'output_dir': session['dir'],
+            'requests_profiled': session['requests'],
+            'requests_remaining': session['remaining'],
+            'seconds_remaining': max(0.0, session['deadline'] - time.time()),
+        }
+
+    # ---- per-request hooks ----
+    def request_started(self):
+        session = self._session
+        if session is not None:
+            with self._lock:
+                session['threads'].add(threading.get_ident())
+
+    def request_finished(self):
+        session = self._session
+        if session is None:
+            return
+        with self._lock:
+            if threading.get_ident() not in session['threads']:
+                return
+            session['threads'].discard(threading.get_ident())
+            session['requests'] += 1
+            if session['remaining'] is not None:
+                session['remaining'] -= 1
+                done = session['remaining'] <= 0
+            else:
+                done = False
+        if done:
+            self.stop(session)
+
+    @contextmanager
+    def forward(self):
+        """Wrap the forward pass; traces it when a session is running and the tracer is free"""
+        session = self._session
+        if session is None or not self._torch_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                        record_shapes=True) as prof:
+                yield
+            path = os.path.join(session['dir'], f"torch-{len(session['torch_traces']):04d}.json")
+            prof.export_chrome_trace(path)
+            session['torch_traces'].append(os.path.basename(path))
+            for event in prof.key_averages():
+                session['torch_ops'][event.key] += event.self_cpu_time_total
+        finally:
+            self._torch_lock.release()
+
+    # ---- sampling and output ----
+    def _sample(self, session):
+        while self._session is session and time.time() < session['deadline']:
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(session['threads'])
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    session['stacks'][_collapse(frame)] += 1
+                    session['samples'] += 1
+            del frames
+            time.sleep(SAMPLE_INTERVAL)
+        self.stop(session)
+
+    def stop(self, session=None):
+        """End the session (idempotent) and write python.folded and summary.json"""
+        with self._lock:
+            session = session or self._session
+            if session is None or self._session is not session:
+                return
+            self._session = None
+
+        # A request may still be exporting its trace into this session; let it finish first
+        with self._torch_lock:
+            pass
+        with open(os.path.join(session['dir'], 'python.folded'), 'w', encoding='utf-8') as f:
+            for stack, count in session['stacks'].most_common():
+                f.write(f"{stack} {count}\n")
+        summary = {
+            'session': session['name'],
+            'pid': os.getpid(),
+            'duration_seconds': time.time() - session['started'],
+            'requests_profiled': session['requests'],
+            'python_samples': session['samples'],
+            'sample_interval_seconds': SAMPLE_INTERVAL,
+            'torch_traces': session['torch_traces'],
+            'top_torch_ops_self_cpu_us': dict(session['torch_ops'].most_common(15)),
+        }
+        with open(os.path.join(session['dir'], 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Profiling session {session['name']} written to {session['dir']}")
+
+
+def server_timing(timings_ms):
+    """(X-Debug-Timing, Server-Timing) header values for a stage -> milliseconds mapping"""
+    debug = ';'.join(f"{stage}={ms:.2f}" for stage, ms in timings_ms.items())
+    standard = ', '.join(f"{stage};dur={ms:.2f}" for stage, ms in timings_ms.items())
+    return debug, standard
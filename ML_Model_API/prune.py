@@ -0,0 +1,374 @@
+"""
+Structured channel pruning of MobileNetV2 against a measured CPU latency budget
+Removes whole hidden (expanded) channels from the inverted-residual blocks: the expand
+1x1 filter, its depthwise filter and the matching projection input all go, so the block
+stays a dense, smaller block. Block inputs and outputs (and so the residual connections)
+are untouched.
+
+Loop, until the batch-1 latency measured on this machine is within the budget:
+    1. score every hidden channel (magnitude or first-order Taylor importance)
+    2. remove the channels with the lowest importance per unit of compute
+    3. fine-tune briefly on the train split, then measure latency again
+Then a final fine-tune, a val-split evaluation of both models and the outputs:
+    <output>              servable artifact: model bundle (default) or TorchScript
+    <output>.report.json  accuracy/latency before and after, per-step history
+
+Usage:
+    python prune.py best_mobilenetv2.bundle --data-dir dataset_split --target-ms 12
+    python prune.py best_mobilenetv2.pth --data-dir dataset_split --target-fraction 0.7 --importance taylor
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import torch
+import torch.nn as nn
+import data_pipeline
+import evaluate
+import model_bundle
+import threading_config
+from model_bundle import shrink_block
+
+# Kept channel counts are rounded to a multiple of this; oneDNN kernels are fastest
+# (and latency most predictable) on channel counts that fill its vector blocks
+CHANNEL_MULTIPLE = 8
+MIN_HIDDEN = 16
+
+
+# ================================
+# Model surgery
+# ================================
+def prunable_blocks(model):
+    """(features index, block) for every inverted residual with an expansion layer"""
+    return [
+        (index, block) for index, block in enumerate(model.features)
+        if hasattr(block, 'conv') and len(block.conv) == 4
+    ]
+
+
+def hidden_channels(model):
+    return {str(index): block.conv[1][0].out_channels for index, block in prunable_blocks(model)}
+
+
+# ================================
+# Importance
+# ================================
+def magnitude_importance(model):
+    """
+    Per hidden channel: |depthwise BN scale| x L2 norm of its projection weights
+    (how strongly the channel can drive the block output)
+    """
+    scores = {}
+    for index, block in prunable_blocks(model):
+        gamma = block.conv[1][1].weight.detach().abs()
+        projection = block.conv[2].weight.detach().flatten(1).norm(dim=0)
+        scores[index] = gamma * projection
+    return scores
+
+
+def taylor_importance(model, batches, criterion, num_batches, device):
+    """
+    First-order Taylor estimate of the loss change from zeroing each hidden channel:
+    |sum over positions of activation x gradient|, accumulated over a few train batches
+    """
+    activations, scores = {}, {}
+    hooks = []
+    for index, block in prunable_blocks(model):
+        def hook(module, inputs, output, index=index):
+            output.retain_grad()
+            activations[index] = output
+        hooks.append(block.conv[1].register_forward_hook(hook))
+
+    model.eval()  # Keep BN statistics fixed while measuring
+    for _ in range(num_batches):
+        inputs, labels = next(batches)
+        model.zero_grad(set_to_none=True)
+        loss = criterion(model(inputs.to(device)), labels.to(device))
+        loss.backward()
+        for index, activation in activations.items():
+            contribution = (activation * activation.grad).sum(dim=(2, 3)).abs().sum(dim=0).detach()
+            scores[index] = scores.get(index, 0) + contribution
+    for hook in hooks:
+        hook.remove()
+    model.zero_grad(set_to_none=True)
+    return scores
+
+
+def channel_costs(model, img_size):
+    """Multiply-accumulates per hidden channel of each block at img_size input"""
+    shapes = {}
+    hooks = [
+        block.conv[1].register_forward_hook(
+            lambda module, inputs, output, index=index: shapes.__setitem__(index, output.shape[2:]))
+        for index, block in prunable_blocks(model)
+    ]
+    model.eval()
+    with torch.inference_mode():
+        model(torch.zeros(1, 3, img_size, img_size, device=next(model.parameters()).device))
+    for hook in hooks:
+        hook.remove()
+    costs = {}
+    for index, block in prunable_blocks(model):
+        height, width = shapes[index]
+        in_height, in_width = height * block.conv[1][0].stride[0], width * block.conv[1][0].stride[1]
+        costs[index] = (in_height * in_width * block.conv[0][0].in_channels
+                        + height * width * (9 + block.conv[2].out_channels))
+    return costs
+
+
+def keep_multiple(hidden, drop):
+    """Channels to keep when `drop` of `hidden` are asked for, on a CHANNEL_MULTIPLE boundary"""
+    # Nearest multiple, ties toward removing: a drop of half a multiple or more takes a whole one
+    keep_count = (hidden - drop + CHANNEL_MULTIPLE // 2 - 1) // CHANNEL_MULTIPLE * CHANNEL_MULTIPLE
+    return min(hidden, max(keep_count, MIN_HIDDEN))
+
+
+def prune_step(model, scores, costs, fraction):
+    """
+    Remove about `fraction` of the remaining hidden channels, lowest importance per unit of
+    compute first. Scores are L2-normalized per block so blocks compare fairly.
+    Returns the number of channels removed.
+    """
+    mean_cost = sum(costs.values()) / len(costs)
+    candidates = []
+    for index, block in prunable_blocks(model):
+        score = scores[index].float()
+        score = score / score.norm().clamp_min(1e-12)
+        candidates.extend((value / (costs[index] / mean_cost), index, channel)
+                          for channel, value in enumerate(score.tolist()))
+    total = len(candidates)
+    target = max(1, int(total * fraction))
+
+    drop = {index: 0 for index, _ in prunable_blocks(model)}
+    removed = 0
+    for _, index, _ in sorted(candidates):
+        if removed >= target:
+            break
+        hidden = model.features[index].conv[1][0].out_channels
+        if hidden - drop[index] - 1 >= MIN_HIDDEN:
+            drop[index] += 1
+            removed += 1
+
+    keep_counts = {index: keep_multiple(model.features[index].conv[1][0].out_channels, count)
+                   for index, count in drop.items()}
+    if drop and all(keep_counts[index] == model.features[index].conv[1][0].out_channels for index in drop):
+        # Drops spread thinly over many blocks all round to nothing; take a whole multiple
+        # from the block that asked for the most instead of stalling
+        index = max(drop, key=drop.get)
+        if drop[index]:
+            keep_counts[index] = keep_multiple(model.features[index].conv[1][0].out_channels,
+                                               CHANNEL_MULTIPLE)
+
+    removed = 0
+    for index, block in prunable_blocks(model):
+        hidden = block.conv[1][0].out_channels
+        keep_count = keep_counts[index]
+        if keep_count < hidden:
+            keep = torch.sort(scores[index].argsort(descending=True)[:keep_count]).values
+            shrink_block(block, keep.to(block.conv[0][0].weight.device))
+            removed += hidden - keep_count
+    return removed
+
+
+# ================================
+# Latency and fine-tuning
+# ================================
+def measure_latency(model, img_size, runs=50, warmup=10):
+    """Median batch-1 latency (ms) on this machine's CPU, as the serving path runs it"""
+    model = model.cpu().eval()
+    x = torch.randn(1, 3, img_size, img_size)
+    timings = []
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(x)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(x)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def _batches(loader):
+    """Endless train batches (one iterator: persistent loader workers allow only one)"""
+    while True:
+        yield from loader
+
+
+def fine_tune(model, batches, criterion, steps, lr, device):
+    """A few optimizer steps to let the remaining channels absorb the removed ones"""
+    model.to(device).train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)
+    running = 0.0
+    for step in range(steps):
+        inputs, labels = next(batches)
+        loss = criterion(model(inputs.to(device)), labels.to(device))
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+        running += loss.item()
+    model.eval()
+    return running / max(1, steps)
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+# ================================
+# CLI
+# ================================
+def load_for_pruning(path):
+    """(model with its own writable weights, class names or None, preprocessing)"""
+    if model_bundle.is_bundle(path):
+        state_dict, metadata = model_bundle.load_state_dict(path)
+        model = model_bundle.build_model(metadata['architecture'])
+        model.load_state_dict({k: v.clone() for k, v in state_dict.items()}, assign=True)
+        return model, metadata['class_names'], metadata['preprocessing']
+    model, _ = evaluate.load_model(path, torch.device('cpu'))
+    return model, None, model_bundle.DEFAULT_PREPROCESSING
+
+
+def save_artifact(model, path, output_format, class_names, preprocessing, report):
+    if output_format == 'torchscript':
+        torch.jit.save(torch.jit.script(model.cpu().eval()), path)
+        return
+    architecture = model_bundle.mobilenet_architecture(model.classifier[1].out_features,
+                                                       hidden_channels=hidden_channels(model))
+    model_bundle.pack(model.state_dict(), path, class_names, preprocessing=preprocessing,
+                      architecture=architecture,
+                      extra={'source': 'prune.py', 'pruning': {
+                          'importance': report['settings']['importance'],
+                          'baseline_latency_ms': report['baseline']['latency_ms'],
+                          'latency_ms': report['pruned']['latency_ms'],
+                      }})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune MobileNetV2 hidden channels to a CPU latency budget")
+    parser.add_argument('model', help="bundle, state dict or training checkpoint")
+    parser.add_argument('--data-dir', required=True, help="dataset_split (train for fine-tuning, val for the report)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--target-ms', type=float, help="batch-1 latency budget in milliseconds")
+    target.add_argument('--target-fraction', type=float, help="budget as a fraction of the measured baseline")
+    parser.add_argument('--importance', choices=('magnitude', 'taylor'), default='taylor')
+    parser.add_argument('--step-fraction', type=float, default=0.1, help="hidden channels removed per step")
+    parser.add_argument('--max-steps', type=int, default=20)
+    parser.add_argument('--finetune-steps', type=int, default=100, help="train batches after each step")
+    parser.add_argument('--final-steps', type=int, default=500, help="train batches after the last step")
+    parser.add_argument('--taylor-batches', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None,
+                        help="torch threads while timing (default: one serving worker's share of the cores)")
+    parser.add_argument('--latency-runs', type=int, default=50)
+    parser.add_argument('--format', choices=('bundle', 'torchscript'), default='bundle')
+    parser.add_argument('--output', default='pruned_mobilenetv2.bundle')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    threads = args.threads or threading_config.plan_threads(
+        len(threading_config.available_cores()), int(os.getenv('WEB_CONCURRENCY', 2)))['intra_op_threads']
+    training_threads = torch.get_num_threads()
+
+    def latency(model):
+        torch.set_num_threads(threads)
+        try:
+            return measure_latency(model, img_size, runs=args.latency_runs)
+        finally:
+            torch.set_num_threads(training_threads)
+            model.to(device)
+
+    model, class_names, preprocessing = load_for_pruning(args.model)
+    img_size = preprocessing['resize'][0]
+    transforms = data_pipeline.build_transforms(img_size)
+    train_set = data_pipeline.open_split(os.path.join(args.data_dir, 'train'), transform=transforms['train'])
+    val_set = data_pipeline.open_split(os.path.join(args.data_dir, 'val'), transform=transforms['val'])
+    class_names = class_names or train_set.classes
+    train_loader = data_pipeline.build_dataloader(train_set, args.batch_size, shuffle=True, num_workers=args.workers)
+    val_loader = data_pipeline.build_dataloader(val_set, 256, num_workers=args.workers)
+    batches = _batches(train_loader)
+    criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
+    model.to(device)
+
+    baseline_ms = latency(model)
+    budget_ms = args.target_ms if args.target_ms is not None else baseline_ms * args.target_fraction
+    baseline_report = evaluate.evaluate(model, val_loader, device, len(class_names), class_names)
+    baseline = {
+        'latency_ms': baseline_ms,
+        'val_accuracy': baseline_report['accuracy'],
+        'parameters': count_parameters(model),
+        'hidden_channels': hidden_channels(model),
+    }
+    print(f"\n{'='*60}")
+    print(f"Baseline: {baseline_ms:.2f} ms, val acc {baseline['val_accuracy']:.4f}, "
+          f"{baseline['parameters']:,} parameters ({threads} threads)")
+    print(f"Budget:   {budget_ms:.2f} ms")
+    print(f"{'='*60}\n")
+
+    costs = channel_costs(model, img_size)
+    history = []
+    current_ms = baseline_ms
+    for step in range(1, args.max_steps + 1):
+        if current_ms <= budget_ms:
+            break
+        if args.importance == 'taylor':
+            scores = taylor_importance(model, batches, criterion, args.taylor_batches, device)
+        else:
+            scores = magnitude_importance(model)
+        removed = prune_step(model, scores, costs, args.step_fraction)
+        if removed == 0:
+            if all(hidden <= MIN_HIDDEN for hidden in hidden_channels(model).values()):
+                print("⚠️  Every block is at its minimum width; stopping")
+            else:
+                print("⚠️  No channels could be removed at this step fraction; stopping")
+            break
+        loss = fine_tune(model, batches, criterion, args.finetune_steps, args.lr, device)
+        current_ms = latency(model)
+        hidden_total = sum(hidden_channels(model).values())
+        history.append({'step': step, 'removed': removed, 'hidden_channels_total': hidden_total,
+                        'latency_ms': current_ms, 'train_loss': loss})
+        print(f"Step {step}: -{removed} channels ({hidden_total} left), {current_ms:.2f} ms, loss {loss:.4f}")
+
+    if args.final_steps:
+        print(f"Final fine-tune ({args.final_steps} batches)...")
+        fine_tune(model, batches, criterion, args.final_steps, args.lr, device)
+    pruned_report = evaluate.evaluate(model, val_loader, device, len(class_names), class_names)
+    current_ms = latency(model)
+
+    report = {
+        'model': args.model,
+        'settings': {k: getattr(args, k) for k in ('importance', 'step_fraction', 'finetune_steps',
+                                                   'final_steps', 'batch_size', 'lr')},
+        'machine': {'threads': threads, 'cores_visible': len(threading_config.available_cores())},
+        'budget_ms': budget_ms,
+        'met_budget': current_ms <= budget_ms,
+        'baseline': baseline,
+        'pruned': {
+            'latency_ms': current_ms,
+            'val_accuracy': pruned_report['accuracy'],
+            'parameters': count_parameters(model),
+            'hidden_channels': hidden_channels(model),
+        },
+        'speedup': baseline_ms / current_ms,
+        'accuracy_delta': pruned_report['accuracy'] - baseline['val_accuracy'],
+        'steps': history,
+    }
+    save_artifact(model, args.output, args.format, class_names, preprocessing, report)
+    with open(args.output + '.report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'='*60}")
+    print(f"Latency:    {baseline_ms:.2f} -> {current_ms:.2f} ms ({report['speedup']:.2f}x)"
+          f"{'' if report['met_budget'] else '  ⚠️  budget not met'}")
+    print(f"Val acc:    {baseline['val_accuracy']:.4f} -> {pruned_report['accuracy']:.4f}")
+    print(f"Parameters: {baseline['parameters']:,} -> {report['pruned']['parameters']:,}")
+    print(f"✅ Wrote {args.output} and {args.output}.report.json")
+    print(f"{'='*60}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
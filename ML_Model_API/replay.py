@@ -0,0 +1,276 @@
+"""
+Deterministic replay of captured traffic (traffic_capture.py) for performance regression tests
+Requests are re-sent in their original order with their original spacing, divided by
+--speed. They keep their original endpoint, query, image source, lane and tenant.
+Scheduling is open-loop: a slow server does not slow the arrivals down, just as in production.
+imageUrl requests point at a local stand-in server that serves the captured payloads, so a
+replay never touches Cloudinary or the network.
+
+Usage:
+    python replay.py run captures/ --target http://localhost:5000 --speed 2 --output before.json
+    python replay.py run captures/ --target http://localhost:5000 --speed 2 --output after.json
+    python replay.py compare before.json after.json --fail-above 10
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+import traffic_capture
+
+PERCENTILES = (50, 90, 95, 99)
+BOOTSTRAP_SAMPLES = 2000
+
+
+# ================================
+# Stand-in image host
+# ================================
+class PayloadServer(ThreadingHTTPServer):
+    """Serves <capture_dir>/payloads/<ab>/<digest> at http://127.0.0.1:<port>/<digest>"""
+    daemon_threads = True
+
+    def __init__(self, capture_dir):
+        self.capture_dir = capture_dir
+        super().__init__(('127.0.0.1', 0), _PayloadHandler)
+        threading.Thread(target=self.serve_forever, name='payload-server', daemon=True).start()
+
+    def url(self, digest):
+        return f"http://127.0.0.1:{self.server_address[1]}/{digest}"
+
+
+class _PayloadHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        digest = self.path.strip('/')
+        try:
+            data = traffic_capture.read_payload(self.server.capture_dir, digest)
+        except (OSError, ValueError):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# ================================
+# Replay
+# ================================
+def build_request(entry, payload, payload_server):
+    """requests.request() keyword arguments reproducing one captured request"""
+    kwargs = {'params': entry['query'], 'headers': {}}
+    if entry.get('lane') == 'bulk':
+        kwargs['headers']['X-Priority'] = 'bulk'
+    if entry.get('tenant'):
+        kwargs['headers']['X-API-Key'] = entry['tenant']
+    source = entry['source']
+    if source == 'url':
+        kwargs['json'] = {'imageUrl': payload_server.url(entry['payload'])}
+    elif source == 'base64':
+        kwargs['json'] = {'image': base64.b64encode(payload).decode('ascii')}
+    elif source == 'binary':
+        kwargs['data'] = payload
+        kwargs['headers']['Content-Type'] = entry.get('content_type') or 'application/octet-stream'
+    else:
+        kwargs['files'] = {'image': ('upload', payload, entry.get('content_type') or 'application/octet-stream')}
+    return kwargs
+
+
+def replayable(capture_dir, entry):
+    """Whether the entry's image is in the payload store (requests without one can't be replayed)"""
+    return bool(entry['payload']) and os.path.exists(traffic_capture.payload_path(capture_dir, entry['payload']))
+
+
+def replay(entries, capture_dir, target, speed=1.0, max_workers=64, timeout=60):
+    """
+    Send every replayable entry at its (scaled) offset
+    Returns one result dict per replayed entry, in trace order; entries without a stored payload are skipped
+    """
+    entries = [e for e in entries if replayable(capture_dir, e)]
+    payloads = {e['payload']: traffic_capture.read_payload(capture_dir, e['payload'])
+                for e in entries if e['source'] != 'url'}
+    payload_server = PayloadServer(capture_dir)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+    results = [None] * len(entries)
+
+    def send(i, entry, due):
+        kwargs = build_request(entry, payloads.get(entry['payload']), payload_server)
+        sent = time.perf_counter()
+        try:
+            response = session.post(target.rstrip('/') + entry['endpoint'], timeout=timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = f"error: {type(e).__name__}"
+        results[i] = {
+            'offset_s': due,
+            'lag_ms': (sent - start - due) * 1000,
+            'latency_ms': (time.perf_counter() - sent) * 1000,
+            'status': status,
+            'captured_status': entry['status'],
+            'endpoint': entry['endpoint'],
+            'source': entry['source'],
+            'lane': entry.get('lane'),
+            'bytes': entry['bytes'],
+        }
+
+    if not entries:
+        return [], 0.0
+    t0 = entries[0]['t']
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        start = time.perf_counter()
+        for i, entry in enumerate(entries):
+            due = (entry['t'] - t0) / speed
+            delay = start + due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, i, entry, due)
+    payload_server.shutdown()
+    return results, time.perf_counter() - start
+
+
+def percentiles(latencies):
+    if len(latencies) == 0:
+        return {f"p{q}": None for q in PERCENTILES}
+    values = np.percentile(latencies, PERCENTILES)
+    return {f"p{q}": round(float(v), 2) for q, v in zip(PERCENTILES, values)}
+
+
+def summarize(results, wall_seconds):
+    """Latency percentiles overall and per endpoint, source and lane (successful requests only)"""
+    ok = [r for r in results if r['status'] == 200]
+    summary = {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'status_changed': sum(1 for r in results if r['status'] != r['captured_status']),
+        'wall_seconds': round(wall_seconds, 2),
+        'throughput_rps': round(len(results) / wall_seconds, 2) if wall_seconds else None,
+        'max_send_lag_ms': round(max((r['lag_ms'] for r in results), default=0.0), 2),
+        'latency_ms': percentiles([r['latency_ms'] for r in ok]),
+    }
+    for key in ('endpoint', 'source', 'lane'):
+        groups = {}
+        for r in ok:
+            groups.setdefault(str(r[key]), []).append(r['latency_ms'])
+        summary[f"by_{key}"] = {name: {'count': len(v), **percentiles(v)} for name, v in sorted(groups.items())}
+    return summary
+
+
+def bootstrap_delta(before, after, q, rng):
+    """95% interval of percentile q of `after` minus that of `before`, resampling both"""
+    before, after = np.asarray(before), np.asarray(after)
+    deltas = [
+        np.percentile(rng.choice(after, len(after)), q) - np.percentile(rng.choice(before, len(before)), q)
+        for _ in range(BOOTSTRAP_SAMPLES)
+    ]
+    return float(np.percentile(deltas, 2.5)), float(np.percentile(deltas, 97.5))
+
+
+# ================================
+# Commands
+# ================================
+def cmd_run(args):
+    entries = traffic_capture.load_trace(args.capture_dir)
+    # No stored image: rejected before it was read (413s), or unparseable and never stored
+    replayed = [e for e in entries if replayable(args.capture_dir, e)]
+    if len(replayed) < len(entries):
+        print(f"⚠️  Skipping {len(entries) - len(replayed)} requests without a stored image")
+    entries = replayed
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print(f"❌ No replayable requests in {args.capture_dir}")
+        return 1
+    span = entries[-1]['t'] - entries[0]['t']
+
+    print(f"\n{'='*60}")
+    print(f"Replaying {len(entries)} requests ({span:.1f}s captured) at {args.speed}x against {args.target}")
+    print(f"{'='*60}\n")
+
+    results, wall = replay(entries, args.capture_dir, args.target, args.speed, args.workers, args.timeout)
+    summary = summarize(results, wall)
+    summary.update({'label': args.label or args.output, 'target': args.target, 'speed': args.speed,
+                    'capture_dir': os.path.abspath(args.capture_dir)})
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'results': results}, f, indent=1)
+
+    latency = summary['latency_ms']
+    print(f"OK {summary['ok']}/{summary['requests']} in {summary['wall_seconds']}s "
+          f"({summary['throughput_rps']} req/s), max send lag {summary['max_send_lag_ms']}ms")
+    print('Latency ms: ' + '  '.join(f"{k} {v}" for k, v in latency.items()))
+    if summary['max_send_lag_ms'] > 100:
+        print(f"⚠️  The client fell behind the schedule; raise --workers or lower --speed")
+    print(f"✅ Wrote {args.output}\n")
+    return 0
+
+
+def cmd_compare(args):
+    runs = []
+    for path in (args.before, args.after):
+        with open(path, encoding='utf-8') as f:
+            runs.append(json.load(f))
+    before, after = ([r['latency_ms'] for r in run['results'] if r['status'] == 200] for run in runs)
+    if not before or not after:
+        print("❌ Both runs need successful requests to compare")
+        return 1
+    rng = np.random.default_rng(0)
+
+    print(f"\n{'='*60}")
+    print(f"Before: {runs[0]['summary']['label']} ({len(before)} ok, {runs[0]['summary']['errors']} errors)")
+    print(f"After:  {runs[1]['summary']['label']} ({len(after)} ok, {runs[1]['summary']['errors']} errors)")
+    print(f"{'='*60}")
+    print(f"{'':<6}{'before':>10}{'after':>10}{'change':>9}   95% interval of the difference (ms)")
+    regressed = []
+    for q in PERCENTILES:
+        b, a = float(np.percentile(before, q)), float(np.percentile(after, q))
+        low, high = bootstrap_delta(before, after, q, rng)
+        change = (a - b) / b * 100
+        significant = low > 0 or high < 0
+        print(f"{'p' + str(q):<6}{b:>10.1f}{a:>10.1f}{change:>+8.1f}%   [{low:+.1f}, {high:+.1f}]"
+              f"{'  *' if significant else ''}")
+        if args.fail_above is not None and low > 0 and change > args.fail_above:
+            regressed.append(f"p{q}")
+    print(f"{'='*60}")
+    print("* the interval excludes zero\n")
+    if regressed:
+        print(f"❌ Regression above {args.fail_above}% at {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic and compare latency between builds")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="replay a capture against a running server")
+    run.add_argument('capture_dir')
+    run.add_argument('--target', default='http://localhost:5000')
+    run.add_argument('--speed', type=float, default=1.0, help="arrival-rate multiplier (2 = twice as fast)")
+    run.add_argument('--limit', type=int, default=None, help="only the first N requests")
+    run.add_argument('--workers', type=int, default=64, help="most requests in flight")
+    run.add_argument('--timeout', type=float, default=60)
+    run.add_argument('--label', default=None, help="name of the build under test")
+    run.add_argument('--output', default='replay.json')
+
+    compare = sub.add_parser('compare', help="compare the latency distributions of two runs")
+    compare.add_argument('before')
+    compare.add_argument('after')
+    compare.add_argument('--fail-above', type=float, default=None,
+                         help="exit 1 if a percentile is significantly more than this %% slower")
+
+    args = parser.parse_args()
+    return cmd_run(args) if args.command == 'run' else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Fast classifier-head retraining on cached backbone features
+Adding a disease class or fixing labels does not need a full fine-tune. The backbone runs
+once over the dataset. Its pooled 1280-d features, plus a few randomly augmented views of
+every train image, are cached in a memory-mapped array. Only the linear head is trained on
+them, which takes seconds. The result is a servable bundle with the new class table.
+
+The feature cache is keyed by the backbone weights and by each image file's name, size and
+mtime. On a rerun only new or changed images go through the backbone. Moving a file to
+another class folder (a label fix) reuses its features, because mv keeps name, size and
+mtime.
+
+Layout: <cache-dir>/<split>/features.npy   float16 [views, N, D]
+                            keys.json      one key per row, in dataset order
+                            meta.json      backbone hash, preprocessing, views, classes
+
+Usage:
+    python retrain_head.py best_mobilenetv2.bundle --data-dir dataset_split --views 2 --output retrained_mobilenetv2.bundle
+"""
+import os
+import sys
+import copy
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import Subset
+import data_pipeline
+import evaluate
+import model_bundle
+from shard_dataset import ShardedImageDataset, SHARD_INDEX_FILE
+
+CACHE_DIR = 'feature_cache'
+HEAD_DROPOUT = 0.2  # Same as torchvision's MobileNetV2 classifier
+MAX_LISTED = 10
+
+
+# ================================
+# Base model
+# ================================
+def load_base(path, class_names_file=None):
+    """(model, class names or None, preprocessing, hidden_channels or None); weights are read-only"""
+    if model_bundle.is_bundle(path):
+        model, metadata = model_bundle.load_model(path)
+        return (model, metadata['class_names'], metadata['preprocessing'],
+                metadata['architecture'].get('hidden_channels'))
+    model, _ = evaluate.load_model(path, torch.device('cpu'))
+    class_names = None
+    if class_names_file and os.path.exists(class_names_file):
+        with open(class_names_file, 'r', encoding='utf-8') as f:
+            class_names = [line.strip() for line in f if line.strip()]
+    return model, class_names, model_bundle.DEFAULT_PREPROCESSING, None
+
+
+def backbone_hash(model):
+    """Hash of model.features only: a head-only retrain keeps every cached feature valid"""
+    digest = hashlib.sha256()
+    for name, tensor in model.features.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+# ================================
+# Feature cache
+# ================================
+def sample_keys(dataset):
+    """Stable identity per sample; survives moving a file between class folders"""
+    if isinstance(dataset, ShardedImageDataset):
+        st = os.stat(os.path.join(dataset.split_dir, SHARD_INDEX_FILE))
+        return [f"shard:{st.st_size}:{st.st_mtime_ns}:{i}" for i in range(len(dataset))]
+    keys = []
+    for path, _ in dataset.samples:
+        st = os.stat(path)
+        keys.append(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}")
+    return keys
+
+
+def extract(model, dataset, indices, out, view, batch_size, workers):
+    """Pooled backbone features of dataset[indices] written to out[view, indices]"""
+    loader = data_pipeline.build_dataloader(Subset(dataset, indices), batch_size, num_workers=workers)
+    row = 0
+    with torch.inference_mode():
+        for images, _ in loader:
+            pooled = model.features(images).mean(dim=(2, 3))
+            out[view, indices[row:row + len(images)]] = pooled.numpy().astype(np.float16)
+            row += len(images)
+
+
+def build_feature_cache(model, model_hash, split_dir, cache_dir, preprocessing, views,
+                        batch_size=64, workers=None):
+    """
+    Cache for one split; returns (features memmap [views, N, D], labels, classes)
+    View 0 uses the serving transform; views 1.. use the training augmentations
+    """
+    source = data_pipeline.open_split(split_dir)
+    keys = sample_keys(source)
+    dim = model.classifier[1].in_features
+    settings = {'backbone': model_hash, 'preprocessing': preprocessing, 'views': views, 'dim': dim}
+
+    # Rows of the previous cache that are still valid, by sample key
+    reuse, old_keys = {}, None
+    features_path = os.path.join(cache_dir, 'features.npy')
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    old = None
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['settings'] == settings:
+            with open(os.path.join(cache_dir, 'keys.json'), 'r', encoding='utf-8') as f:
+                old_keys = json.load(f)
+            reuse = {key: row for row, key in enumerate(old_keys)}
+            old = np.load(features_path, mmap_mode='r')
+
+    labels = np.asarray(source.targets, dtype=np.int64)
+    missing = np.array([i for i, key in enumerate(keys) if key not in reuse], dtype=np.int64)
+    if keys == old_keys:
+        print(f"✓ Reusing feature cache at {cache_dir} ({len(keys)} images)")
+        return old, labels, source.classes
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = features_path + '.tmp.npy'
+    features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16, shape=(views, len(keys), dim))
+    kept = [(i, reuse[key]) for i, key in enumerate(keys) if key in reuse]
+    for start in range(0, len(kept), 4096):  # Bounded copies, not the whole cache at once
+        new_rows, old_rows = map(np.array, zip(*kept[start:start + 4096]))
+        features[:, new_rows] = old[:, old_rows]
+    del old
+
+    print(f"🔄 Extracting features for {len(missing)} of {len(keys)} images in {split_dir} "
+          f"({views} view{'s' if views > 1 else ''})...")
+    started = time.perf_counter()
+    if len(missing):
+        img_size = max(preprocessing['resize'])
+        # Augmented views must be normalized like view 0, i.e. as the bundle expects
+        augment = data_pipeline.build_transforms(img_size, preprocessing['mean'], preprocessing['std'])['train']
+        for view in range(views):
+            source.transform = model_bundle.build_transform(preprocessing) if view == 0 else augment
+            extract(model, source, missing, features, view, batch_size, workers)
+    features.flush()
+    del features
+
+    # keys/meta last, so an interrupted run never pairs new keys with old rows
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    os.replace(tmp_path, features_path)
+    with open(os.path.join(cache_dir, 'keys.json'), 'w', encoding='utf-8') as f:
+        json.dump(keys, f)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'settings': settings, 'classes': source.classes, 'count': len(keys)}, f)
+    print(f"✓ Feature cache ready at {cache_dir} ({time.perf_counter() - started:.1f}s)")
+    return np.load(features_path, mmap_mode='r'), labels, source.classes
+
+
+# ================================
+# Head training
+# ================================
+def init_head(base_head, base_classes, classes):
+    """New Linear head; rows of classes the base model already knew start from its weights"""
+    head = nn.Linear(base_head.in_features, len(classes))
+    nn.init.normal_(head.weight, 0, 0.01)
+    nn.init.zeros_(head.bias)
+    carried = 0
+    if base_classes:
+        known = {name: i for i, name in enumerate(base_classes)}
+        with torch.no_grad():
+            for i, name in enumerate(classes):
+                if name in known:
+                    head.weight[i] = base_head.weight[known[name]].float()
+                    head.bias[i] = base_head.bias[known[name]].float()
+                    carried += 1
+    return head, carried
+
+
+def accuracy(head, features, labels, top_k=1):
+    with torch.no_grad():
+        logits = head(torch.from_numpy(np.asarray(features, dtype=np.float32)))
+        hits = logits.topk(min(top_k, logits.shape[1]), dim=1).indices == torch.from_numpy(labels)[:, None]
+        return hits.any(dim=1).float().mean().item()
+
+
+def train_head(head, train_features, train_labels, val_features, val_labels, epochs=50, patience=8,
+               lr=1e-3, weight_decay=1e-4, label_smoothing=0.1, batch_size=256, seed=0):
+    """
+    AdamW on the cached features; each epoch draws one random view per train image
+    Returns (best head by val accuracy, history)
+    """
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    views, count, _ = train_features.shape
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+    criterion = nn.CrossEntropyLoss(label_smoothing=label_smoothing)
+    labels = torch.from_numpy(train_labels)
+
+    best_acc, best_state, waited = -1.0, None, 0
+    history = {'train_loss': [], 'val_acc': []}
+    for epoch in range(epochs):
+        head.train()
+        order = rng.permutation(count)
+        view_of = rng.integers(0, views, size=count)
+        total_loss = 0.0
+        for start in range(0, count, batch_size):
+            rows = np.sort(order[start:start + batch_size])  # Sorted rows read the memmap sequentially
+            inputs = torch.from_numpy(np.asarray(train_features[view_of[rows], rows], dtype=np.float32))
+            loss = criterion(head(F.dropout(inputs, HEAD_DROPOUT, training=True)), labels[rows])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(rows)
+        scheduler.step()
+
+        head.eval()
+        val_acc = accuracy(head, val_features, val_labels)
+        history['train_loss'].append(total_loss / count)
+        history['val_acc'].append(val_acc)
+        if val_acc > best_acc:
+            best_acc, best_state, waited = val_acc, copy.deepcopy(head.state_dict()), 0
+        else:
+            waited += 1
+            if waited >= patience:
+                break
+    head.load_state_dict(best_state)
+    return head.eval(), history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain only the classifier head on cached backbone features")
+    parser.add_argument('model', help="bundle, state dict or training checkpoint to take the backbone from")
+    parser.add_argument('--data-dir', required=True, help="dataset_split; the train folders define the class table")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--views', type=int, default=2, help="augmented train views cached besides the plain one")
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--patience', type=int, default=8)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--weight-decay', type=float, default=1e-4)
+    parser.add_argument('--label-smoothing', type=float, default=0.1)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--extract-batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--class-names', default='class_names.txt',
+                        help="class table of a non-bundle base model (bundles carry their own)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='retrained_mobilenetv2.bundle')
+    args = parser.parse_args()
+
+    model, base_classes, preprocessing, hidden = load_base(args.model, args.class_names)
+    model_hash = backbone_hash(model)
+
+    print(f"\n{'='*60}")
+    print(f"Head retraining: backbone {model_hash} from {args.model}")
+    print(f"{'='*60}\n")
+    started = time.perf_counter()
+    train_features, train_labels, classes = build_feature_cache(
+        model, model_hash, os.path.join(args.data_dir, 'train'), os.path.join(args.cache_dir, 'train'),
+        preprocessing, 1 + args.views, args.extract_batch_size, args.workers)
+    val_features, val_labels, val_classes = build_feature_cache(
+        model, model_hash, os.path.join(args.data_dir, 'val'), os.path.join(args.cache_dir, 'val'),
+        preprocessing, 1, args.extract_batch_size, args.workers)
+    extracted = time.perf_counter()
+
+    # Folder order differs when val lacks a class; map val labels by name
+    class_index = {name: i for i, name in enumerate(classes)}
+    unknown = sorted(set(val_classes) - set(class_index))
+    if unknown:
+        print(f"❌ Val classes missing from train: {unknown}")
+        return 1
+    val_labels = np.array([class_index[val_classes[t]] for t in val_labels], dtype=np.int64)
+    val_features = val_features[0]
+
+    head, carried = init_head(model.classifier[1], base_classes, classes)
+    start_acc = accuracy(head, val_features, val_labels)
+    head, history = train_head(head, train_features, train_labels, val_features, val_labels,
+                               epochs=args.epochs, patience=args.patience, lr=args.lr,
+                               weight_decay=args.weight_decay, label_smoothing=args.label_smoothing,
+                               batch_size=args.batch_size, seed=args.seed)
+    trained = time.perf_counter()
+    val_acc = accuracy(head, val_features, val_labels)
+    val_top3 = accuracy(head, val_features, val_labels, top_k=3)
+
+    # Same backbone tensors, new head
+    state_dict = {k: v for k, v in model.state_dict().items() if not k.startswith('classifier.1.')}
+    state_dict['classifier.1.weight'] = head.weight.detach().to(model.classifier[1].weight.dtype)
+    state_dict['classifier.1.bias'] = head.bias.detach().to(model.classifier[1].bias.dtype)
+    added = [c for c in classes if c not in (base_classes or [])]
+    removed = [c for c in (base_classes or []) if c not in class_index]
+    model_bundle.pack(state_dict, args.output, classes, preprocessing=preprocessing,
+                      architecture=model_bundle.mobilenet_architecture(len(classes), hidden_channels=hidden),
+                      extra={'source': 'retrain_head.py', 'retrain': {
+                          'base_model': os.path.basename(args.model),
+                          'backbone': model_hash,
+                          'views': 1 + args.views,
+                          'epochs': len(history['val_acc']),
+                          'val_accuracy': val_acc,
+                      }})
+    class_table = os.path.splitext(args.output)[0] + '_class_names.txt'
+    with open(class_table, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(classes) + '\n')
+
+    print(f"\n{'='*60}")
+    print(f"Classes:   {len(classes)} ({carried} carried over, {len(added)} new, {len(removed)} dropped)")
+    for sign, names in (('+', added), ('-', removed)):
+        for name in names[:MAX_LISTED]:
+            print(f"  {sign} {name}")
+        if len(names) > MAX_LISTED:
+            print(f"  {sign} ... {len(names) - MAX_LISTED} more")
+    print(f"Val acc:   {start_acc:.4f} before training -> {val_acc:.4f} (top-3 {val_top3:.4f}) "
+          f"after {len(history['val_acc'])} epochs")
+    print(f"Time:      {extracted - started:.1f}s features + {trained - extracted:.1f}s head")
+    print(f"✅ Wrote {args.output} and {class_table}")
+    print(f"{'='*60}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
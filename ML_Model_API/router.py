@@ -0,0 +1,281 @@
+"""
+Cache-affine request router for several ML API instances
+Each instance keeps its own near-duplicate cache and warm state. A plain load balancer
+spreads identical images over all of them and wastes those caches. This router hashes
+each request's image (the imageUrl, or a hash of the uploaded bytes) onto a consistent-hash
+ring of backends, so repeat images keep landing on the instance that has already seen them.
+
+Bounded loads (consistent hashing with bounded loads, Mirrokni et al.): a backend takes a
+new request only while its in-flight count is below ceil(LOAD_FACTOR * average). Otherwise
+the request walks on to the next backend on the ring. A hot image therefore spills over to
+its neighbours instead of overloading one node. Adding or removing a backend only moves the
+keys next to it on the ring.
+
+Failover: a health thread polls every backend's /health. A backend counts as healthy
+only when that returns 200 with "model_loaded": true. A connection error takes a backend
+out at once and the request is retried on the next backend on the ring. A 503 from one
+instance (for example /api/similar without an index there) is retried on the others.
+A down backend comes back after one successful health check.
+
+Environment:
+    ROUTER_BACKENDS         comma-separated backend base URLs (or --backends)
+    ROUTER_LOAD_FACTOR      in-flight bound relative to the average (default 1.25)
+    ROUTER_VNODES           ring points per backend (default 160)
+    ROUTER_HEALTH_INTERVAL  seconds between health checks (default 2)
+    ROUTER_TIMEOUT          backend request timeout in seconds (default 60)
+
+Run one process (in-flight counts live in memory), with threads for concurrency:
+    ROUTER_BACKENDS=http://localhost:5001,http://localhost:5002 gunicorn router:app -w 1 --threads 32 -b :8000
+    python router.py --port 8000 --backends http://localhost:5001,http://localhost:5002
+"""
+import os
+import sys
+import io
+import math
+import time
+import bisect
+import binascii
+import hashlib
+import logging
+import argparse
+import threading
+import requests
+from flask import Flask, request, jsonify, Response
+from werkzeug.formparser import parse_form_data
+import image_ingest
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ROUTER_BACKENDS = [b.strip().rstrip('/') for b in os.getenv('ROUTER_BACKENDS', '').split(',') if b.strip()]
+ROUTER_LOAD_FACTOR = float(os.getenv('ROUTER_LOAD_FACTOR', 1.25))
+ROUTER_VNODES = int(os.getenv('ROUTER_VNODES', 160))
+ROUTER_HEALTH_INTERVAL = float(os.getenv('ROUTER_HEALTH_INTERVAL', 2))
+ROUTER_TIMEOUT = float(os.getenv('ROUTER_TIMEOUT', 60))
+HEALTH_TIMEOUT = 2.0
+# Inference endpoints are routed by image; everything else goes to the least-loaded backend
+AFFINE_PATHS = ('/api/predict', '/api/embed', '/api/similar', '/api/explain')
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+              'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length', 'content-encoding'}
+
+
+def _point(value):
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+
+# ================================
+# Routing key
+# ================================
+def routing_key(body, content_type):
+    """
+    Bytes identifying the image in a request body: the imageUrl or the image bytes however
+    they were sent (raw, multipart or base64). Envelope details do not affect it
+    """
+    mimetype = content_type.split(';')[0].strip().lower()
+    if mimetype == 'application/json':
+        # Base64 is decoded, so an image keys the same whether it was uploaded or inlined
+        try:
+            data, image_bytes = image_ingest.parse_json_body(body)
+            if image_bytes is not None:
+                return image_bytes
+            if isinstance(data, dict) and isinstance(data.get('imageUrl'), str):
+                return data['imageUrl'].encode()
+            if isinstance(data, dict) and isinstance(data.get('image'), str):
+                image_data = data['image'].encode('ascii')
+                if b',' in image_data[:256]:
+                    image_data = image_data[image_data.index(b',') + 1:]
+                return image_ingest.decode_base64_into(image_data)
+        except (ValueError, binascii.Error, image_ingest.PayloadTooLarge):
+            pass
+        return body
+    if mimetype == 'multipart/form-data':
+        _, _, files = parse_form_data({
+            'wsgi.input': io.BytesIO(body), 'CONTENT_LENGTH': str(len(body)),
+            'CONTENT_TYPE': content_type, 'REQUEST_METHOD': 'POST',
+        })
+        for field in ('image', 'file'):
+            if field in files:
+                return files[field].read()
+    return body
+
+
+# ================================
+# Ring with bounded loads
+# ================================
+class Backend:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.spilled = 0  # Requests taken because the key's first choice was full
+        self.last_error = None
+
+
+class Ring:
+    def __init__(self, urls, vnodes=ROUTER_VNODES, load_factor=ROUTER_LOAD_FACTOR):
+        self.backends = {url: Backend(url) for url in urls}
+        self.load_factor = load_factor
+        self._points = sorted((_point(f"{url}#{i}".encode()), url) for url in urls for i in range(vnodes))
+        self._keys = [p for p, _ in self._points]
+        self._lock = threading.Lock()
+
+    def _capacity(self, healthy):
+        total = sum(b.inflight for b in healthy) + 1
+        return math.ceil(self.load_factor * total / len(healthy))
+
+    def candidates(self, key):
+        """Distinct backends in ring order from the key's position"""
+        start = bisect.bisect(self._keys, _point(key)) if key is not None else 0
+        seen = []
+        for i in range(len(self._points)):
+            url = self._points[(start + i) % len(self._points)][1]
+            if url not in seen:
+                seen.append(url)
+                if len(seen) == len(self.backends):
+                    break
+        return seen
+
+    def acquire(self, key, exclude=()):
+        """Claim the backend for a key (None: least loaded); returns a Backend or None"""
+        with self._lock:
+            healthy = [b for b in self.backends.values() if b.healthy and b.url not in exclude]
+            if not healthy:
+                return None
+            if key is None:
+                chosen = min(healthy, key=lambda b: b.inflight)
+            else:
+                capacity = self._capacity(healthy)
+                order = [self.backends[url] for url in self.candidates(key) if self.backends[url] in healthy]
+                chosen = next((b for b in order if b.inflight < capacity), order[0])
+                if chosen is not order[0]:
+                    chosen.spilled += 1
+            chosen.inflight += 1
+            chosen.requests += 1
+            return chosen
+
+    def release(self, backend):
+        with self._lock:
+            backend.inflight -= 1
+
+    def mark(self, backend, healthy, error=None):
+        with self._lock:
+            if backend.healthy and not healthy:
+                logger.warning(f"⚠️  Backend {backend.url} down: {error}")
+            elif healthy and not backend.healthy:
+                logger.info(f"✓ Backend {backend.url} back up")
+            backend.healthy = healthy
+            if not healthy:
+                backend.failures += 1
+                backend.last_error = str(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'load_factor': self.load_factor,
+                'backends': [{
+                    'url': b.url, 'healthy': b.healthy, 'inflight': b.inflight, 'requests': b.requests,
+                    'spilled': b.spilled, 'failures': b.failures, 'last_error': b.last_error,
+                } for b in self.backends.values()],
+            }
+
+
+def health_loop(ring, interval):
+    session = requests.Session()
+    while True:
+        for backend in list(ring.backends.values()):
+            try:
+                response = session.get(backend.url + '/health', timeout=HEALTH_TIMEOUT)
+                if response.status_code != 200:
+                    ring.mark(backend, False, f"/health returned {response.status_code}")
+                    continue
+                health = response.json()
+                ok = health.get('model_loaded') is True and health.get('status') == 'healthy'
+                ring.mark(backend, ok, None if ok else "/health reports the model is not loaded")
+            except (requests.RequestException, ValueError) as e:
+                ring.mark(backend, False, type(e).__name__)
+        time.sleep(interval)
+
+
+# ================================
+# Proxy
+# ================================
+app = Flask(__name__)
+ring = None
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
+
+def create_ring(backends):
+    global ring
+    ring = Ring(backends)
+    threading.Thread(target=health_loop, args=(ring, ROUTER_HEALTH_INTERVAL), name='router-health',
+                     daemon=True).start()
+    logger.info(f"✓ Routing across {len(backends)} backends: {', '.join(backends)}")
+
+
+if ROUTER_BACKENDS:
+    create_ring(ROUTER_BACKENDS)
+
+
+@app.route('/router/health', methods=['GET'])
+def router_health():
+    healthy = sum(b['healthy'] for b in ring.stats()['backends'])
+    return jsonify({'status': 'healthy' if healthy else 'unavailable', **ring.stats()}), 200 if healthy else 503
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'OPTIONS'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'OPTIONS'])
+def proxy(path):
+    body = request.get_data()
+    key = None
+    if request.method == 'POST' and request.path in AFFINE_PATHS:
+        key = routing_key(body, request.content_type or '')
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP}
+
+    tried = []
+    while True:
+        backend = ring.acquire(key, exclude=tried)
+        if backend is None:
+            return jsonify({'success': False, 'error': 'No healthy ML API backend'}), 503
+        tried.append(backend.url)
+        try:
+            upstream = session.request(request.method, backend.url + request.full_path.rstrip('?'),
+                                       data=body, headers=headers, timeout=ROUTER_TIMEOUT)
+        except requests.ConnectionError as e:
+            # Unreachable or died mid-request; predictions are idempotent, so try the next backend
+            ring.mark(backend, False, type(e).__name__)
+            continue
+        except requests.Timeout:
+            return jsonify({'success': False, 'error': f'Backend {backend.url} timed out'}), 504
+        finally:
+            ring.release(backend)
+        if upstream.status_code == 503 and len(tried) < len(ring.backends):
+            continue  # This instance can't serve it (e.g. no embedding index); another may
+        response = Response(upstream.content, status=upstream.status_code,
+                            headers=[(k, v) for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP])
+        response.headers['X-Routed-To'] = backend.url
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache-affine router for ML API instances")
+    parser.add_argument('--backends', default=','.join(ROUTER_BACKENDS),
+                        help="comma-separated backend URLs, e.g. http://localhost:5001,http://localhost:5002")
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    args = parser.parse_args()
+    backends = [b.strip().rstrip('/') for b in args.backends.split(',') if b.strip()]
+    if not backends:
+        parser.error("No backends (use --backends or ROUTER_BACKENDS)")
+    if ring is None:
+        create_ring(backends)
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
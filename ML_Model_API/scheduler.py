@@ -0,0 +1,225 @@
+"""
+Priority lanes and weighted fair queuing in front of the model
+Request threads no longer call the model themselves. They submit their preprocessed tensor
+and wait, and one inference thread per worker decides what runs next:
+
+- interactive work (the mobile app) always goes first, in small batches so a burst of
+  scans shares one forward pass
+- bulk work (rescoring jobs) only runs when no interactive work is waiting, in larger
+  batches grouped by input shape. A running batch cannot be preempted, so bulk batches are
+  sized to finish within BULK_BATCH_BUDGET_MS; that bounds how long a newly arrived
+  interactive request can wait behind bulk work
+- within a lane, tenants (API keys) share the model by weighted fair queuing, so one
+  tenant's backlog cannot starve another's
+
+Bulk requests are also admitted through a semaphore smaller than the worker's request
+thread pool. Request threads therefore stay free for interactive traffic, and excess bulk
+requests get a 429 to retry instead of queueing inside gunicorn.
+
+Environment:
+    BULK_API_KEYS        comma-separated API keys whose requests always use the bulk lane
+    TENANT_WEIGHTS       "key:weight,..." share of the model per tenant (default weight 1)
+    BULK_MAX_INFLIGHT    bulk requests admitted per worker (default: request threads - 2)
+    BULK_MAX_BATCH       images per bulk forward pass (default 16)
+    BULK_BATCH_BUDGET_MS target duration of one bulk forward pass (default 60)
+    INTERACTIVE_MAX_BATCH  images per interactive forward pass (default 4)
+"""
+import os
+import time
+import heapq
+import logging
+import threading
+import itertools
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+BULK_API_KEYS = frozenset(k.strip() for k in os.getenv('BULK_API_KEYS', '').split(',') if k.strip())
+BULK_MAX_BATCH = int(os.getenv('BULK_MAX_BATCH', 16))
+INTERACTIVE_MAX_BATCH = int(os.getenv('INTERACTIVE_MAX_BATCH', 4))
+BULK_BATCH_BUDGET_MS = float(os.getenv('BULK_BATCH_BUDGET_MS', 60))
+
+
+def parse_weights(spec):
+    """'key:2,other:0.5' -> {'key': 2.0, 'other': 0.5}"""
+    weights = {}
+    for item in spec.split(','):
+        if ':' in item:
+            tenant, weight = item.rsplit(':', 1)
+            weights[tenant.strip()] = max(float(weight), 1e-3)
+    return weights
+
+
+TENANT_WEIGHTS = parse_weights(os.getenv('TENANT_WEIGHTS', ''))
+
+
+def classify(api_key, priority_header):
+    """(lane, tenant) for a request; keys listed in BULK_API_KEYS cannot opt into the interactive lane"""
+    tenant = api_key or 'anonymous'
+    if api_key in BULK_API_KEYS or (priority_header or '').strip().lower() == BULK:
+        return BULK, tenant
+    return INTERACTIVE, tenant
+
+
+class BulkBusy(Exception):
+    """Raised when every bulk slot of this worker is taken"""
+
+
+class _Lane:
+    """Jobs of one priority class, ordered by their weighted-fair-queuing finish tag"""
+
+    def __init__(self):
+        self.heap = []
+        self.virtual_time = 0.0
+        self.finish_tags = {}  # tenant -> finish tag of its last queued job
+
+    def push(self, job, seq, weight):
+        # Start where the tenant's previous job finishes, or now if the tenant was idle
+        start = max(self.virtual_time, self.finish_tags.get(job['tenant'], 0.0))
+        tag = start + job['count'] / weight
+        self.finish_tags[job['tenant']] = tag
+        heapq.heappush(self.heap, (tag, seq, job))
+
+    def pop_batch(self, max_batch):
+        """Jobs in tag order sharing the first job's input shape, up to max_batch images in total"""
+        tag, _, first = heapq.heappop(self.heap)
+        self.virtual_time = tag
+        batch, skipped, images = [first], [], first['count']
+        while self.heap and images < max_batch:
+            entry = heapq.heappop(self.heap)
+            if entry[2]['shape'] == first['shape'] and images + entry[2]['count'] <= max_batch:
+                batch.append(entry[2])
+                images += entry[2]['count']
+                self.virtual_time = entry[0]
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        if not self.heap:
+            self.finish_tags.clear()  # Every tenant is idle; restart the clock
+        return batch
+
+
+class Scheduler:
+    """
+    Single inference thread fed by two priority lanes
+    run_batch(tensor [B, ...]) must return one result per row; it only ever runs on the
+    scheduler thread, so thread-local model state (FeatureTap) stays consistent.
+    """
+
+    def __init__(self, run_batch, bulk_max_inflight=4,
+                 interactive_max_batch=INTERACTIVE_MAX_BATCH, bulk_max_batch=BULK_MAX_BATCH,
+                 bulk_budget_ms=BULK_BATCH_BUDGET_MS, weights=None):
+        self.run_batch = run_batch
+        self.max_batch = {INTERACTIVE: max(1, interactive_max_batch), BULK: max(1, bulk_max_batch)}
+        self.bulk_budget_ms = bulk_budget_ms
+        self._image_ms = None  # Moving average of bulk forward time per image
+        self.weights = weights if weights is not None else TENANT_WEIGHTS
+        self.bulk_max_inflight = max(1, bulk_max_inflight)
+        self._bulk_slots = threading.BoundedSemaphore(self.bulk_max_inflight)
+        self._lanes = {lane: _Lane() for lane in LANES}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {lane: Counter() for lane in LANES}
+        self._thread = threading.Thread(target=self._loop, name='inference-scheduler', daemon=True)
+        self._thread.start()
+
+    # ---- request side ----
+    def admit(self, lane):
+        """Claim a bulk slot (no-op for interactive); raises BulkBusy when none is free"""
+        if lane == BULK and not self._bulk_slots.acquire(blocking=False):
+            with self._cond:
+                self._stats[BULK]['rejected'] += 1
+            raise BulkBusy(f"All {self.bulk_max_inflight} bulk slots of this worker are busy")
+
+    def release(self, lane):
+        if lane == BULK:
+            self._bulk_slots.release()
+
+    def submit(self, tensor, lane=INTERACTIVE, tenant='anonymous'):
+        """
+        Queue preprocessed images [N, ...] that must run in one forward pass (N > 1 for tiles)
+        The Future resolves to (run_batch's N rows for them, batch start time)
+        """
+        future = Future()
+        job = {'tensor': tensor, 'count': tensor.shape[0], 'shape': tuple(tensor.shape[1:]),
+               'tenant': tenant, 'future': future}
+        with self._cond:
+            self._lanes[lane].push(job, next(self._seq), self.weights.get(tenant, 1.0))
+            self._stats[lane]['submitted'] += 1
+            self._cond.notify()
+        return future
+
+    def queued_images(self, lane=None):
+        """Images waiting for a forward pass in one lane, or both (excluding the running batch)"""
+        with self._cond:
+            lanes = [self._lanes[lane]] if lane is not None else self._lanes.values()
+            return sum(entry[2]['count'] for queue in lanes for entry in queue.heap)
+
+    # ---- inference thread ----
+    def _batch_limit(self, lane):
+        if lane == BULK and self._image_ms:
+            return int(min(self.max_batch[BULK], max(1, self.bulk_budget_ms // self._image_ms)))
+        return self.max_batch[lane]
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                for lane in LANES:  # Strict priority: bulk only runs when interactive is empty
+                    if self._lanes[lane].heap:
+                        return lane, self._lanes[lane].pop_batch(self._batch_limit(lane))
+                self._cond.wait()
+
+    def _loop(self):
+        import torch
+
+        while True:
+            lane, batch = self._next_batch()
+            started = time.perf_counter()
+            try:
+                tensors = torch.cat([job['tensor'] for job in batch])
+                results = self.run_batch(tensors)
+                offset = 0
+                for job in batch:
+                    job['future'].set_result((results[offset:offset + job['count']], started))
+                    offset += job['count']
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} {lane} jobs failed: {e}", exc_info=True)
+                for job in batch:
+                    if not job['future'].done():
+                        job['future'].set_exception(e)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            images = sum(job['count'] for job in batch)
+            with self._cond:
+                self._stats[lane]['batches'] += 1
+                self._stats[lane]['images'] += images
+                if lane == BULK:
+                    per_image = elapsed_ms / images
+                    self._image_ms = per_image if self._image_ms is None else 0.8 * self._image_ms + 0.2 * per_image
+
+    @property
+    def thread_ident(self):
+        """Ident of the inference thread (for profilers)"""
+        return self._thread.ident
+
+    def stats(self):
+        with self._cond:
+            report = {}
+            for lane in LANES:
+                counts = self._stats[lane]
+                report[lane] = {
+                    'queued': len(self._lanes[lane].heap),
+                    'submitted': counts['submitted'],
+                    'batches': counts['batches'],
+                    'mean_batch_size': counts['images'] / counts['batches'] if counts['batches'] else 0.0,
+                    'max_batch': self.max_batch[lane],
+                }
+            report[BULK]['rejected'] = self._stats[BULK]['rejected']
+            report[BULK]['max_inflight'] = self.bulk_max_inflight
+            report[BULK]['current_batch_limit'] = self._batch_limit(BULK)
+            return report
@@ -0,0 +1,208 @@
+"""
+Sharded, memory-mapped dataset format
+Packs each ImageFolder split into a few large shard files plus an index so training and
+evaluation read big sequential files instead of thousands of small ones.
+
+Layout of a packed split:
+    <out>/<split>/shards.json     class table, sample count, shard file names
+    <out>/<split>/index.npz       per-sample shard id, byte offset, byte length, label
+    <out>/<split>/shard-00000.bin concatenated encoded image bytes
+
+Usage: python shard_dataset.py <dataset_split_dir> <output_dir> [--shard-size-mb 512]
+"""
+import os
+import io
+import sys
+import json
+import mmap
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+
+SHARD_FORMAT = 'agrolens-shards'
+SHARD_VERSION = 1
+SHARD_META_FILE = 'shards.json'
+SHARD_INDEX_FILE = 'index.npz'
+
+# Same extensions torchvision's ImageFolder accepts
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+
+def is_sharded_split(split_dir):
+    """True if split_dir holds a packed split rather than class folders"""
+    return os.path.exists(os.path.join(split_dir, SHARD_META_FILE))
+
+
+def read_shard_meta(split_dir):
+    """Load shards.json for a packed split"""
+    with open(os.path.join(split_dir, SHARD_META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != SHARD_FORMAT:
+        raise ValueError(f"{split_dir} is not a {SHARD_FORMAT} split")
+    return meta
+
+
+def scan_image_folder(split_dir):
+    """(classes, [(path, label), ...]) in the same order ImageFolder uses"""
+    classes = sorted(entry.name for entry in os.scandir(split_dir) if entry.is_dir())
+    samples = []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(split_dir, class_name)
+        for root, _, files in sorted(os.walk(class_dir, followlinks=True)):
+            for name in sorted(files):
+                if name.lower().endswith(IMG_EXTENSIONS):
+                    samples.append((os.path.join(root, name), label))
+    return classes, samples
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def pack_split(split_dir, out_dir, shard_size_mb=512, io_threads=16):
+    """Pack one ImageFolder split into shards; returns the number of samples written"""
+    classes, samples = scan_image_folder(split_dir)
+    if not samples:
+        raise ValueError(f"No images found in {split_dir}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, SHARD_META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # Mark the split incomplete while it is rewritten
+    shard_limit = shard_size_mb * 1024 * 1024
+
+    shard_ids = np.zeros(len(samples), dtype=np.uint16)
+    offsets = np.zeros(len(samples), dtype=np.uint64)
+    lengths = np.zeros(len(samples), dtype=np.uint32)
+    labels = np.asarray([label for _, label in samples], dtype=np.int32)
+
+    shard_names = []
+    shard_file = None
+    shard_pos = 0
+
+    def _write_sample(i, data):
+        nonlocal shard_file, shard_pos
+        if shard_file is None or (shard_pos > 0 and shard_pos + len(data) > shard_limit):
+            if shard_file is not None:
+                shard_file.close()
+            shard_names.append(f"shard-{len(shard_names):05d}.bin")
+            shard_file = open(os.path.join(out_dir, shard_names[-1]), 'wb')
+            shard_pos = 0
+
+        shard_file.write(data)
+        shard_ids[i] = len(shard_names) - 1
+        offsets[i] = shard_pos
+        lengths[i] = len(data)
+        shard_pos += len(data)
+
+    # Reads are parallel (network disks reward concurrency), writes stay sequential.
+    # Files are read in chunks so at most a chunk's worth of bytes is held in memory.
+    chunk = io_threads * 8
+    with ThreadPoolExecutor(max_workers=io_threads) as pool:
+        for chunk_start in range(0, len(samples), chunk):
+            paths = [path for path, _ in samples[chunk_start:chunk_start + chunk]]
+            for i, data in enumerate(pool.map(_read_file, paths), start=chunk_start):
+                _write_sample(i, data)
+    shard_file.close()
+
+    np.savez(os.path.join(out_dir, SHARD_INDEX_FILE),
+             shard=shard_ids, offset=offsets, length=lengths, label=labels)
+
+    # Written last: a split without shards.json is treated as incomplete
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'format': SHARD_FORMAT,
+            'version': SHARD_VERSION,
+            'classes': classes,
+            'count': len(samples),
+            'shards': shard_names,
+        }, f, indent=2)
+    return len(samples)
+
+
+class ShardedImageDataset(Dataset):
+    """
+    Dataset over a packed split
+
+    Shards are mmapped lazily in each DataLoader worker; raw_bytes() returns a zero-copy
+    memoryview into the mapping, decoded with PIL only when an item is requested.
+    """
+
+    def __init__(self, split_dir, transform=None):
+        meta = read_shard_meta(split_dir)
+        index = np.load(os.path.join(split_dir, SHARD_INDEX_FILE))
+
+        self.split_dir = split_dir
+        self.transform = transform
+        self.classes = meta['classes']
+        self.class_to_idx = {name: i for i, name in enumerate(self.classes)}
+        self.shard_names = meta['shards']
+        self.shard_ids = index['shard']
+        self.offsets = index['offset']
+        self.lengths = index['length']
+        self.targets = index['label'].astype(np.int64).tolist()
+        self._maps = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getstate__(self):
+        # mmap objects can't be pickled into workers; each worker maps the shards itself
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def _open(self):
+        self._maps = []
+        for name in self.shard_names:
+            with open(os.path.join(self.split_dir, name), 'rb') as f:
+                self._maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def raw_bytes(self, idx):
+        """Encoded image bytes for one sample as a memoryview into the shard mapping"""
+        if self._maps is None:
+            self._open()
+        start = int(self.offsets[idx])
+        end = start + int(self.lengths[idx])
+        return memoryview(self._maps[self.shard_ids[idx]])[start:end]
+
+    def __getitem__(self, idx):
+        image = Image.open(io.BytesIO(self.raw_bytes(idx))).convert('RGB')
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack dataset_split/{train,val,test} into mmap-able shards")
+    parser.add_argument('data_dir', help="dataset_split directory containing train/val/test")
+    parser.add_argument('output_dir', help="where to write the packed splits")
+    parser.add_argument('--shard-size-mb', type=int, default=512)
+    parser.add_argument('--io-threads', type=int, default=16)
+    parser.add_argument('--splits', default='train,val,test')
+    args = parser.parse_args()
+
+    print(f"\n{'='*60}")
+    print(f"Packing dataset into shards")
+    print(f"{'='*60}")
+    print(f"Source: {args.data_dir}")
+    print(f"Output: {args.output_dir}\n")
+
+    for split in args.splits.split(','):
+        split_dir = os.path.join(args.data_dir, split)
+        if not os.path.isdir(split_dir):
+            print(f"⚠️  Skipping {split}: {split_dir} not found")
+            continue
+        count = pack_split(split_dir, os.path.join(args.output_dir, split),
+                           shard_size_mb=args.shard_size_mb, io_threads=args.io_threads)
+        meta = read_shard_meta(os.path.join(args.output_dir, split))
+        print(f"✅ {split}: {count} images, {len(meta['classes'])} classes, {len(meta['shards'])} shards")
+
+    print(f"\n{'='*60}\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# ====================================================================
+# 1. DEFINE PATHS (Use the absolute, short paths for I/O)
+# ====================================================================
+
+# This is the folder that CONTAINS all 97 class subfolders.
+INPUT_FOLDER = r"E:\data\dataset"
+
+# This is where the script will CREATE the dataset_split folder containing train/val/test.
+OUTPUT_FOLDER = r"E:\data\dataset_split"
+
+# Records what was placed where, so re-runs only touch new/changed/deleted files
+MANIFEST_FILE = os.path.join(OUTPUT_FOLDER, ".split_manifest.json")
+
+# ====================================================================
+# 2. DEFINE SPLIT RATIO
+# ====================================================================
+# (train, validation, test) -> 70% / 15% / 15%
+SPLIT_RATIO = (0.7, 0.15, 0.15)
+SPLIT_NAMES = ("train", "val", "test")
+
+# Each file's split is derived from a hash of its relative path, so the same file always
+# lands in the same split no matter what else was added. Changing the salt reshuffles all.
+SPLIT_SALT = "agrolens-split-v1"
+
+# ====================================================================
+# 3. DEFINE FILE PLACEMENT
+# ====================================================================
+# "hardlink" shares disk blocks with the source (no extra space); falls back to a symlink,
+# then to a copy when links aren't possible (e.g. output on another drive).
+LINK_MODE = "hardlink"   # "hardlink" | "symlink" | "copy"
+MAX_WORKERS = 32         # File operations are I/O bound, so more threads than cores is fine
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+
+def assign_split(rel_path):
+    """Deterministically map a relative path to one of SPLIT_NAMES"""
+    key = (SPLIT_SALT + "|" + rel_path).encode("utf-8")
+    # First 8 bytes of the digest as a uniform number in [0, 1)
+    u = int.from_bytes(hashlib.sha1(key).digest()[:8], "big") / 2**64
+    cumulative = 0.0
+    for name, ratio in zip(SPLIT_NAMES, SPLIT_RATIO):
+        cumulative += ratio
+        if u < cumulative:
+            return name
+    return SPLIT_NAMES[-1]
+
+
+def scan_input(input_folder):
+    """{relative posix path: (size, mtime_ns)} for every image under input_folder"""
+    files = {}
+    for root, _, names in os.walk(input_folder):
+        for name in names:
+            if not name.lower().endswith(IMG_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            # Posix separators keep hashes (and therefore splits) identical across OSes
+            rel_path = os.path.relpath(path, input_folder).replace(os.sep, "/")
+            files[rel_path] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f).get("files", {})
+
+
+def save_manifest(entries):
+    # Write-then-rename so an interrupted run never leaves a truncated manifest
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"salt": SPLIT_SALT, "ratio": SPLIT_RATIO, "files": entries}, f)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def output_path(split, rel_path):
+    return os.path.join(OUTPUT_FOLDER, split, *rel_path.split("/"))
+
+
+def place_file(src, dst):
+    """Hardlink/symlink/copy src to dst; returns the method that worked"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if LINK_MODE == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    if LINK_MODE in ("hardlink", "symlink"):
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def remove_file(dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+
+def class_of(rel_path):
+    """Class folder a relative path belongs to (its first component)"""
+    return rel_path.split("/", 1)[0]
+
+
+def ensure_class_dirs(classes):
+    """
+    Create every class folder in every split, even where hashing placed no file of that class
+    ImageFolder numbers classes by the folders it finds, so a missing folder would silently shift
+    every later class index. An empty folder makes it fail loudly instead.
+    """
+    for split in SPLIT_NAMES:
+        for name in classes:
+            os.makedirs(os.path.join(OUTPUT_FOLDER, split, name), exist_ok=True)
+
+
+def split_dataset():
+    """Place new/changed files, drop deleted ones, keep everything else untouched"""
+    current = scan_input(INPUT_FOLDER)
+    manifest = load_manifest()
+
+    to_place = []
+    for rel_path, (size, mtime_ns) in current.items():
+        split = assign_split(rel_path)
+        entry = manifest.get(rel_path)
+        if (entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns
+                and entry["split"] == split and os.path.lexists(output_path(split, rel_path))):
+            continue
+        to_place.append((rel_path, split))
+
+    # Deleted sources, plus stale copies of files whose split changed (new salt/ratio)
+    to_remove = [
+        output_path(entry["split"], rel_path)
+        for rel_path, entry in manifest.items()
+        if rel_path not in current or entry["split"] != assign_split(rel_path)
+    ]
+
+    print(f"Found {len(current)} images: {len(to_place)} to place, "
+          f"{len(to_remove)} to remove, {len(current) - len(to_place)} unchanged")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        list(pool.map(remove_file, to_remove))
+        methods = list(pool.map(
+            lambda item: place_file(os.path.join(INPUT_FOLDER, *item[0].split("/")),
+                                    output_path(item[1], item[0])),
+            to_place
+        ))
+
+    entries = {
+        rel_path: entry for rel_path, entry in manifest.items()
+        if rel_path in current and entry["split"] == assign_split(rel_path)
+    }
+    for (rel_path, split), method in zip(to_place, methods):
+        size, mtime_ns = current[rel_path]
+        entries[rel_path] = {"split": split, "size": size, "mtime_ns": mtime_ns, "method": method}
+    save_manifest(entries)
+
+    classes = sorted({class_of(rel_path) for rel_path in entries if "/" in rel_path})
+    ensure_class_dirs(classes)
+
+    counts = {name: 0 for name in SPLIT_NAMES}
+    class_counts = {name: dict.fromkeys(classes, 0) for name in SPLIT_NAMES}
+    for rel_path, entry in entries.items():
+        counts[entry["split"]] += 1
+        if "/" in rel_path:
+            class_counts[entry["split"]][class_of(rel_path)] += 1
+    empty = {split: [name for name, count in per_class.items() if count == 0]
+             for split, per_class in class_counts.items()}
+    method_counts = {}
+    for method in methods:
+        method_counts[method] = method_counts.get(method, 0) + 1
+    return counts, method_counts, empty
+
+
+# ====================================================================
+# 4. RUN THE SPLIT
+# ====================================================================
+if __name__ == "__main__":
+    # Allow command line overrides: python split_data.py [input_folder] [output_folder]
+    if len(sys.argv) > 1:
+        INPUT_FOLDER = sys.argv[1]
+    if len(sys.argv) > 2:
+        OUTPUT_FOLDER = sys.argv[2]
+        MANIFEST_FILE = os.path.join(OUTPUT_FOLDER, ".split_manifest.json")
+
+    print(f"Starting dataset split from: {INPUT_FOLDER}")
+
+    if not os.path.exists(INPUT_FOLDER):
+        sys.exit(f"❌ ERROR: Input folder not found at {INPUT_FOLDER}. Check your extraction path.")
+
+    try:
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        counts, method_counts, empty = split_dataset()
+        print("\n✅ Dataset successfully split!")
+        print(f"New splits are available at: {OUTPUT_FOLDER}")
+        print("   " + ", ".join(f"{name}: {count}" for name, count in counts.items()))
+        if method_counts:
+            print("   Placed via " + ", ".join(f"{m}: {c}" for m, c in method_counts.items()))
+        for split, names in empty.items():
+            if names:
+                print(f"⚠️  WARNING: {len(names)} class(es) have no images in {split} "
+                      f"(too few images to fill every split): {', '.join(names)}")
+                print(f"   Their {split} folders are empty, so ImageFolder will refuse to load {split} "
+                      f"until those classes get more images.")
+
+    except Exception as e:
+        print(f"\n❌ An error occurred during splitting: {e}")
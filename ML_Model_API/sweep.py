@@ -0,0 +1,244 @@
+"""
+Parallel hyperparameter sweep over model.train() with successive halving
+Trials run in a local process pool. Each pool process is pinned to its own disjoint
+slice of the cores, and torch and the DataLoader workers are sized to that slice, so
+trials never compete for a core. The dataset is decoded once into a shared pixel cache
+(data_pipeline.build_decoded_cache). Every trial then memory-maps the same file, so
+page-cache pages are shared rather than each trial decoding JPEGs itself.
+
+Successive halving: every trial trains for --min-epochs. The best 1/eta (by best val
+accuracy) resume from their checkpoints for eta times as many epochs, and so on up to
+--max-epochs. Trials that early-stop (patience) finish where they are.
+
+Output in --output (default sweeps/<timestamp>):
+    trial-NNN/          checkpoints, best_mobilenetv2.pth/.bundle and train.log per trial
+    results.csv/.json   one row per trial, best first; rewritten after every rung
+
+Usage:
+    python sweep.py --data-dir dataset_split --param learning_rate=1e-4,3e-4,1e-3 \\
+        --param batch_size=32,64 --param unfreeze_last=20,40,0 --parallel 2 --max-epochs 18
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading_config
+
+_cores = None  # This pool process's core slice, set by _init_worker
+
+
+def parse_param(spec):
+    """'name=v1,v2' -> (name, [v1, v2]); values are JSON when they parse, strings otherwise"""
+    name, _, values = spec.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError(f"Expected name=value[,value...], got {spec!r}")
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(json.loads(value))
+        except json.JSONDecodeError:
+            parsed.append(value)
+    return name.strip(), parsed
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    """Epoch budget per rung: min_epochs, min_epochs * eta, ... capped by max_epochs"""
+    budgets, budget = [], min_epochs
+    while budget < max_epochs:
+        budgets.append(budget)
+        budget *= eta
+    return budgets + [max_epochs]
+
+
+# ================================
+# Pool workers
+# ================================
+def _init_worker(slots, core_sets):
+    global _cores
+    _cores = core_sets[slots.get()]
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, _cores)  # DataLoader workers inherit the mask
+    import torch
+    torch.set_num_threads(len(_cores))
+
+
+def run_trial(trial, config):
+    """Train one trial up to config['epochs'] (resuming its checkpoints); runs in a pool process"""
+    import model
+
+    config = dict(config)
+    if config.get('num_workers') is None:
+        config['num_workers'] = max(0, len(_cores or [0]) - 1)
+    os.makedirs(config['output_dir'], exist_ok=True)
+    log_path = os.path.join(config['output_dir'], 'train.log')
+    started = time.perf_counter()
+    with open(log_path, 'a', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        print(f"\n===== {trial}: up to {config['epochs']} epochs on cores {_cores} =====")
+        result = model.train(config)
+    history = result['history']
+    return {
+        'best_val_acc': result['best_val_acc'],
+        'epochs': result['epochs_completed'],
+        'stopped_early': result['stopped_early'],
+        'train_images_per_sec': history['train_images_per_sec'][-1] if history['train_images_per_sec'] else 0.0,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+# ================================
+# Sweep driver
+# ================================
+def write_results(trials, param_names, output_dir):
+    rows = sorted(trials.values(), key=lambda t: t.get('best_val_acc') or -1.0, reverse=True)
+    with open(os.path.join(output_dir, 'results.json'), 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
+    columns = ['trial', 'status', 'epochs', 'best_val_acc', 'seconds', 'train_images_per_sec'] + param_names
+    with open(os.path.join(output_dir, 'results.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row.get(c, row['params'].get(c)) for c in columns])
+    return rows
+
+
+def print_table(rows, param_names):
+    header = f"{'trial':<10}{'status':<16}{'epochs':>7}{'val_acc':>9}{'minutes':>9}  " + '  '.join(param_names)
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        acc = f"{row['best_val_acc']:.4f}" if row.get('best_val_acc') is not None else '-'
+        params = '  '.join(str(row['params'][name]) for name in param_names)
+        print(f"{row['trial']:<10}{row['status']:<16}{row.get('epochs', 0):>7}{acc:>9}"
+              f"{row.get('seconds', 0.0) / 60:>9.1f}  {params}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with successive halving")
+    parser.add_argument('--data-dir', required=True, help="dataset_split (ImageFolder or shard splits)")
+    parser.add_argument('--param', type=parse_param, action='append', default=[],
+                        help="name=v1,v2,... for any key of model.default_config(); repeat per parameter")
+    parser.add_argument('--samples', type=int, default=None, help="random subset of the grid (default: all)")
+    parser.add_argument('--parallel', type=int, default=2, help="trials running at once")
+    parser.add_argument('--min-epochs', type=int, default=2)
+    parser.add_argument('--max-epochs', type=int, default=None, help="default model.epochs")
+    parser.add_argument('--eta', type=int, default=3, help="keep the best 1/eta of trials at each rung")
+    parser.add_argument('--cache-dir', default=None, help="shared decoded cache (default <output>/decoded_cache)")
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import model
+    import data_pipeline
+    from torchvision import models
+
+    defaults = model.default_config()
+    params = dict(args.param)
+    unknown = sorted(set(params) - set(defaults))
+    if unknown:
+        parser.error(f"Unknown parameters {unknown}; choose from {sorted(defaults)}")
+    param_names = list(params)
+    grid = [dict(zip(param_names, values)) for values in itertools.product(*params.values())] or [{}]
+    if args.samples and args.samples < len(grid):
+        grid = random.Random(args.seed).sample(grid, args.samples)
+
+    output_dir = args.output or os.path.join('sweeps', time.strftime('%Y%m%d-%H%M%S'))
+    cache_dir = args.cache_dir or os.path.join(output_dir, 'decoded_cache')
+    os.makedirs(output_dir, exist_ok=True)
+    max_epochs = args.max_epochs or defaults['epochs']
+    budgets = rung_budgets(args.min_epochs, max_epochs, args.eta)
+
+    # Shared, decode-once inputs: the pixel cache and the pretrained weights
+    data_pipeline.load_datasets(args.data_dir, data_pipeline.build_transforms(defaults['img_size']),
+                                cache_dir=cache_dir, cache_resolution=defaults['cache_resolution'])
+    models.mobilenet_v2(weights='IMAGENET1K_V1')
+
+    cores = threading_config.available_cores()
+    parallel = max(1, min(args.parallel, len(grid), len(cores)))
+    core_sets = [threading_config.worker_core_set(cores, slot, parallel) for slot in range(parallel)]
+
+    trials = {}
+    for number, values in enumerate(grid):
+        name = f"trial-{number:03d}"
+        trial_dir = os.path.join(output_dir, name)
+        trials[name] = {
+            'trial': name,
+            'status': 'pending',
+            'params': values,
+            'config': {
+                **values,
+                'data_dir': args.data_dir,
+                'cache_dir': cache_dir,
+                'output_dir': trial_dir,
+                'checkpoint_dir': os.path.join(trial_dir, 'checkpoints'),
+                'resume': 'latest',
+                'progress': False,
+                'evaluate_test': False,
+            },
+        }
+
+    print(f"\n{'='*60}")
+    print(f"Sweep: {len(trials)} trials, {parallel} at a time on {len(cores)} cores")
+    print(f"Rungs (epochs): {budgets}, keeping 1/{args.eta} each time")
+    print(f"Output: {output_dir}")
+    print(f"{'='*60}\n")
+
+    ctx = mp.get_context('spawn')
+    slots = ctx.Queue()
+    for slot in range(parallel):
+        slots.put(slot)
+    active = list(trials)
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=ctx,
+                             initializer=_init_worker, initargs=(slots, core_sets)) as pool:
+        for rung, budget in enumerate(budgets):
+            futures = {
+                pool.submit(run_trial, name, {**trials[name]['config'], 'epochs': budget}): name
+                for name in active
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                trial = trials[name]
+                try:
+                    result = future.result()
+                    result['seconds'] += trial.get('seconds', 0.0)  # Total over all rungs
+                    trial.update(result)
+                    trial['status'] = 'stopped early' if trial['stopped_early'] else 'running'
+                except Exception as e:
+                    trial['status'], trial['error'] = 'failed', f"{type(e).__name__}: {e}"
+                    print(f"  ❌ rung {rung} ({budget} epochs) {name}: {trial['error']}")
+                    continue
+                print(f"  rung {rung} ({budget} epochs) {name}: {trial['status']}, "
+                      f"val acc {trial['best_val_acc']:.4f}")
+
+            contenders = sorted((n for n in active if trials[n]['status'] == 'running'),
+                                key=lambda n: trials[n]['best_val_acc'], reverse=True)
+            if rung < len(budgets) - 1:
+                keep = max(1, math.ceil(len(contenders) / args.eta))
+                for name in contenders[keep:]:
+                    trials[name]['status'] = f"pruned@{budget}"
+                active = contenders[:keep]
+            else:
+                for name in contenders:
+                    trials[name]['status'] = 'complete'
+            write_results(trials, param_names, output_dir)
+
+    rows = write_results(trials, param_names, output_dir)
+    print(f"\n{'='*60}")
+    print_table(rows, param_names)
+    print(f"{'='*60}")
+    if rows and rows[0].get('best_val_acc') is not None:
+        print(f"✅ Best: {rows[0]['trial']} {rows[0]['params']} (val acc {rows[0]['best_val_acc']:.4f})")
+    print(f"Results: {os.path.join(output_dir, 'results.csv')}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ from torchvision import models, transforms
 from PIL import Image
 import os
 import json
+import model_bundle
 
 class DiseaseDetectionModel:
     def __init__(self, model_path='best_mobilenetv2.pth', num_classes=None, data_dir=r"E:\data\dataset_split"):
@@ -17,6 +18,9 @@ class DiseaseDetectionModel:
         """
         self.model_path = model_path
         self.data_dir = data_dir
+        # Bundles carry their own class table and preprocessing spec
+        self.bundle_metadata = model_bundle.read_header(model_path)[0]['metadata'] \
+            if model_bundle.is_bundle(model_path) else None
         self.device = self._setup_device()
         self.num_classes = num_classes if num_classes else self._detect_num_classes()
         self.class_names = self._load_class_names()
@@ -36,19 +40,19 @@ class DiseaseDetectionModel:
     
     def _detect_num_classes(self):
         """Detect number of classes from the saved model"""
-        try:
-            state_dict = torch.load(self.model_path, map_location='cpu', weights_only=False)
-            # Get the classifier weight shape
-            classifier_weight = state_dict['classifier.1.weight']
-            num_classes = classifier_weight.shape[0]
-            print(f"Detected {num_classes} classes from model")
-            return num_classes
-        except Exception as e:
-            print(f"Could not auto-detect classes: {e}")
-            return 38  # Default fallback
+        if self.bundle_metadata is not None:
+            return self.bundle_metadata['architecture']['num_classes']
+        state_dict = torch.load(self.model_path, map_location='cpu', weights_only=False)
+        # Get the classifier weight shape
+        classifier_weight = state_dict['classifier.1.weight']
+        num_classes = classifier_weight.shape[0]
+        print(f"Detected {num_classes} classes from model")
+        return num_classes
     
     def _load_class_names(self):
-        """Load class names from the dataset directory"""
+        """Load class names from the bundle, else from the dataset directory"""
+        if self.bundle_metadata is not None:
+            return list(self.bundle_metadata['class_names'])
         try:
             train_dir = os.path.join(self.data_dir, "train")
             if os.path.exists(train_dir):
@@ -67,6 +71,12 @@ class DiseaseDetectionModel:
         """Load the trained MobileNetV2 model"""
         print(f"Loading model from {self.model_path}...")
         
+        if self.bundle_metadata is not None:
+            # Weights are mapped straight from the bundle file, no copy
+            model, _ = model_bundle.load_model(self.model_path)
+            print("✓ Model loaded successfully")
+            return model.to(self.device)
+        
         # Create model architecture
         model = models.mobilenet_v2(weights=None)
         model.classifier[1] = nn.Linear(model.last_channel, self.num_classes)
@@ -85,6 +95,8 @@ class DiseaseDetectionModel:
     
     def _get_transforms(self):
         """Get image transformation pipeline"""
+        if self.bundle_metadata is not None:
+            return model_bundle.build_transform(self.bundle_metadata['preprocessing'])
         return transforms.Compose([
             transforms.Resize((224, 224)),
             transforms.ToTensor(),
@@ -92,67 +104,99 @@ class DiseaseDetectionModel:
                                [0.229, 0.224, 0.225])
         ])
     
-    def predict_image(self, image_path):
+    def _load_image(self, source):
+        """PIL image from a path, an open binary file handle or an already opened image"""
+        if isinstance(source, Image.Image):
+            image = source
+        elif hasattr(source, 'read'):
+            image = Image.open(source)
+        else:
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"Image not found: {source}")
+            image = Image.open(source)
+        return image.convert('RGB')
+    
+    def _to_tensor(self, source):
+        """Preprocessed [3, 224, 224] tensor; tensors are assumed to be preprocessed already"""
+        if torch.is_tensor(source):
+            return source
+        return self.transform(self._load_image(source))
+    
+    def predict_tensor(self, batch):
         """
-        Predict disease from a single image
+        One forward pass over a preprocessed batch [N, 3, H, W]
+        
+        Returns:
+            list: One Prediction per row, all backed by the same logits tensor
+        """
+        with torch.inference_mode():
+            logits = self.model(batch.to(self.device)).float().cpu()
+        return [Prediction(logits[i], self.class_names) for i in range(logits.shape[0])]
+    
+    def predict(self, source):
+        """
+        Predict disease for one image with a single decode and forward pass
         
         Args:
-            image_path: Path to the image file
+            source: Image path, open binary file handle, PIL image or preprocessed tensor
             
         Returns:
-            dict: Prediction results with class index, class name, confidence, and probabilities
+            Prediction: Lazy accessors for the top class, top-k and full distribution
         """
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        
-        # Load and preprocess image
-        image = Image.open(image_path).convert('RGB')
-        image_tensor = self.transform(image).unsqueeze(0)
-        image_tensor = image_tensor.to(self.device)
-        
-        # Make prediction
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            confidence, predicted_class = torch.max(probabilities, 1)
-        
-        predicted_idx = predicted_class.item()
-        predicted_name = self.class_names[predicted_idx] if predicted_idx < len(self.class_names) else f"Class_{predicted_idx}"
-        
-        return {
-            'predicted_class': predicted_idx,
-            'predicted_name': predicted_name,
-            'confidence': confidence.item(),
-            'all_probabilities': probabilities.cpu().numpy()[0].tolist()
-        }
+        return self.predict_tensor(self._to_tensor(source).unsqueeze(0))[0]
     
-    def predict_batch(self, image_paths):
+    def predict_batch(self, sources, batch_size=64):
         """
-        Predict diseases from multiple images
+        Predict diseases for many images, batch_size images per forward pass
         
         Args:
-            image_paths: List of image file paths
+            sources: List of paths / file handles / PIL images / tensors, or an [N, 3, H, W] tensor
+            batch_size: Images per forward pass
             
         Returns:
-            list: List of prediction results
+            list: One dict per input, in order: predict_image()'s fields plus 'image_path',
+                  or {'image_path', 'error'} for an input that could not be read
+                  (use predict_tensor() for Prediction objects)
         """
-        results = []
-        for image_path in image_paths:
+        if torch.is_tensor(sources):
+            sources = list(sources)
+        
+        # Decode each input on its own so one unreadable file doesn't lose the whole batch
+        results, tensors, positions = [], [], []
+        for i, source in enumerate(sources):
+            image_path = source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', None)
             try:
-                result = self.predict_image(image_path)
-                result['image_path'] = image_path
-                results.append(result)
+                tensors.append(self._to_tensor(source))
+                positions.append(i)
+                results.append({'image_path': image_path})
             except Exception as e:
-                results.append({
-                    'image_path': image_path,
-                    'error': str(e)
-                })
+                results.append({'image_path': image_path, 'error': str(e)})
+        
+        for start in range(0, len(tensors), batch_size):
+            batch = torch.stack(tensors[start:start + batch_size])
+            for i, prediction in zip(positions[start:start + batch_size], self.predict_tensor(batch)):
+                results[i].update(prediction.to_dict())
         return results
     
+    def predict_image(self, image_path):
+        """
+        Predict disease from a single image (dict form of predict())
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            dict: Prediction results with class index, class name, confidence, and probabilities
+        """
+        return self.predict(image_path).to_dict()
+    
     def get_top_k_predictions(self, image_path, k=5):
         """
         Get top K predictions for an image
         
+        Prefer predict(path).top_k(k) when the top prediction is needed as well,
+        so the image is only decoded and run through the model once.
+        
         Args:
             image_path: Path to the image file
             k: Number of top predictions to return
@@ -160,31 +204,64 @@ class DiseaseDetectionModel:
         Returns:
             list: Top K predictions with class indices, names, and confidences
         """
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        
-        # Load and preprocess image
-        image = Image.open(image_path).convert('RGB')
-        image_tensor = self.transform(image).unsqueeze(0)
-        image_tensor = image_tensor.to(self.device)
-        
-        # Make prediction
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            top_probs, top_indices = torch.topk(probabilities, k)
-        
-        top_predictions = []
-        for i in range(k):
-            class_idx = top_indices[0][i].item()
-            class_name = self.class_names[class_idx] if class_idx < len(self.class_names) else f"Class_{class_idx}"
-            top_predictions.append({
-                'class_index': class_idx,
-                'class_name': class_name,
-                'confidence': top_probs[0][i].item()
-            })
-        
-        return top_predictions
+        return self.predict(image_path).top_k(k)
+
+
+class Prediction:
+    """
+    Result for one image, backed by a single row of logits
+    
+    Softmax, top-k and the Python list of probabilities are computed only when
+    asked for, and the softmax at most once.
+    """
+    
+    def __init__(self, logits, class_names):
+        self.logits = logits
+        self.class_names = class_names
+        self._probabilities = None
+    
+    def _name(self, idx):
+        return self.class_names[idx] if idx < len(self.class_names) else f"Class_{idx}"
+    
+    @property
+    def probabilities(self):
+        """Softmax over the logits (tensor), computed on first access"""
+        if self._probabilities is None:
+            self._probabilities = torch.softmax(self.logits, dim=0)
+        return self._probabilities
+    
+    @property
+    def class_index(self):
+        return int(self.logits.argmax())
+    
+    @property
+    def class_name(self):
+        return self._name(self.class_index)
+    
+    @property
+    def confidence(self):
+        return float(self.probabilities[self.class_index])
+    
+    def top_k(self, k=5):
+        """Top K classes as [{'class_index', 'class_name', 'confidence'}, ...]"""
+        top_probs, top_indices = torch.topk(self.probabilities, min(k, self.probabilities.numel()))
+        return [
+            {'class_index': idx, 'class_name': self._name(idx), 'confidence': prob}
+            for idx, prob in zip(top_indices.tolist(), top_probs.tolist())
+        ]
+    
+    def distribution(self):
+        """Full probability distribution as a Python list"""
+        return self.probabilities.tolist()
+    
+    def to_dict(self):
+        """Same shape as the dicts predict_image() has always returned"""
+        return {
+            'predicted_class': self.class_index,
+            'predicted_name': self.class_name,
+            'confidence': self.confidence,
+            'all_probabilities': self.distribution()
+        }
 
 
 def main():
@@ -236,16 +313,16 @@ def main():
             print(f"\n🔍 Analyzing image: {os.path.basename(image_path)}")
             print("=" * 60)
             
-            # Get prediction
-            result = detector.predict_image(image_path)
+            # Get prediction (one decode and forward pass serves everything below)
+            result = detector.predict(image_path)
             
             print(f"\n✅ PREDICTION RESULT:")
-            print(f"   Disease Detected: {result['predicted_name']}")
-            print(f"   Confidence: {result['confidence']:.4f} ({result['confidence']*100:.2f}%)")
-            print(f"   Class Index: {result['predicted_class']}")
+            print(f"   Disease Detected: {result.class_name}")
+            print(f"   Confidence: {result.confidence:.4f} ({result.confidence*100:.2f}%)")
+            print(f"   Class Index: {result.class_index}")
             
             # Show confidence level
-            confidence_pct = result['confidence'] * 100
+            confidence_pct = result.confidence * 100
             if confidence_pct >= 90:
                 confidence_level = "🟢 Very High"
             elif confidence_pct >= 75:
@@ -258,7 +335,7 @@ def main():
             
             # Get top 5 predictions
             print(f"\n📊 Top 5 Possible Diagnoses:")
-            top_predictions = detector.get_top_k_predictions(image_path, k=5)
+            top_predictions = result.top_k(5)
             for i, pred in enumerate(top_predictions, 1):
                 bar_length = int(pred['confidence'] * 40)
                 bar = "█" * bar_length + "░" * (40 - bar_length)
@@ -0,0 +1,211 @@
+"""
+CPU threading layout for the serving workers
+Splits the machine's cores between gunicorn workers so each worker's intra-op pool only
+uses its share, instead of every worker assuming it owns every core.
+
+Environment overrides:
+    WEB_CONCURRENCY        gunicorn workers (default 2)
+    GUNICORN_THREADS       request threads per worker
+    TORCH_INTRA_THREADS    intra-op threads per worker
+    TORCH_INTEROP_THREADS  inter-op threads per worker
+    PIN_WORKERS            "1" pins each worker to its own disjoint set of cores
+
+Auto-tune: python threading_config.py --tune [--workers 2] [--seconds 5]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Filled in by configure_torch_threads(); reported on /health
+EFFECTIVE_SETTINGS = {}
+
+
+def available_cores():
+    """Cores this process may run on (respects affinity masks and container cpusets)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_threads(num_cores, num_workers):
+    """Default intra-op / inter-op / request thread counts for one worker"""
+    cores_per_worker = max(1, num_cores // max(1, num_workers))
+    return {
+        'cores_per_worker': cores_per_worker,
+        'intra_op_threads': cores_per_worker,
+        # MobileNetV2 is a single chain of ops, so a second inter-op thread only adds contention
+        'inter_op_threads': 1,
+        # Request threads mostly wait on downloads and decode; two per core keeps the model busy
+        'request_threads': min(8, max(2, 2 * cores_per_worker)),
+    }
+
+
+def worker_core_set(cores, slot, num_workers):
+    """Disjoint, contiguous slice of cores for worker `slot`"""
+    if num_workers >= len(cores):
+        return [cores[slot % len(cores)]]
+    per_worker = len(cores) // num_workers
+    return cores[slot * per_worker:(slot + 1) * per_worker]
+
+
+def configure_torch_threads():
+    """Apply the thread plan to torch in this worker; call once, before the first inference"""
+    import torch
+
+    cores = available_cores()
+    pinned = os.getenv('AGROLENS_PINNED') == '1'
+    # A pinned worker's affinity mask already is its share of the machine
+    num_workers = 1 if pinned else int(os.getenv('AGROLENS_NUM_WORKERS', os.getenv('WEB_CONCURRENCY', '1')))
+    plan = plan_threads(len(cores), num_workers)
+
+    intra = int(os.getenv('TORCH_INTRA_THREADS', plan['intra_op_threads']))
+    interop = int(os.getenv('TORCH_INTEROP_THREADS', plan['inter_op_threads']))
+
+    torch.set_num_threads(intra)
+    try:
+        torch.set_num_interop_threads(interop)
+    except RuntimeError as e:
+        # Only allowed before any inter-op work has run in this process
+        logger.warning(f"Could not set inter-op threads: {e}")
+
+    EFFECTIVE_SETTINGS.clear()
+    EFFECTIVE_SETTINGS.update({
+        'cores_visible': len(cores),
+        'num_workers': int(os.getenv('AGROLENS_NUM_WORKERS', os.getenv('WEB_CONCURRENCY', '1'))),
+        'worker_slot': int(os.getenv('AGROLENS_WORKER_INDEX', '0')),
+        'pinned_cores': cores if pinned else None,
+        'intra_op_threads': torch.get_num_threads(),
+        'inter_op_threads': torch.get_num_interop_threads(),
+        'request_threads': int(os.getenv('GUNICORN_THREADS', plan['request_threads'])),
+    })
+    logger.info(f"Threading: {EFFECTIVE_SETTINGS}")
+    return EFFECTIVE_SETTINGS
+
+
+# ================================
+# Auto-tune
+# ================================
+def _benchmark_worker(intra, interop, request_threads, seconds, num_classes, results):
+    """One simulated gunicorn worker: request_threads threads doing batch-1 forward passes"""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    torch.set_num_threads(intra)
+    torch.set_num_interop_threads(interop)
+
+    model = models.mobilenet_v2(weights=None)
+    model.classifier[1] = nn.Linear(model.last_channel, num_classes)
+    model.eval()
+    x = torch.randn(1, 3, 224, 224)
+    with torch.inference_mode():
+        for _ in range(3):
+            model(x)
+
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop():
+        local = []
+        with torch.inference_mode():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                model(x)
+                local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=loop) for _ in range(request_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put(latencies)
+
+
+def benchmark(intra, interop, request_threads, num_workers, seconds, num_classes=97):
+    """Run num_workers simulated workers concurrently; returns throughput and latency stats"""
+    import multiprocessing as mp
+
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_benchmark_worker,
+                    args=(intra, interop, request_threads, seconds, num_classes, results))
+        for _ in range(num_workers)
+    ]
+    for p in procs:
+        p.start()
+    latencies = sorted(l for _ in procs for l in results.get())
+    for p in procs:
+        p.join()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        'intra_op_threads': intra,
+        'inter_op_threads': interop,
+        'request_threads': request_threads,
+        'images_per_sec': len(latencies) / seconds,
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+    }
+
+
+def tune(num_workers, seconds, num_classes=97):
+    """Sweep thread settings for num_workers workers; returns results best-first"""
+    cores = available_cores()
+    plan = plan_threads(len(cores), num_workers)
+    per_worker = plan['cores_per_worker']
+    intra_options = sorted({1, 2, 4, per_worker, len(cores)} & set(range(1, len(cores) + 1)))
+
+    results = []
+    for intra in intra_options:
+        for interop in (1, 2):
+            for request_threads in sorted({1, 2, 4, plan['request_threads']}):
+                result = benchmark(intra, interop, request_threads, num_workers, seconds, num_classes)
+                print(f"  intra={intra:<3} interop={interop} threads={request_threads:<2} "
+                      f"{result['images_per_sec']:7.1f} img/s  p50 {result['p50_ms']:6.1f} ms  "
+                      f"p99 {result['p99_ms']:6.1f} ms")
+                results.append(result)
+    return sorted(results, key=lambda r: r['images_per_sec'], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or auto-tune the per-worker threading plan")
+    parser.add_argument('--tune', action='store_true', help="benchmark a sweep of thread settings")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', 2)))
+    parser.add_argument('--seconds', type=float, default=5.0, help="benchmark time per setting")
+    parser.add_argument('--num-classes', type=int, default=97)
+    args = parser.parse_args()
+
+    cores = available_cores()
+    plan = plan_threads(len(cores), args.workers)
+    print(f"\n{'='*60}")
+    print(f"Threading plan: {len(cores)} cores, {args.workers} workers")
+    print(f"{'='*60}")
+    print(json.dumps(plan, indent=2))
+
+    if args.tune:
+        print(f"\nSweeping settings ({args.seconds:.0f}s each)...")
+        results = tune(args.workers, args.seconds, args.num_classes)
+        best = results[0]
+        print(f"\n✅ Best throughput: {best['images_per_sec']:.1f} images/sec")
+        print(f"   TORCH_INTRA_THREADS={best['intra_op_threads']} "
+              f"TORCH_INTEROP_THREADS={best['inter_op_threads']} "
+              f"GUNICORN_THREADS={best['request_threads']}")
+        print(f"{'='*60}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
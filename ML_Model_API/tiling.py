@@ -0,0 +1,133 @@
+"""
+Tiled multi-region inference for high-resolution field images
+Instead of squashing a whole field shot to 224x224, the image is cut into overlapping
+tiles at native resolution, each resized to the model input on its own. Tiles that are
+mostly background (flat sky, bare soil, blur) are dropped using a cheap filter on a
+thumbnail. The survivors go through the model as one batch.
+
+Filter, per tile, on a thumbnail where every tile is about FILTER_TILE_PIXELS wide:
+    texture     standard deviation of luma (0-255); flat tiles are dropped
+    vegetation  fraction of pixels with excess green (2G - R - B) above GREEN_EXCESS
+Diseased tissue is often brown or yellow, so the vegetation bar is low. It only has to
+reject tiles that contain no plant at all.
+
+Environment:
+    TILE_SIZE       tile side in native pixels (default 512)
+    TILE_OVERLAP    fraction of a tile shared with its neighbour (default 0.25)
+    MAX_TILES       largest batch per image; tiles grow to keep the grid within it (default 8)
+    TILE_MIN_STD    minimum luma standard deviation (default 8)
+    TILE_MIN_GREEN  minimum vegetation fraction (default 0.05)
+"""
+import os
+import math
+import numpy as np
+import torch
+from PIL import Image
+
+TILE_SIZE = int(os.getenv('TILE_SIZE', 512))
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', 0.25))
+MAX_TILES = int(os.getenv('MAX_TILES', 8))
+TILE_MIN_STD = float(os.getenv('TILE_MIN_STD', 8.0))
+TILE_MIN_GREEN = float(os.getenv('TILE_MIN_GREEN', 0.05))
+GREEN_EXCESS = 20
+FILTER_TILE_PIXELS = 32
+
+
+def _axis_starts(length, tile, stride):
+    """Tile offsets along one axis; the last tile is flush with the edge"""
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / stride) + 1
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def plan_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """Overlapping square tile boxes (left, top, right, bottom) covering the image"""
+    tile = min(tile_size, width, height)
+    while True:
+        stride = max(1, int(tile * (1.0 - overlap)))
+        xs, ys = _axis_starts(width, tile, stride), _axis_starts(height, tile, stride)
+        if len(xs) * len(ys) <= max_tiles or tile >= min(width, height):
+            break
+        tile = min(int(tile * 1.25) + 1, width, height)
+    return [(x, y, x + tile, y + tile) for y in ys for x in xs]
+
+
+def open_tiled(fp, input_size, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """
+    Decode an upload for tiling; returns (RGB image, boxes in original pixels, decode scale)
+    Every tile is downsampled to input_size anyway, so JPEGs are decoded at the smallest
+    DCT scale (1/2, 1/4, 1/8) that still leaves each tile at least input_size wide.
+    """
+    image = Image.open(fp)
+    width, height = image.size
+    boxes = plan_tiles(width, height, tile_size, overlap, max_tiles)
+    tile = boxes[0][2] - boxes[0][0]
+    if image.format == 'JPEG' and tile > input_size:
+        image.draft('RGB', (math.ceil(width * input_size / tile), math.ceil(height * input_size / tile)))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image, boxes, image.width / width
+
+
+def scale_boxes(boxes, scale):
+    """Boxes in decoded-image pixels (fractional; PIL resamples sub-pixel boxes exactly)"""
+    return [tuple(v * scale for v in box) for box in boxes]
+
+
+def tile_scores(image, boxes):
+    """(luma std, vegetation fraction) per box, from one small thumbnail of the whole image"""
+    tile = boxes[0][2] - boxes[0][0]
+    scale = min(1.0, FILTER_TILE_PIXELS / tile)
+    thumb_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    pixels = np.asarray(image.resize(thumb_size, Image.BILINEAR, reducing_gap=2.0), dtype=np.int16)
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    luma = 0.299 * red + 0.587 * green + 0.114 * blue
+    vegetation = (2 * green - red - blue) > GREEN_EXCESS
+
+    scores = []
+    for left, top, right, bottom in boxes:
+        rows = slice(int(top * scale), max(int(top * scale) + 1, int(bottom * scale)))
+        cols = slice(int(left * scale), max(int(left * scale) + 1, int(right * scale)))
+        scores.append((float(luma[rows, cols].std()), float(vegetation[rows, cols].mean())))
+    return scores
+
+
+def select_tiles(image, boxes, min_std=TILE_MIN_STD, min_green=TILE_MIN_GREEN):
+    """Indices of the boxes that pass the texture and vegetation filter; never empty"""
+    scores = tile_scores(image, boxes)
+    kept = [i for i, (std, green) in enumerate(scores) if std >= min_std and green >= min_green]
+    if not kept:
+        # Nothing looks like a plant; classify the most textured tile rather than nothing
+        kept = [max(range(len(boxes)), key=lambda i: scores[i][0])]
+    return kept
+
+
+def crop_tiles(image, boxes, size, to_tensor):
+    """Batch [N, 3, H, W]: each box cropped and resized in one step (no full-image copy)"""
+    return torch.stack([
+        to_tensor(image.resize(size, Image.BILINEAR, box=box, reducing_gap=3.0))
+        for box in boxes
+    ])
+
+
+def aggregate(probabilities):
+    """
+    Image-level class distribution from per-tile probabilities [N, C]
+    Tiles are weighted by their own confidence, so a tile with a clear lesion outweighs
+    ambiguous ones (edges, stems, out-of-focus leaves)
+    """
+    weights = probabilities.max(dim=1).values
+    return (probabilities * weights[:, None]).sum(dim=0) / weights.sum()
+
+
+def detections(probabilities, class_names):
+    """Classes that are the top prediction of at least one tile, with tile counts, most confident first"""
+    confidences, indices = probabilities.max(dim=1)
+    found = {}
+    for index, confidence in zip(indices.tolist(), confidences.tolist()):
+        entry = found.setdefault(index, {'class': class_names[index], 'class_index': index,
+                                         'tiles': 0, 'max_confidence': 0.0})
+        entry['tiles'] += 1
+        entry['max_confidence'] = max(entry['max_confidence'], confidence)
+    return sorted(found.values(), key=lambda d: d['max_confidence'], reverse=True)
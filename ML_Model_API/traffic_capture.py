@@ -0,0 +1,279 @@
+"""
+Opt-in capture of production traffic for deterministic replay (see replay.py)
+Every inference request is written as one JSON line: arrival time, endpoint, query, how
+the image arrived (url / base64 / binary / file), its lane, a pseudonymous tenant, status
+and server latency. URLs, API keys, filenames and client addresses are never written.
+The image itself goes into a content-addressed payload store, so a popular image is
+stored once however often it is sent.
+
+Captured images are NOT anonymised: they are the photos users sent. Metadata is removed
+before an image is written: EXIF (including GPS), XMP, IPTC, comments and text chunks.
+JPEG, PNG and WebP are stripped without re-encoding, so replays decode the same pixels.
+Other formats are re-encoded to PNG. The trace's 'payload' digest and 'bytes' still
+describe the original upload.
+
+Layout: <CAPTURE_DIR>/trace-<start_ts>-<pid>.jsonl   (one file per gunicorn worker)
+        <CAPTURE_DIR>/payloads/<ab>/<blake2b hex>    (image bytes, written once)
+        <CAPTURE_DIR>/salt                           (keys the tenant pseudonyms)
+
+Environment:
+    CAPTURE_DIR          enables capture when set
+    CAPTURE_SAMPLE_RATE  fraction of requests captured (default 1.0)
+"""
+import os
+import json
+import time
+import queue
+import random
+import struct
+import atexit
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_DIR = os.getenv('CAPTURE_DIR')
+CAPTURE_SAMPLE_RATE = float(os.getenv('CAPTURE_SAMPLE_RATE', 1.0))
+QUEUE_SIZE = 1000
+PAYLOAD_DIR = 'payloads'
+TRACE_PREFIX = 'trace-'
+# Query parameters that change the work a request does; anything else is dropped
+QUERY_KEYS = ('similar', 'tiled', 'k', 'explain', 'explain_format', 'format')
+# Payload digests remembered per worker to skip copying repeats; older ones fall back to the disk check
+STORED_CACHE_SIZE = 65536
+
+# JPEG segments that can carry metadata: APP1 (EXIF, XMP), APP3-APP15 (IPTC is APP13), COM.
+# APP0 (JFIF) and APP2 (ICC profile) affect decoding and are kept.
+_JPEG_METADATA = {0xE1, 0xFE} | set(range(0xE3, 0xF0))
+_PNG_METADATA = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+_WEBP_METADATA = {b'EXIF', b'XMP '}
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def payload_path(capture_dir, digest):
+    return os.path.join(capture_dir, PAYLOAD_DIR, digest[:2], digest)
+
+
+# ================================
+# Metadata removal
+# ================================
+def _strip_jpeg(data):
+    out = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:  # Start of scan: entropy-coded data follows, no more headers
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker not in _JPEG_METADATA:
+            out.append(data[pos:pos + 2 + length])
+        pos += 2 + length
+    out.append(data[pos:])
+    return b''.join(out)
+
+
+def _strip_png(data):
+    out = [data[:8]]
+    pos = 8
+    while pos + 8 <= len(data):
+        length = struct.unpack('>I', data[pos:pos + 4])[0]
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type not in _PNG_METADATA:
+            out.append(data[pos:end])
+        pos = end
+    return b''.join(out)
+
+
+def _strip_webp(data):
+    out = []
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        length = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        end = pos + 8 + length + (length & 1)
+        if fourcc == b'VP8X':
+            chunk = bytearray(data[pos:end])
+            chunk[8] &= ~0x0C  # Clear the EXIF and XMP flags
+            out.append(bytes(chunk))
+        elif fourcc not in _WEBP_METADATA:
+            out.append(data[pos:end])
+        pos = end
+    body = b'WEBP' + b''.join(out)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def _reencode(data):
+    """Lossless PNG of the pixels; PIL writes no EXIF or text chunks unless asked to"""
+    import io
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ('1', 'L', 'LA', 'I', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+def strip_metadata(data):
+    """Image bytes without EXIF/GPS, XMP, IPTC, comments or text chunks"""
+    data = bytes(data)
+    if data[:3] == b'\xff\xd8\xff':
+        return _strip_jpeg(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return _strip_png(data)
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _strip_webp(data)
+    return _reencode(data)
+
+
+def _load_salt(capture_dir):
+    """Per-capture salt shared by all workers, so one tenant maps to one pseudonym"""
+    path = os.path.join(capture_dir, 'salt')
+    try:
+        with open(path, 'x', encoding='ascii') as f:
+            f.write(secrets.token_hex(16))
+    except FileExistsError:
+        pass
+    with open(path, encoding='ascii') as f:
+        return bytes.fromhex(f.read().strip())
+
+
+class TrafficCapture:
+    """Background writer of trace lines and payloads; record() never blocks the request thread"""
+
+    def __init__(self, capture_dir=CAPTURE_DIR, sample_rate=CAPTURE_SAMPLE_RATE):
+        self.capture_dir = capture_dir
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.recorded = 0
+        os.makedirs(os.path.join(capture_dir, PAYLOAD_DIR), exist_ok=True)
+        self._salt = _load_salt(capture_dir)
+        self._stored = OrderedDict()  # Recently stored payload digests (LRU of STORED_CACHE_SIZE)
+        self._stored_lock = threading.Lock()
+        self._trace_path = os.path.join(capture_dir, f"{TRACE_PREFIX}{int(time.time() * 1000)}-{os.getpid()}.jsonl")
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def sampled(self):
+        """Decide at arrival whether this request is captured"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def tenant_pseudonym(self, tenant):
+        if not tenant or tenant == 'anonymous':
+            return None
+        return hashlib.blake2b(tenant.encode(), key=self._salt, digest_size=8).hexdigest()
+
+    def record(self, arrival, endpoint, query, source, content_type, payload, lane, tenant,
+               status, latency_ms):
+        """Queue one request; payload is the decoded image (bytes-like) or None"""
+        entry = {
+            't': arrival,
+            'endpoint': endpoint,
+            'query': {k: v for k, v in query.items() if k in QUERY_KEYS},
+            'source': source,
+            'content_type': content_type,
+            'payload': None,
+            'bytes': 0,
+            'lane': lane,
+            'tenant': self.tenant_pseudonym(tenant),
+            'status': status,
+            'latency_ms': round(latency_ms, 3),
+        }
+        data = None
+        if payload is not None:
+            entry['payload'] = content_hash(payload)
+            entry['bytes'] = len(payload)
+            with self._stored_lock:
+                seen = entry['payload'] in self._stored
+                if seen:
+                    self._stored.move_to_end(entry['payload'])
+            if not seen:
+                # Request buffers are reused once the response is sent; copy new images only
+                data = bytes(payload)
+        try:
+            self._queue.put_nowait((entry, data))
+        except queue.Full:
+            self.dropped += 1  # A gap in the trace beats stalling a request
+
+    def stats(self):
+        return {'trace': self._trace_path, 'recorded': self.recorded, 'dropped': self.dropped,
+                'sample_rate': self.sample_rate}
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=30)
+
+    def _run(self):
+        with open(self._trace_path, 'a', encoding='utf-8') as trace:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                entry, data = item
+                try:
+                    if data is not None and self._store_payload(entry['payload'], data):
+                        self._remember(entry['payload'])
+                    if entry['payload'] and not os.path.exists(payload_path(self.capture_dir, entry['payload'])):
+                        # Not stored (e.g. unparseable): not replayable, like a request without an image
+                        entry['payload'] = None
+                    trace.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                    trace.flush()
+                    self.recorded += 1
+                except Exception as e:
+                    logger.error(f"Traffic capture write failed: {e}")
+
+    def _remember(self, digest):
+        """Mark a payload as on disk, so later repeats skip the copy (writer thread only)"""
+        with self._stored_lock:
+            self._stored[digest] = None
+            self._stored.move_to_end(digest)
+            if len(self._stored) > STORED_CACHE_SIZE:
+                self._stored.popitem(last=False)
+
+    def _store_payload(self, digest, data):
+        """Write one payload with its metadata removed; False if it could not be cleaned"""
+        path = payload_path(self.capture_dir, digest)
+        if os.path.exists(path):
+            return True  # Another worker (or an earlier run) already has it
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            data = strip_metadata(data)
+        except Exception as e:
+            # Never write an image whose metadata might still be in it
+            logger.warning(f"Could not strip metadata from payload {digest}, not storing it: {e}")
+            return False
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+
+# ================================
+# Reading a capture
+# ================================
+def load_trace(capture_dir):
+    """All captured requests from every worker's trace file, in arrival order"""
+    entries = []
+    for name in sorted(os.listdir(capture_dir)):
+        if name.startswith(TRACE_PREFIX) and name.endswith('.jsonl'):
+            with open(os.path.join(capture_dir, name), encoding='utf-8') as f:
+                entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda e: e['t'])
+    return entries
+
+
+def read_payload(capture_dir, digest):
+    with open(payload_path(capture_dir, digest), 'rb') as f:
+        return f.read()